@@ -11,6 +11,13 @@ particular, we do this to supplement the DAR clusters with tornadocash
 address clusters. We optimize for programming ease and not efficiency:
 this script will wipe all non-rows from the db and re-populate each run,
 even though most of the rows will remain identical.
+
+With --incremental, clusters are kept in a persistent union-find (see
+src/cluster/unionfind.py) that only ingests the day's edges. Cluster ids
+are union-find roots plus `CLUSTER_OFFSET`, so they are consistent across
+days and never collide with the networkx cluster ids already in the db,
+and only the addresses whose cluster id changed (new ones and the members
+of absorbed clusters) are rewritten in the db.
 """
 
 import os
@@ -26,8 +33,13 @@ from typing import List, Any, Tuple, Set, Dict
 from live import utils
 from src.utils.loader import DataframeLoader
 from src.cluster.deposit import DepositCluster
+from src.cluster.unionfind import DiskUnionFind
 from src.utils.utils import from_json
 
+# union-find cluster ids start here, above any id enumerated by networkx
+# runs, and stay within the integer cluster columns of the address table
+CLUSTER_OFFSET: int = 2**30
+
 # ---
 # begin metadata utilities
 # --
@@ -95,6 +107,117 @@ def cluster_graph(
     return user_wccs, exchange_wccs
 
 
+def cluster_incremental(
+    data: pd.DataFrame,
+    tcash_address_list: List[List[Set[str]]],
+    unionfind_path: str,
+    bootstrap_data: pd.DataFrame = None,
+) -> Tuple[DiskUnionFind, DiskUnionFind, np.array, np.array]:
+    """
+    Incremental alternative to `cluster_graph`: feed only new edges to the
+    persistent user and exchange union-finds. Returns both union-finds
+    and the ids whose cluster changed in each, including those still
+    pending from runs whose changes never reached the db (see
+    `clear_pending`).
+
+    @bootstrap_data: (pd.DataFrame) full history of (user, deposit, exchange)
+        rows, only used when the union-finds do not exist yet.
+    """
+    user_path: str = join(unionfind_path, 'user')
+    exchange_path: str = join(unionfind_path, 'exchange')
+    is_new: bool = not os.path.isdir(user_path)
+
+    user_uf: DiskUnionFind = DiskUnionFind(user_path)
+    exchange_uf: DiskUnionFind = DiskUnionFind(exchange_path)
+
+    if is_new and bootstrap_data is not None:
+        data: pd.DataFrame = pd.concat([bootstrap_data, data])
+
+    # one ingest per union-find, so the day's new addresses are saved once
+    user_a: List[str] = data.user.tolist()
+    user_b: List[str] = data.deposit.tolist()
+    for address_set in tcash_address_list:
+        for cluster in address_set:
+            assert len(cluster) == 2, "Only supports edges with two nodes."
+        user_a.extend([list(cluster)[0] for cluster in address_set])
+        user_b.extend([list(cluster)[1] for cluster in address_set])
+
+    changed_users: np.array = user_uf.union_edges(
+        user_a, user_b, pending_file = get_pending_file(unionfind_path, 'user'))
+    changed_exchanges: np.array = exchange_uf.union_edges(
+        data.deposit, data.exchange, pending_file = get_pending_file(unionfind_path, 'exchange'))
+
+    return user_uf, exchange_uf, changed_users, changed_exchanges
+
+
+def get_pending_file(unionfind_path: str, name: str) -> str:
+    return join(unionfind_path, f'{name}-pending.npy')
+
+
+def clear_pending(unionfind_path: str, update_files: List[str]):
+    """
+    Forget the pending changes once the db has them.
+    """
+    paths: List[str] = update_files + [
+        get_pending_file(unionfind_path, name) for name in ['user', 'exchange']]
+    for path in paths:
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def get_cluster_updates(uf: DiskUnionFind, ids: np.array) -> pd.DataFrame:
+    """
+    (address, cluster) rows for the ids whose cluster changed.
+    """
+    return pd.DataFrame({
+        'address': uf.index.decode(ids),
+        'cluster': uf.roots(ids) + CLUSTER_OFFSET,
+    })
+
+
+def add_incremental_clusters_to_metadata(
+    metadata: pd.DataFrame,
+    user_uf: DiskUnionFind,
+    exchange_uf: DiskUnionFind,
+) -> pd.DataFrame:
+    """
+    Same as `add_clusters_to_metadata` but cluster ids are union-find
+    roots (plus `CLUSTER_OFFSET`).
+    """
+    for field_name, uf in [('user_cluster', user_uf), ('exchange_cluster', exchange_uf)]:
+        ids: np.array = uf.encode(metadata.address)
+        clusters: pd.Series = pd.Series(pd.NA, index=metadata.index, dtype=pd.Int64Dtype())
+        clusters[ids >= 0] = uf.roots(ids[ids >= 0]) + CLUSTER_OFFSET
+        metadata[field_name] = clusters
+
+    return metadata
+
+
+def update_changed_clusters(
+    update_file: str,
+    field_name: str = 'user_cluster',
+):
+    """
+    Rewrite `field_name` for the addresses whose cluster changed only.
+    `update_file` is a csv of (address, cluster) rows.
+    """
+    import psycopg2
+
+    conn: Any = psycopg2.connect(
+        database = utils.CONSTANTS['postgres_db'], 
+        user = utils.CONSTANTS['postgres_user'])
+    cursor: Any = conn.cursor()
+
+    cursor.execute("create temp table cluster_update (address varchar(128), cluster bigint)")
+    cursor.execute(f"COPY cluster_update(address,cluster) FROM '{update_file}' DELIMITER ',' CSV HEADER;")
+    cursor.execute(f"update address set {field_name} = cluster_update.cluster from cluster_update "
+                   f"where address.address = cluster_update.address")
+    conn.commit()
+
+    cursor.close()
+    conn.close()
+
+
 def add_to_user_graph(graph: nx.DiGraph, clusters: List[Set[str]]):
     for cluster in clusters:
         assert len(cluster) == 2, "Only supports edges with two nodes."
@@ -423,29 +546,60 @@ def main(args: Any):
                 address_set: List[Set[str]] = from_json(address_file)
                 tcash_address_list.append(address_set)
 
-        logger.info('clustering with networkx')
-        if args.debug:
-            user_clusters, exchange_clusters = cluster_graph(
-                data, tcash_address_list)
+        if args.incremental:
+            logger.info('clustering with union-find')
+            bootstrap_data: pd.DataFrame = None
+            if args.bootstrap_csv is not None:
+                bootstrap_data: pd.DataFrame = prune_data(pd.read_csv(args.bootstrap_csv))
+            unionfind_path: str = join(proc_path, 'unionfind')
+            if args.debug:
+                user_uf, exchange_uf, changed_users, changed_exchanges = \
+                    cluster_incremental(data, tcash_address_list, unionfind_path, bootstrap_data)
+            else:
+                try:
+                    user_uf, exchange_uf, changed_users, changed_exchanges = \
+                        cluster_incremental(data, tcash_address_list, unionfind_path, bootstrap_data)
+                except:
+                    logger.error('failed in cluster_incremental()')
+                    sys.exit(0)
+            logger.info(f'{len(changed_users)} user and '
+                        f'{len(changed_exchanges)} exchange addresses changed cluster')
+
+            # addresses that changed cluster (pending ones included), applied to
+            # the db below. rewritten whole on every run until then
+            for name, uf, changed in [('user', user_uf, changed_users),
+                                      ('exchange', exchange_uf, changed_exchanges)]:
+                update_file: str = join(proc_path, f'{name}-cluster-updates.csv')
+                get_cluster_updates(uf, changed).to_csv(f'{update_file}.tmp', index=False)
+                os.replace(f'{update_file}.tmp', update_file)
+
+            logger.info('adding clusters into metadata')
+            metadata: pd.DataFrame = add_incremental_clusters_to_metadata(
+                metadata, user_uf, exchange_uf)
         else:
-            try:
+            logger.info('clustering with networkx')
+            if args.debug:
                 user_clusters, exchange_clusters = cluster_graph(
                     data, tcash_address_list)
-            except:
-                logger.error('failed in cluster_graph()')
-                sys.exit(0)
+            else:
+                try:
+                    user_clusters, exchange_clusters = cluster_graph(
+                        data, tcash_address_list)
+                except:
+                    logger.error('failed in cluster_graph()')
+                    sys.exit(0)
 
-        logger.info('adding clusters into metadata')
-        if args.debug:
-            metadata: pd.DataFrame = add_clusters_to_metadata(
-                metadata, user_clusters, exchange_clusters)
-        else:
-            try:
+            logger.info('adding clusters into metadata')
+            if args.debug:
                 metadata: pd.DataFrame = add_clusters_to_metadata(
                     metadata, user_clusters, exchange_clusters)
-            except:
-                logger.error('failed in add_clusters_to_metadata()')
-                sys.exit(0)
+            else:
+                try:
+                    metadata: pd.DataFrame = add_clusters_to_metadata(
+                        metadata, user_clusters, exchange_clusters)
+                except:
+                    logger.error('failed in add_clusters_to_metadata()')
+                    sys.exit(0)
 
         # save new metadata to file
         metadata_file: str = join(proc_path, 'metadata.csv')
@@ -467,16 +621,18 @@ def main(args: Any):
         metadata.exchange_cluster = metadata.exchange_cluster.astype(pd.Int64Dtype())
 
         # merge these user_clusters consistently with the existing
-        # clusters such that any address is in only one address
-        logger.info('merging clusters in current metadata with db')
-        if args.debug:
-            metadata: pd.DataFrame = merge_clusters_with_db(metadata, greedy=args.greedy)
-        else:
-            try:
+        # clusters such that any address is in only one address. union-find
+        # roots are already consistent across days.
+        if not args.incremental:
+            logger.info('merging clusters in current metadata with db')
+            if args.debug:
                 metadata: pd.DataFrame = merge_clusters_with_db(metadata, greedy=args.greedy)
-            except:
-                logger.error('failed in merge_clusters_with_db()')
-                sys.exit(0)
+            else:
+                try:
+                    metadata: pd.DataFrame = merge_clusters_with_db(metadata, greedy=args.greedy)
+                except:
+                    logger.error('failed in merge_clusters_with_db()')
+                    sys.exit(0)
 
         merged_file: str = join(proc_path, 'metadata-merged.csv')
         metadata.to_csv(merged_file, index=False)
@@ -532,6 +688,19 @@ def main(args: Any):
         cursor.close()
         conn.close()
 
+        # step 5: re-label older addresses whose cluster changed. the
+        # pending changes are kept until both updates are committed
+        if args.incremental:
+            logger.info('updating changed clusters in db')
+            update_files: List[str] = [
+                join(proc_path, 'user-cluster-updates.csv'),
+                join(proc_path, 'exchange-cluster-updates.csv'),
+            ]
+            if all(os.path.isfile(path) for path in update_files):
+                update_changed_clusters(update_files[0], 'user_cluster')
+                update_changed_clusters(update_files[1], 'exchange_cluster')
+            clear_pending(join(proc_path, 'unionfind'), update_files)
+
 
 if __name__ == "__main__":
     import argparse
@@ -546,6 +715,12 @@ if __name__ == "__main__":
                         help='throw errors / no try-catch (default: False)')
     parser.add_argument('--greedy', action='store_true', default=False,
                         help='do not correct old clusters, just new ones (default: False)')
+    parser.add_argument('--incremental', action='store_true', default=False,
+                        help='cluster with the persistent union-find and only update '
+                             'changed clusters in the db (default: False)')
+    parser.add_argument('--bootstrap-csv', type=str, default=None,
+                        help='full history data.csv to seed the union-find on its '
+                             'first run (default: None)')
     args = parser.parse_args()
 
     main(args)
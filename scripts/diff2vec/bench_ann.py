@@ -0,0 +1,83 @@
+"""
+Latency of the webapp's in-process neighbour search (webapp/app/lib/ann.py)
+for single address queries, as the search route issues them. Prints the
+load time and latency percentiles and, given the float vectors, the
+recall@k of the int8 / FAISS results against exact search.
+"""
+import os
+import time
+import importlib.util
+import numpy as np
+from typing import Any, List
+
+from scripts.diff2vec.eval_ens import nearest_neighbors
+
+
+def load_ann_module() -> Any:
+    # app/__init__.py connects to the database and web3, so load the module by path
+    path: str = os.path.join(
+        os.path.dirname(__file__), '..', '..', 'webapp', 'app', 'lib', 'ann.py')
+    spec: Any = importlib.util.spec_from_file_location('ann', os.path.realpath(path))
+    module: Any = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main(args: Any):
+    ann: Any = load_ann_module()
+
+    start: float = time.perf_counter()
+    index: Any = ann.ANNIndex(args.ann_dir, nprobe = args.nprobe, block_size = args.block_size)
+    print(f'loaded {len(index)} vectors in {time.perf_counter() - start:.3f}s '
+          f'({"faiss" if index.index is not None else "int8 scan"})')
+
+    rng: np.random.Generator = np.random.default_rng(args.seed)
+    embedded: np.array = np.flatnonzero(np.asarray(index.norms) > 0)
+    nodes: np.array = rng.choice(embedded, size=min(args.num_queries, len(embedded)), replace=False)
+    addresses: List[str] = [index.get_address(node) for node in nodes.tolist()]
+
+    index.neighbors(addresses[0], k = args.k)  # warm up
+    latencies: List[float] = []
+    results: List[List[str]] = []
+    for address in addresses:
+        start: float = time.perf_counter()
+        results.append([neighbor for neighbor, _ in index.neighbors(address, k = args.k)])
+        latencies.append(time.perf_counter() - start)
+
+    latencies: np.array = np.array(latencies) * 1000
+    print(f'{len(addresses)} queries, k={args.k}: '
+          f'p50 {np.percentile(latencies, 50):.2f}ms, '
+          f'p95 {np.percentile(latencies, 95):.2f}ms, '
+          f'p99 {np.percentile(latencies, 99):.2f}ms, '
+          f'max {latencies.max():.2f}ms')
+    if args.budget_ms > 0:
+        print(f'{(latencies <= args.budget_ms).mean():.1%} within {args.budget_ms}ms')
+
+    if args.vectors_npy is not None:
+        vectors: np.array = np.load(args.vectors_npy, mmap_mode='r')
+        queries: np.array = np.asarray(vectors[nodes], dtype=np.float32)
+        truth: np.array = nearest_neighbors(vectors, queries, args.k + 1)
+        hits: int = 0
+        for node, found, exact in zip(nodes.tolist(), results, truth):
+            exact: List[str] = [index.get_address(i) for i in exact.tolist() if i != node][:args.k]
+            hits += len(set(found) & set(exact))
+        print(f'recall@{args.k}: {hits / float(args.k * len(addresses)):.3f}')
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument('ann_dir', type=str, help='directory written by make_ann.py')
+    parser.add_argument('--vectors-npy', type=str, default=None,
+                        help='float vectors, to measure recall against exact search (default: None)')
+    parser.add_argument('--k', type=int, default=10, help='neighbours per query (default: 10)')
+    parser.add_argument('--num-queries', type=int, default=1000, help='number of queries (default: 1000)')
+    parser.add_argument('--nprobe', type=int, default=16, help='FAISS inverted lists per query (default: 16)')
+    parser.add_argument('--block-size', type=int, default=2**16,
+                        help='rows per block of the int8 scan (default: 65536)')
+    parser.add_argument('--budget-ms', type=float, default=50,
+                        help='report the fraction of queries within this latency, 0 to skip (default: 50)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default: 42)')
+    args: Any = parser.parse_args()
+
+    main(args)
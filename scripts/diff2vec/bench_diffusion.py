@@ -0,0 +1,61 @@
+"""
+Benchmark Eulerian diffusion on a weighted CSR graph directory (see
+make_csr.py --weight-column): uniform vs. alias-table weighted neighbour
+sampling from the same random source nodes.
+"""
+import time
+import numpy as np
+from typing import Any, List
+
+from src.diff2vec.graph import CSRGraph
+from src.diff2vec.euler import EulerianDiffusion
+
+
+def bench(graph: CSRGraph, nodes: np.array, cover_size: int, weighted: bool, seed: int) -> float:
+    euler: EulerianDiffusion = EulerianDiffusion(
+        graph, [], cover_size, rng = np.random.default_rng(seed), weighted = weighted)
+    start: float = time.perf_counter()
+    for node in nodes.tolist():
+        euler._diffuse(node)
+    return len(nodes) / (time.perf_counter() - start)
+
+
+def main(args: Any):
+    rng: np.random.Generator = np.random.default_rng(args.seed)
+    graph: CSRGraph = CSRGraph.load(args.graph_dir)
+    assert graph.is_weighted(), f'{args.graph_dir} has no alias tables.'
+    nodes: np.array = rng.choice(graph.nodes(), args.num_sources)
+    print(f'{len(graph)} nodes, {args.num_sources} sources, cover size {args.cover_size}')
+
+    # the weighted sampler should favour heavy edges: compare the mean
+    # weight of sampled edges against the mean edge weight
+    euler: EulerianDiffusion = EulerianDiffusion(
+        graph, [], 2, rng = np.random.default_rng(args.seed), weighted = True)
+    sampled: List[float] = []
+    for node in nodes[:1000].tolist():
+        seq: List[int] = euler._diffuse(node)
+        if len(seq) == 0:
+            continue
+        neighbors: np.array = graph.neighbors(node, as_set=False)
+        start: int = int(graph._offsets[node])
+        sampled.append(float(graph._weights[start + np.searchsorted(neighbors, seq[1])]))
+    print(f'mean edge weight: {float(np.mean(graph._weights)):.4f}, '
+          f'mean sampled weight: {float(np.mean(sampled)):.4f}')
+
+    for weighted in [False, True]:
+        rate: float = bench(graph, nodes, args.cover_size, weighted, args.seed)
+        print(f'{"weighted" if weighted else "uniform"}: {rate:.1f} sequences / s')
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument('graph_dir', type=str, help='path to weighted CSR graph directory')
+    parser.add_argument('--num-sources', type=int, default=10000,
+                        help='number of random source nodes (default: 10000)')
+    parser.add_argument('--cover-size', type=int, default=80, 
+                        help='size of subgraph (default: 80)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default: 42)')
+    args: Any = parser.parse_args()
+
+    main(args)
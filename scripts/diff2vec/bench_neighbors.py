@@ -0,0 +1,95 @@
+"""
+Measure the speed / recall tradeoff of an approximate FAISS index (see
+get_neighbors.py) against exact search, on a random sample of queries.
+Recall@k is the fraction of the exact k nearest neighbours found.
+"""
+import os
+import time
+import faiss
+import numpy as np
+from typing import Any, List
+
+from src.diff2vec.neighbors import build_index, recall_at_k, search, set_nprobe
+
+
+def exact_neighbors(vectors: np.array, queries: np.array, k: int, block_size: int = 2**20) -> np.array:
+    """
+    Exact k nearest rows of `vectors` for each query, merging the results
+    of one flat index per block so `vectors` never has to fit in memory.
+    """
+    best_distances: np.array = np.full((len(queries), k), np.inf, dtype=np.float32)
+    best_neighbors: np.array = np.full((len(queries), k), -1, dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        block: np.array = np.ascontiguousarray(vectors[start:start + block_size], dtype=np.float32)
+        flat: faiss.IndexFlatL2 = faiss.IndexFlatL2(block.shape[1])
+        flat.add(block)
+        D, I = flat.search(queries, min(k, len(block)))
+        distances: np.array = np.concatenate([best_distances, D], axis=1)
+        neighbors: np.array = np.concatenate([best_neighbors, I + start], axis=1)
+        order: np.array = np.argsort(distances, axis=1)[:, :k]
+        best_distances: np.array = np.take_along_axis(distances, order, axis=1)
+        best_neighbors: np.array = np.take_along_axis(neighbors, order, axis=1)
+    return best_neighbors
+
+
+def main(args: Any):
+    vectors: np.array = np.load(args.vectors_npy, mmap_mode='r')
+    if args.threads > 0:
+        faiss.omp_set_num_threads(args.threads)
+
+    rng: np.random.Generator = np.random.default_rng(args.seed)
+    sample: np.array = np.sort(rng.choice(len(vectors), min(args.num_queries, len(vectors)), replace=False))
+    queries: np.array = np.ascontiguousarray(vectors[sample], dtype=np.float32)
+
+    print('exact search...', end=' ', flush=True)
+    start: float = time.perf_counter()
+    truth: np.array = exact_neighbors(vectors, queries, args.k)
+    print(f'{len(queries) / (time.perf_counter() - start):.1f} queries / s')
+
+    if args.index_file is None:
+        index: faiss.Index = build_index(
+            vectors, index_type = args.index_type, nlist = args.nlist, m = args.m, nbits = args.nbits,
+            train_size = args.train_size, seed = args.seed)
+    else:
+        index: faiss.Index = faiss.read_index(args.index_file)
+    code_size: int = len(faiss.serialize_index(index)) if args.index_file is None \
+        else os.path.getsize(args.index_file)
+    print(f'index: {index.ntotal} vectors, {code_size / 2**20:.1f} MiB')
+
+    nprobes: List[int] = [int(x) for x in args.nprobes.split(',')]
+    print('nprobe\trecall@k\tqueries / s')
+    for nprobe in nprobes:
+        set_nprobe(index, nprobe)
+        start: float = time.perf_counter()
+        _, found = search(index, queries, args.k, batch_size = args.batch_size, verbose = False)
+        rate: float = len(queries) / (time.perf_counter() - start)
+        print(f'{nprobe}\t{recall_at_k(found, truth):.4f}\t{rate:.1f}')
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument('vectors_npy', type=str, help='path to trained word2vec vectors')
+    parser.add_argument('--index-file', type=str, default=None,
+                        help='index written by get_neighbors.py, else build one (default: None)')
+    parser.add_argument('--index-type', type=str, default='ivfflat', choices=['ivfflat', 'ivfpq', 'opq'],
+                        help='index to build without --index-file (default: ivfflat)')
+    parser.add_argument('--nlist', type=int, default=None,
+                        help='number of inverted lists (default: 4 * sqrt(number of vectors))')
+    parser.add_argument('--m', type=int, default=16, help='sub-quantizers for ivfpq / opq (default: 16)')
+    parser.add_argument('--nbits', type=int, default=8, help='bits per sub-quantizer code (default: 8)')
+    parser.add_argument('--train-size', type=int, default=2**20,
+                        help='number of vectors sampled to train the index (default: 1048576)')
+    parser.add_argument('--nprobes', type=str, default='1,4,16,64',
+                        help='comma separated nprobe values to try (default: 1,4,16,64)')
+    parser.add_argument('--num-queries', type=int, default=10000,
+                        help='number of sampled query vectors (default: 10000)')
+    parser.add_argument('--batch-size', type=int, default=2**16,
+                        help='queries per search call (default: 65536)')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='OpenMP threads used by FAISS, 0 keeps its default (default: 0)')
+    parser.add_argument('--k', type=int, default=10, help='number of neighbors (default: 10)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default: 42)')
+    args: Any = parser.parse_args()
+
+    main(args)
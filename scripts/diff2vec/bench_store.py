@@ -0,0 +1,66 @@
+"""
+Benchmark random neighbour lookups on a CSR graph directory: memory
+mapped (`CSRGraph`) vs. the bounded page cache (`PagedCSRGraph`), one
+node at a time and in batches.
+"""
+import time
+import numpy as np
+from typing import Any, Tuple
+
+from src.diff2vec.graph import CSRGraph, PagedCSRGraph
+
+
+def bench_single(graph: CSRGraph, nodes: np.array) -> float:
+    start: float = time.perf_counter()
+    for node in nodes.tolist():
+        graph.neighbors(node, as_set=False)
+    return (time.perf_counter() - start) / len(nodes)
+
+
+def bench_batch(graph: CSRGraph, nodes: np.array, batch_size: int) -> float:
+    start: float = time.perf_counter()
+    for i in range(0, len(nodes), batch_size):
+        graph.neighbors_batch(nodes[i:i+batch_size])
+    return (time.perf_counter() - start) / len(nodes)
+
+
+def main(args: Any):
+    rng: np.random.Generator = np.random.default_rng(args.seed)
+    mmap_graph: CSRGraph = CSRGraph.load(args.graph_dir)
+    paged_graph: PagedCSRGraph = PagedCSRGraph(
+        args.graph_dir, page_size = args.page_size, cache_pages = args.cache_pages)
+    nodes: np.array = rng.integers(0, len(mmap_graph), args.num_lookups)
+    print(f'{len(mmap_graph)} nodes, {args.num_lookups} random lookups')
+
+    # check both readers agree before timing
+    for node in nodes[:1000].tolist():
+        assert np.array_equal(
+            mmap_graph.neighbors(node, as_set=False), paged_graph.neighbors(node, as_set=False))
+
+    results: Tuple[Tuple[str, float], ...] = (
+        ('mmap single', bench_single(mmap_graph, nodes)),
+        ('paged single', bench_single(paged_graph, nodes)),
+        ('mmap batch', bench_batch(mmap_graph, nodes, args.batch_size)),
+        ('paged batch', bench_batch(paged_graph, nodes, args.batch_size)),
+    )
+    for name, seconds in results:
+        print(f'{name}: {seconds * 1e6:.2f} us / lookup')
+    print(f'page cache: {paged_graph.hits} hits, {paged_graph.misses} misses')
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument('graph_dir', type=str, help='path to CSR graph directory')
+    parser.add_argument('--num-lookups', type=int, default=100000,
+                        help='number of random lookups (default: 100000)')
+    parser.add_argument('--batch-size', type=int, default=1024,
+                        help='nodes per batch lookup (default: 1024)')
+    parser.add_argument('--page-size', type=int, default=65536,
+                        help='neighbours per page (default: 65536)')
+    parser.add_argument('--cache-pages', type=int, default=1024,
+                        help='maximum pages kept in memory (default: 1024)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default: 42)')
+    args: Any = parser.parse_args()
+
+    main(args)
@@ -5,9 +5,10 @@ Then we can we create a map to do the replacement later.
 
 import numpy as np
 import pandas as pd
-from typing import Any, Iterable, Dict, Set, List
+from typing import Any, Iterable
 
-from src.utils.utils import to_json
+from src.diff2vec.addresses import AddressIndex
+from src.diff2vec.graph import csr_from_csv
 
 
 def yield_transactions(
@@ -19,44 +20,31 @@ def yield_transactions(
         yield chunk
 
 
-def make_address_map(
-    address_map: Dict[str, int], 
-    chunk: pd.DataFrame, 
-    min_index: int,
-) -> Dict[str, Any]:
-    from_set: Set[str] = set(chunk.from_address.to_numpy())
-    to_set: Set[str] = set(chunk.to_address.to_numpy())
-
-    # build mapping from unique addresses
-    addresses: Set[str] = from_set.union(to_set)
-    bank: Set[str] = set(list(address_map.keys()))
-    # remove existing addresses
-    addresses: Set[str] = addresses - bank
-    addresses: List[str] = sorted(list(addresses))
-
-    indices: List[int] = list(range(len(addresses)))
-    indices: List[int] = [x + min_index for x in indices]
-
-    return dict(zip(addresses, indices))
+def yield_addresses(
+    transactions_csv: str, chunk_size: int = 10000) -> Iterable[np.array]:
+    for chunk in pd.read_csv(
+        transactions_csv, usecols = ['from_address', 'to_address'], chunksize = chunk_size):
+        yield np.concatenate([chunk.from_address.to_numpy(), chunk.to_address.to_numpy()])
 
 
 def make_graph_dataframe(
     transactions_csv: str,
     out_csv: str,
-    addr_json: str,
+    addr_file: str,
     chunk_size: int = 10000,
-) -> pd.DataFrame:
-    count: int = 0
-    address_map: Dict[str, int] = {}
+) -> AddressIndex:
+    """
+    Pass 1 builds the sorted address array (the id of an address is its
+    index), pass 2 replaces addresses by ids with a binary search.
+    """
+    index: AddressIndex = AddressIndex.build(
+        yield_addresses(transactions_csv, chunk_size), addr_file)
 
+    count: int = 0
     print('processing txs',  end = '', flush=True)
     for chunk in yield_transactions(transactions_csv, chunk_size):
-        cur_map: Dict[str, int] = \
-            make_address_map(address_map, chunk, len(address_map))
-        address_map.update(cur_map)
-
-        chunk.from_address = chunk.from_address.apply(lambda x: address_map[x])
-        chunk.to_address = chunk.to_address.apply(lambda x: address_map[x])
+        chunk.from_address = index.encode(chunk.from_address.to_numpy())
+        chunk.to_address = index.encode(chunk.to_address.to_numpy())
 
         if count == 0:
             chunk.to_csv(out_csv, index=False)
@@ -67,12 +55,16 @@ def make_graph_dataframe(
         print('.', end = '', flush=True)
         count += 1 
 
-    to_json(address_map, addr_json)
+    return index
 
 
 def main(args: Any):
-    make_graph_dataframe(
-        args.transactions_csv, args.save_csv, args.addr_json, args.chunk_size)
+    index: AddressIndex = make_graph_dataframe(
+        args.transactions_csv, args.save_csv, args.addr_file, args.chunk_size)
+
+    if args.csr_dir is not None:
+        # memory mapped graph for diff2vec (see src/diff2vec/graph.py)
+        csr_from_csv(args.save_csv, args.csr_dir, num_nodes = len(index), chunk_size = args.chunk_size)
 
 
 if __name__ == "__main__":
@@ -80,9 +72,12 @@ if __name__ == "__main__":
     parser: ArgumentParser = ArgumentParser()
     parser.add_argument('transactions_csv', type=str, help='path to transaction data')
     parser.add_argument('save_csv', type=str, help='path to save data')
-    parser.add_argument('addr_json', type=str, help='path to save addr map')
+    parser.add_argument('addr_file', type=str, 
+                        help='path to save sorted address array (.npy), ids are indices into it')
     parser.add_argument('--chunk-size', type=int, default=1000000,
                         help='Chunk size (default: 1000000)')
+    parser.add_argument('--csr-dir', type=str, default=None,
+                        help='also write a CSR graph to this directory (default: None)')
     args: Any = parser.parse_args()
 
     main(args)
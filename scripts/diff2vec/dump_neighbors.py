@@ -1,44 +1,37 @@
 """
-After running `get_neighbors.py` we will dump the information
-into a CSV, converting numbers back to address string.
+After running `get_neighbors.py` we will dump the information into a
+Postgres binary COPY file for the `embedding` table (see
+webapp/db_utils/upload_diff2vec.py). Neighbours stay node ids (the `id`
+of other rows) in a bigint[] column and distances go in a real[]
+column, so nothing is formatted as text.
 """
 import os
-import json
 import numpy as np
-import pandas as pd
 from tqdm import tqdm
-from typing import Any, List, Dict
+from typing import Any
 
-from src.utils.utils import from_json
+from src.diff2vec.addresses import AddressIndex
+from src.utils.pgcopy import write_header, write_trailer, write_embedding_rows
 
 
 def main(args: Any):
-    distances: np.array = np.load(args.distance_file)
-    neighbors: np.array = np.load(args.neighbor_file)
-    index2addr: Dict[str, int] = from_json(args.address_file)
+    distances: np.array = np.load(args.distance_file, mmap_mode='r')
+    neighbors: np.array = np.load(args.neighbor_file, mmap_mode='r')
+    index: AddressIndex = AddressIndex(args.address_file)
     size: int = len(distances)
 
-    address_df: List[str] = []
-    distance_df: List[str] = []
-    neighbor_df: List[str] = []
-
-    for index in tqdm(range(size)):
-        distance: List[float] = distances[index].tolist()
-        distance: str = json.dumps(distance)
-        neighbor: List[int] = neighbors[index].tolist()
-        neighbor: List[str] = [index2addr[str(nei)] for nei in neighbor if nei >= 0]
-        neighbor: str = json.dumps(neighbor)
-        distance_df.append(distance)
-        neighbor_df.append(neighbor)
-        address_df.append(index2addr[str(index)])
-
-    df_dict: Dict[str, List[str]] = dict(
-        address=address_df, 
-        distance=distance_df,
-        neighbor=neighbor_df,
-    )
-    df: pd.DataFrame = pd.DataFrame.from_dict(df_dict)
-    df.to_csv(os.path.join(args.save_dir, 'diff2vec-processed.csv'), index=False)
+    out_file: str = os.path.join(args.save_dir, 'diff2vec-processed.pgcopy')
+    with open(out_file, 'wb') as fp:
+        write_header(fp)
+        for start in tqdm(range(0, size, args.block_size)):
+            ids: np.array = np.arange(start, min(start + args.block_size, size), dtype=np.int64)
+            addresses: np.array = index.decode(ids).astype(bytes)
+            write_embedding_rows(
+                fp, ids, addresses,
+                np.asarray(neighbors[ids[0]:ids[-1] + 1], dtype=np.int64),
+                np.asarray(distances[ids[0]:ids[-1] + 1], dtype=np.float32),
+            )
+        write_trailer(fp)
 
 
 if __name__ == "__main__":
@@ -47,8 +40,10 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('distance_file', type=str, help='path to distance numpy file.')
     parser.add_argument('neighbor_file', type=str, help='path to neighbor numpy file.')
-    parser.add_argument('address_file', type=str, help='path to address lookup file.')
+    parser.add_argument('address_file', type=str, help='path to sorted address array (see compress_graph.py).')
     parser.add_argument('save_dir', type=str, help='where to save outpouts.')
+    parser.add_argument('--block-size', type=int, default=2**20,
+                        help='rows encoded at a time (default: 1048576)')
     args: Any = parser.parse_args()
 
     main(args)
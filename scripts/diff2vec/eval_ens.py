@@ -0,0 +1,126 @@
+"""
+Offline embedding-quality check against ENS clusters (addresses sharing
+an ENS name), without the webapp database. Like `webapp/tests/test_ens.py`
+in `node` mode: the k nearest neighbours of one address of each cluster
+are its predicted cluster, scored by average precision and recall.
+
+Row i of the embedding matrix is node i, whose address is entry i of
+the address array written by compress_graph.py.
+"""
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from typing import Any, Dict, List, Set
+
+from src.diff2vec.addresses import AddressIndex
+
+
+def get_clusters(csv_file: str) -> List[Set[str]]:
+    df: pd.DataFrame = pd.read_csv(csv_file)
+    clusters: List[Set[str]] = []
+    for _, group in df.groupby('name'):
+        cluster: Set[str] = set(group.address.str.lower())
+        if len(cluster) > 1:  # solo clusters are not worthwhile
+            clusters.append(cluster)
+    return clusters
+
+
+def nearest_neighbors(
+    vectors: np.array,
+    queries: np.array,
+    k: int,
+    metric: str = 'l2',
+    block_size: int = 2**18,
+) -> np.array:
+    """
+    Exact k nearest rows of `vectors` for each query, in one pass over
+    `vectors` (which may be memory mapped).
+    """
+    queries: np.array = np.asarray(queries, dtype=np.float32)
+    if metric == 'cosine':
+        queries: np.array = queries / np.maximum(
+            np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+    best_dist: np.array = np.full((len(queries), k), np.inf, dtype=np.float32)
+    best_index: np.array = np.full((len(queries), k), -1, dtype=np.int64)
+    for start in tqdm(range(0, len(vectors), block_size)):
+        block: np.array = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+        if metric == 'cosine':
+            block: np.array = block / np.maximum(
+                np.linalg.norm(block, axis=1, keepdims=True), 1e-12)
+            dist: np.array = -queries @ block.T
+        else:  # squared l2 up to a per-query constant
+            dist: np.array = (block * block).sum(axis=1)[None, :] - 2 * queries @ block.T
+
+        # merge this block's candidates with the best so far
+        dist: np.array = np.concatenate([best_dist, dist], axis=1)
+        index: np.array = np.concatenate([
+            best_index, np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))
+        ], axis=1)
+        top: np.array = np.argpartition(dist, min(k, dist.shape[1] - 1), axis=1)[:, :k]
+        best_dist: np.array = np.take_along_axis(dist, top, axis=1)
+        best_index: np.array = np.take_along_axis(index, top, axis=1)
+
+    return best_index
+
+
+def evaluate(
+    clusters: List[Set[str]],
+    vectors: np.array,
+    index: AddressIndex,
+    k: int = 10,
+    metric: str = 'l2',
+) -> Dict[str, float]:
+    representatives: List[str] = [sorted(cluster)[0] for cluster in clusters]
+    ids: np.array = index.encode(representatives)
+    known: np.array = (ids >= 0) & (ids < len(vectors))
+
+    neighbors: np.array = np.full((len(clusters), k), -1, dtype=np.int64)
+    if known.any():
+        queries: np.array = np.asarray(vectors[np.sort(ids[known])], dtype=np.float32)
+        order: np.array = np.argsort(ids[known])
+        found: np.array = nearest_neighbors(vectors, queries, k, metric = metric)
+        neighbors[np.flatnonzero(known)[order]] = found
+
+    avg_precision: float = 0
+    avg_recall: float = 0
+    for i, cluster in enumerate(clusters):
+        if known[i]:
+            row: np.array = neighbors[i]
+            pred_cluster: Set[str] = set(index.decode(row[row >= 0]).tolist())
+        else:  # not in the graph, so just predict itself
+            pred_cluster: Set[str] = {representatives[i]}
+
+        tp: int = len(pred_cluster & cluster)  # true positive
+        fp: int = len(pred_cluster - cluster)  # false positive
+        fn: int = len(cluster - pred_cluster)  # false negatives
+        avg_precision += tp / float(tp + fp)
+        avg_recall += tp / float(tp + fn)
+
+    return {
+        'precision': avg_precision / float(len(clusters)),
+        'recall': avg_recall / float(len(clusters)),
+        'coverage': float(known.mean()),
+    }
+
+
+def main(args: Any):
+    clusters: List[Set[str]] = get_clusters(args.ens_csv)
+    vectors: np.array = np.load(args.vectors_npy, mmap_mode='r')
+    index: AddressIndex = AddressIndex(args.address_file)
+    print(f'{len(clusters)} ENS clusters, {len(vectors)} vectors')
+    print(evaluate(clusters, vectors, index, k = args.k, metric = args.metric))
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument('vectors_npy', type=str, help='path to embeddings, row i is node i')
+    parser.add_argument('address_file', type=str, help='path to sorted address array (see compress_graph.py)')
+    parser.add_argument('ens_csv', type=str, help='path to csv of ENS names and addresses')
+    parser.add_argument('--k', type=int, default=10, help='number of neighbors (default: 10)')
+    parser.add_argument('--metric', type=str, default='l2', choices=['l2', 'cosine'],
+                        help='distance between embeddings (default: l2)')
+    args: Any = parser.parse_args()
+
+    main(args)
@@ -1,65 +1,55 @@
 """
-We can't store the Word2Vec in RAM on the server so we should 
+We can't store the Word2Vec in RAM on the server so we should
 instead store a map from address index -> clusters of indices.
 """
 import os
 import faiss
 import numpy as np
-from typing import Any, List
-from tqdm import tqdm
+from typing import Any
+
+from src.diff2vec.neighbors import build_index, search, set_nprobe
 
 
 def main(args: Any):
+    if not os.path.isdir(args.save_dir): os.makedirs(args.save_dir)
     print('loading vectors...', end=' ')
-    vectors: np.array = np.load(args.vectors_npy)
+    vectors: np.array = np.load(args.vectors_npy, mmap_mode='r')
     print('done')
-    size = vectors.shape[0]
+    size: int = vectors.shape[0]
 
-    # https://github.com/facebookresearch/faiss/issues/112
-    nlist = int(4 * np.sqrt(size))
+    if args.threads > 0:
+        faiss.omp_set_num_threads(args.threads)
 
     if args.index_file is None:
-        quantizer: faiss.IndexFlatL2 = faiss.IndexFlatL2(128)
-        index: faiss.IndexIVFFlat = \
-            faiss.IndexIVFFlat(quantizer, 128, nlist, faiss.METRIC_L2)
-        
-        assert not index.is_trained
-        print('training FAISS index...', end=' ')
-        index.train(vectors)
-        print('done')
-        assert index.is_trained
-
-        print('adding vectors to index...', end=' ')
-        index.add(vectors)
-        print('done')
-
+        index: faiss.Index = build_index(
+            vectors,
+            index_type = args.index_type,
+            nlist = args.nlist,
+            m = args.m,
+            nbits = args.nbits,
+            train_size = args.train_size,
+            batch_size = args.batch_size,
+        )
         print('saving to disk...', end=' ')
-        faiss.write_index(index, os.path.join(args.save_dir, 'faiss.index')) 
+        faiss.write_index(index, os.path.join(args.save_dir, 'faiss.index'))
         print('done')
     else:
-        print('reading to disk...', end=' ')
-        index = faiss.read_index(os.path.join(args.save_dir, 'faiss.index'))
+        print('reading from disk...', end=' ')
+        index: faiss.Index = faiss.read_index(args.index_file)
         print('done')
+    set_nprobe(index, args.nprobe)
 
     print('computing neighbors')
-    distances: List[np.array] = []
-    neighbors: List[np.array] = []
-
-    batch_size: int = 100
-    num_batches: int = (size // batch_size) + int(size % batch_size)
-
-    for i in tqdm(range(num_batches)):
-        query: np.array = vectors[batch_size*i:batch_size*(i+1)]
-        D, I = index.search(query, args.k)
-        distances.append(D)
-        neighbors.append(I)
-
-    distances = np.concatenate(distances, axis=0)
-    neighbors = np.concatenate(neighbors, axis=0)
-
-    np.save(os.path.join(args.save_dir, f'distances-k{args.k}.npy'), distances)
-    np.save(os.path.join(args.save_dir, f'neighbors-k{args.k}.npy'), neighbors)
-
+    distances: np.memmap = np.lib.format.open_memmap(
+        os.path.join(args.save_dir, f'distances-k{args.k}.npy'),
+        mode='w+', dtype=np.float32, shape=(size, args.k))
+    neighbors: np.memmap = np.lib.format.open_memmap(
+        os.path.join(args.save_dir, f'neighbors-k{args.k}.npy'),
+        mode='w+', dtype=np.int64, shape=(size, args.k))
+    search(index, vectors, args.k, batch_size = args.batch_size,
+           distances = distances, neighbors = neighbors)
+    distances.flush()
+    neighbors.flush()
 
 
 if __name__ == "__main__":
@@ -70,6 +60,21 @@ if __name__ == "__main__":
     parser.add_argument('save_dir', type=str, help='where to save outputs.')
     parser.add_argument('--index-file', type=str, default=None,
                         help='optional path to cached index file')
+    parser.add_argument('--index-type', type=str, default='ivfflat', choices=['ivfflat', 'ivfpq', 'opq'],
+                        help='ivfflat stores raw vectors, ivfpq / opq store m-byte codes (default: ivfflat)')
+    parser.add_argument('--nlist', type=int, default=None,
+                        help='number of inverted lists (default: 4 * sqrt(number of vectors))')
+    parser.add_argument('--m', type=int, default=16,
+                        help='sub-quantizers for ivfpq / opq, must divide the dimension (default: 16)')
+    parser.add_argument('--nbits', type=int, default=8, help='bits per sub-quantizer code (default: 8)')
+    parser.add_argument('--nprobe', type=int, default=1,
+                        help='inverted lists visited per query (default: 1)')
+    parser.add_argument('--train-size', type=int, default=2**20,
+                        help='number of vectors sampled to train the index (default: 1048576)')
+    parser.add_argument('--batch-size', type=int, default=2**16,
+                        help='queries per search call (default: 65536)')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='OpenMP threads used by FAISS, 0 keeps its default (default: 0)')
     parser.add_argument('--k', type=int, default=10, help='number of neighbors to find.')
     args: Any = parser.parse_args()
 
@@ -0,0 +1,67 @@
+"""
+Write the files read by the webapp's in-process neighbour search
+(webapp/app/lib/ann.py): int8 vectors with a per-dimension scale, their
+squared norms, the address arrays and, optionally, a FAISS index.
+"""
+import os
+import shutil
+import numpy as np
+from tqdm import tqdm
+from typing import Any
+
+from src.diff2vec.addresses import AddressIndex
+
+
+def quantize(vectors: np.array, out_dir: str, block_size: int = 2**20):
+    """
+    Symmetric int8 quantisation per dimension: scale = max |v| / 127.
+    Two passes over `vectors` (which may be memory mapped).
+    """
+    size, dim = vectors.shape
+    max_abs: np.array = np.zeros(dim, dtype=np.float32)
+    for start in tqdm(range(0, size, block_size), desc='scale'):
+        block: np.array = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+        max_abs: np.array = np.maximum(max_abs, np.abs(block).max(axis=0))
+    scale: np.array = np.where(max_abs > 0, max_abs / 127., 1.).astype(np.float32)
+    np.save(os.path.join(out_dir, 'scale.npy'), scale)
+
+    codes: np.memmap = np.lib.format.open_memmap(
+        os.path.join(out_dir, 'vectors-int8.npy'), mode='w+', dtype=np.int8, shape=(size, dim))
+    norms: np.memmap = np.lib.format.open_memmap(
+        os.path.join(out_dir, 'norms.npy'), mode='w+', dtype=np.float32, shape=(size,))
+    for start in tqdm(range(0, size, block_size), desc='quantize'):
+        block: np.array = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+        code: np.array = np.clip(np.rint(block / scale), -127, 127).astype(np.int8)
+        codes[start:start + len(block)] = code
+        norms[start:start + len(block)] = ((code * scale) ** 2).sum(axis=1)
+    codes.flush()
+    norms.flush()
+
+
+def main(args: Any):
+    if not os.path.isdir(args.out_dir): os.makedirs(args.out_dir)
+    vectors: np.array = np.load(args.vectors_npy, mmap_mode='r')
+    quantize(vectors, args.out_dir, block_size = args.block_size)
+
+    index: AddressIndex = AddressIndex(args.address_file)
+    shutil.copyfile(args.address_file, os.path.join(args.out_dir, 'addresses.npy'))
+    for i, path in enumerate(index.get_delta_files()):
+        shutil.copyfile(path, os.path.join(args.out_dir, f'addresses.delta{i + 1:04d}.npy'))
+
+    if args.index_file is not None:
+        shutil.copyfile(args.index_file, os.path.join(args.out_dir, 'faiss.index'))
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument('vectors_npy', type=str, help='path to vectors, row i is node i')
+    parser.add_argument('address_file', type=str, help='path to sorted address array (see compress_graph.py)')
+    parser.add_argument('out_dir', type=str, help='where to save outputs (ANN_DIR of the webapp)')
+    parser.add_argument('--index-file', type=str, default=None,
+                        help='FAISS index from get_neighbors.py, else search scans the int8 vectors (default: None)')
+    parser.add_argument('--block-size', type=int, default=2**20,
+                        help='rows quantised at a time (default: 1048576)')
+    args: Any = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,20 @@
+from typing import Any
+from src.diff2vec.corpus import BinaryCorpus, jsonl_to_binary
+
+
+def main(args: Any):
+    corpus: BinaryCorpus = jsonl_to_binary(args.sequences_file, args.corpus_dir, total = args.corpus_size)
+    print(f'wrote {corpus.num_sentences} sentences and {corpus.num_tokens} tokens to {args.corpus_dir}')
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument('sequences_file', type=str, 
+                        help='path to sequences file, or directory of sequence shards')
+    parser.add_argument('corpus_dir', type=str, help='path to save binary corpus')
+    parser.add_argument('--corpus-size', type=int, default=None, 
+                        help='number of sentences, for the progress bar (default: None)')
+    args: Any = parser.parse_args()
+
+    main(args)
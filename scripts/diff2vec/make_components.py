@@ -1,18 +1,25 @@
-from typing import Any
-from src.diff2vec.graph import UndirectedGraph
+from typing import Any, Union
+from src.diff2vec.graph import UndirectedGraph, CSRGraph, load_graph
 
 
 def main(args: Any):
-    graph: UndirectedGraph = UndirectedGraph()
-    graph.from_pickle(args.edges_file)
-    graph.connected_components(args.out_file)
+    graph: Union[UndirectedGraph, CSRGraph] = load_graph(args.edges_file, cache_pages = args.cache_pages)
+    if isinstance(graph, UndirectedGraph):
+        # vectorised components need the CSR layout
+        graph: CSRGraph = CSRGraph.from_graph(graph)
+    graph.connected_components(args.out_file, verbose = args.verbose)
 
 
 if __name__ == "__main__":
     from argparse import ArgumentParser
     parser: ArgumentParser = ArgumentParser()
-    parser.add_argument('edges_file', type=str, help='path to edges pickle file')
+    parser.add_argument('edges_file', type=str, help='path to edges pickle file or CSR graph directory')
     parser.add_argument('out_file', type=str, help='path to save components')
+    parser.add_argument('--cache-pages', type=int, default=0,
+                        help='read a CSR graph through a page cache of this many pages, '
+                             '0 memory maps it (default: 0)')
+    parser.add_argument('--verbose', action='store_true', default=False,
+                        help='print progress (default: False)')
     args: Any = parser.parse_args()
 
     main(args)
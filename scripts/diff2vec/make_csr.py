@@ -0,0 +1,33 @@
+"""
+Convert a compressed graph csv (see compress_graph.py) into a CSR graph
+directory that can be memory mapped by `CSRGraph.load`.
+"""
+from typing import Any
+from src.diff2vec.graph import csr_from_csv
+
+
+def main(args: Any):
+    csr_from_csv(
+        args.data_csv, 
+        args.csr_dir, 
+        chunk_size = args.chunk_size,
+        weight_column = args.weight_column,
+        log_weights = args.log_weights,
+    )
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument('data_csv', type=str, help='path to compressed graph csv')
+    parser.add_argument('csr_dir', type=str, help='path to save CSR graph')
+    parser.add_argument('--chunk-size', type=int, default=10000000,
+                        help='Chunk size (default: 10000000)')
+    parser.add_argument('--weight-column', type=str, default=None, choices=['size', 'value'],
+                        help='weight edges by transaction count or total value and build '
+                             'alias tables for weighted diffusion (default: None)')
+    parser.add_argument('--log-weights', action='store_true', default=False,
+                        help='use log(1 + weight) as the weight (default: False)')
+    args: Any = parser.parse_args()
+
+    main(args)
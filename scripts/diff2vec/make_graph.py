@@ -1,9 +1,18 @@
 """
 Need to convert the transactions dataframe to a smaller dataframe 
-with the columns: `Address A | Address B | # of interactions`
+with the columns: `Address A | Address B | # of interactions | total value`
+
+The same pair of addresses shows up in many chunks, so rows are first
+hash-partitioned to disk on (from_address, to_address): every copy of a
+pair lands in the same partition, and each partition is small enough to
+aggregate in memory. The output has one row per unique pair.
 """
+import os
+import shutil
+import tempfile
+import numpy as np
 import pandas as pd
-from typing import Any, Iterable
+from typing import Any, Iterable, List, Optional
 
 
 def yield_transactions(
@@ -11,32 +20,82 @@ def yield_transactions(
     """
     Load a segment at a time (otherwise too large).
     """
-    for chunk in pd.read_csv(transactions_csv, chunksize = chunk_size):
+    for chunk in pd.read_csv(
+        transactions_csv, 
+        usecols = ['from_address', 'to_address', 'value'], 
+        chunksize = chunk_size,
+    ):
         yield chunk
 
 
+def aggregate_edges(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sum interaction counts and values per (from_address, to_address).
+    """
+    return df.groupby(['from_address', 'to_address'], as_index=False).agg(
+        size = ('size', 'sum'), value = ('value', 'sum'))
+
+
 def make_graph_dataframe(
-    transactions_csv: str, out_csv: str, chunk_size: int = 10000) -> pd.DataFrame:
-    count: int = 0
+    transactions_csv: str,
+    out_csv: str,
+    chunk_size: int = 10000,
+    num_partitions: int = 256,
+    tmp_dir: Optional[str] = None,
+):
+    part_dir: str = tempfile.mkdtemp(
+        prefix='partitions-', dir=tmp_dir or os.path.dirname(os.path.abspath(out_csv)))
+    part_files: List[str] = [
+        os.path.join(part_dir, f'partition-{i:04d}.csv') for i in range(num_partitions)]
+    written: np.array = np.zeros(num_partitions, dtype=bool)
+
+    try:
+        print('partitioning txs',  end = '', flush=True)
+        for chunk in yield_transactions(transactions_csv, chunk_size):
+            chunk['size'] = 1
+            chunk.value = chunk.value.astype(float) / 10**18  # wei to eth
+            chunk: pd.DataFrame = aggregate_edges(chunk)
+
+            hashes: np.array = pd.util.hash_pandas_object(
+                chunk[['from_address', 'to_address']], index=False).to_numpy()
+            partition: np.array = (hashes % num_partitions).astype(np.int64)
+            for i, part in chunk.groupby(partition):
+                part.to_csv(part_files[i], mode='a', header=not written[i], index=False)
+                written[i] = True
 
-    print('processing txs',  end = '', flush=True)
-    for chunk in yield_transactions(transactions_csv, chunk_size):
-        chunk: pd.DataFrame = \
-            chunk.groupby(['from_address', 'to_address'], as_index=False).size()
+            del chunk  # wipe memory
+            print('.', end = '', flush=True)
+        print()
 
-        if count == 0:
-            chunk.to_csv(out_csv, index=False)
-        else:
-            chunk.to_csv(out_csv, mode='a', header=False, index=False)
+        # every copy of a pair is in one partition, so aggregate each alone
+        print('aggregating partitions',  end = '', flush=True)
+        count: int = 0
+        for i in np.flatnonzero(written).tolist():
+            part: pd.DataFrame = aggregate_edges(pd.read_csv(part_files[i]))
+            if count == 0:
+                part.to_csv(out_csv, index=False)
+            else:
+                part.to_csv(out_csv, mode='a', header=False, index=False)
+            os.remove(part_files[i])
+            print('.', end = '', flush=True)
+            count += 1
+        print()
 
-        del chunk  # wipe memory
-        print('.', end = '', flush=True)
-        count += 1 
+        if count == 0:  # no transactions: header only
+            pd.DataFrame(columns=['from_address', 'to_address', 'size', 'value']).to_csv(
+                out_csv, index=False)
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
 
 
 def main(args: Any):
     make_graph_dataframe(
-        args.transactions_csv, args.save_csv, args.chunk_size)
+        args.transactions_csv, 
+        args.save_csv, 
+        chunk_size = args.chunk_size,
+        num_partitions = args.num_partitions,
+        tmp_dir = args.tmp_dir,
+    )
 
 
 if __name__ == "__main__":
@@ -46,6 +105,10 @@ if __name__ == "__main__":
     parser.add_argument('save_csv', type=str, help='path to save data')
     parser.add_argument('--chunk-size', type=int, default=1000000,
                         help='Chunk size (default: 1000000)')
+    parser.add_argument('--num-partitions', type=int, default=256,
+                        help='number of on-disk hash partitions; each must fit in memory (default: 256)')
+    parser.add_argument('--tmp-dir', type=str, default=None,
+                        help='where to write partitions (default: next to save_csv)')
     args: Any = parser.parse_args()
 
     main(args)
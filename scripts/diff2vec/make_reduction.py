@@ -1,13 +1,47 @@
+"""
+Project the word2vec vectors onto their top principal components (for
+the embedding plots), streaming the memory mapped vectors in blocks.
+
+PCA only needs the mean and covariance of the vectors: one pass sums
+x and x^T x per block (d x d, small for our d), the components are the
+top eigenvectors of the covariance, and a second pass writes each block
+of projections to a memory mapped output. Memory is one block plus the
+output pages being written, and the result is the exact PCA.
+"""
 import os
 import numpy as np
-from typing import Any, List
-from sklearn.decomposition import PCA
+from tqdm import tqdm
+from typing import Any, List, Tuple
+
+
+def fit_pca(vectors: np.array, n_components: int, block_size: int = 2**20) -> Tuple[np.array, np.array, np.array]:
+    """
+    Mean, components (n_components x d) and explained variance ratio.
+    Signs follow sklearn: the largest loading of each component is positive.
+    """
+    size, dim = vectors.shape
+    total: np.array = np.zeros(dim)
+    outer: np.array = np.zeros((dim, dim))
+    for start in tqdm(range(0, size, block_size), desc='fitting'):
+        block: np.array = np.asarray(vectors[start:start + block_size], dtype=np.float64)
+        total += block.sum(axis=0)
+        outer += block.T @ block
+    mean: np.array = total / size
+    cov: np.array = (outer - size * np.outer(mean, mean)) / (size - 1)
+
+    variances, vectors_ = np.linalg.eigh(cov)
+    order: np.array = np.argsort(variances)[::-1][:n_components]
+    components: np.array = vectors_[:, order].T
+    signs: np.array = np.sign(components[np.arange(n_components), np.abs(components).argmax(axis=1)])
+    components *= signs[:, None]
+    ratio: np.array = variances[order] / variances.sum()
+    return mean, components, ratio
 
 
 def main(args: Any):
-    vectors: np.array = np.load(args.vectors_npy)
-    pca: PCA = PCA(n_components=3)
-    vectors: np.array = pca.fit_transform(vectors)
+    vectors: np.array = np.load(args.vectors_npy, mmap_mode='r')
+    mean, components, ratio = fit_pca(vectors, args.n_components, block_size = args.block_size)
+    print(f'explained variance ratio: {np.round(ratio, 4).tolist()}')
 
     filename: str = os.path.basename(args.vectors_npy)
     name_pieces: List[str] = filename.split('.')
@@ -15,7 +49,13 @@ def main(args: Any):
     filename = '.'.join(name_pieces)
 
     dirname: str = os.path.dirname(args.vectors_npy)
-    np.save(os.path.join(dirname, filename), vectors)
+    out: np.memmap = np.lib.format.open_memmap(
+        os.path.join(dirname, filename), mode='w+', dtype=np.float32,
+        shape=(len(vectors), args.n_components))
+    for start in tqdm(range(0, len(vectors), args.block_size), desc='transforming'):
+        block: np.array = np.asarray(vectors[start:start + args.block_size], dtype=np.float64)
+        out[start:start + len(block)] = (block - mean) @ components.T
+    out.flush()
 
 
 if __name__ == "__main__":
@@ -23,6 +63,10 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument('vectors_npy', type=str, help='path to trained word2vec vectors.')
+    parser.add_argument('--n-components', type=int, default=3,
+                        help='number of components (default: 3)')
+    parser.add_argument('--block-size', type=int, default=2**18,
+                        help='vectors read at a time (default: 262144)')
     args: Any = parser.parse_args()
 
     main(args)
@@ -1,27 +1,103 @@
 import os
-from typing import Any
+from typing import Any, Optional, Union
 
-from src.diff2vec.graph import UndirectedGraph
-from src.diff2vec.euler import SubGraphSequences
+from src.diff2vec.graph import UndirectedGraph, CSRGraph, load_graph
+from src.diff2vec.euler import SubGraphSequences, HubPolicy
+
+
+def get_hub_components(hub_dir: str) -> str:
+    """
+    Connected components of the graph in `hub_dir`, computed once per
+    hub policy applied there. Node ids are those of the original graph.
+    """
+    components_file: str = os.path.join(hub_dir, 'components.jsonl')
+    policy_file: str = os.path.join(hub_dir, 'hub-policy.json')
+    if os.path.isfile(components_file) and \
+            os.path.getmtime(components_file) >= os.path.getmtime(policy_file):
+        return components_file
+    tmp_file: str = f'{components_file}.tmp'
+    CSRGraph.load(hub_dir).connected_components(tmp_file, verbose = True)
+    os.replace(tmp_file, components_file)
+    return components_file
 
 
 def main(args: Any):
-    graph: UndirectedGraph = UndirectedGraph()
-    graph.from_pickle(args.edges_file)
+    max_misses: Optional[int] = None
+    if args.max_degree > 0 or args.exclude_exchanges is not None:
+        assert os.path.isdir(args.edges_file), 'a hub policy needs a CSR graph directory.'
+        if args.exclude_exchanges is not None:
+            assert args.address_file is not None, '--exclude-exchanges needs --address-file.'
+            policy: HubPolicy = HubPolicy.from_known_addresses(
+                args.exclude_exchanges, args.address_file,
+                max_degree = args.max_degree, seed = args.seed)
+        else:
+            policy: HubPolicy = HubPolicy(max_degree = args.max_degree, seed = args.seed)
+        hub_dir: str = args.hub_dir or args.edges_file.rstrip('/') + '-hubs'
+        args.edges_file = policy.apply(args.edges_file, hub_dir)
+        # cutting hubs splits the original components, and a cover drawn
+        # from a split component is mostly unreachable: size covers from
+        # the components of the hub graph instead
+        args.components_file = get_hub_components(hub_dir)
+        # only a guard now, every cover is reachable
+        max_misses: int = args.max_misses_factor * args.cover_size
+
+    if args.num_shards > 0:
+        # workers open the CSR graph themselves
+        sequencer: SubGraphSequences = \
+            SubGraphSequences(None, args.cover_size, seed=args.seed, weighted=args.weighted,
+                              max_misses=max_misses)
+        sequencer.get_sequences_sharded(
+            args.components_file,
+            args.sequences_file,
+            args.edges_file,
+            num_shards = args.num_shards,
+            workers = args.workers,
+            cache_pages = args.cache_pages,
+        )
+        return
+
+    graph: Union[UndirectedGraph, CSRGraph] = load_graph(args.edges_file, cache_pages = args.cache_pages)
     sequencer: SubGraphSequences = \
-        SubGraphSequences(graph, args.cover_size, seed=args.seed)
+        SubGraphSequences(graph, args.cover_size, seed=args.seed, weighted=args.weighted,
+                          max_misses=max_misses)
     sequencer.get_sequences(args.components_file, args.sequences_file)
 
 
 if __name__ == "__main__":
     from argparse import ArgumentParser
     parser: ArgumentParser = ArgumentParser()
-    parser.add_argument('edges_file', type=str, help='path to edges pickle file')
+    parser.add_argument('edges_file', type=str, help='path to edges pickle file or CSR graph directory')
     parser.add_argument('components_file', type=str, help='path to components file')
-    parser.add_argument('sequences_file', type=str, help='path to sequences file')
+    parser.add_argument('sequences_file', type=str, 
+                        help='path to sequences file, or output directory with --num-shards')
     parser.add_argument('--cover-size', type=int, default=80, 
                         help='size of subgraph (default: 80)')
     parser.add_argument('--seed', type=int, default=42, help='random seed (default: 42)')
+    parser.add_argument('--cache-pages', type=int, default=0,
+                        help='read a CSR graph through a page cache of this many pages, '
+                             '0 memory maps it (default: 0)')
+    parser.add_argument('--num-shards', type=int, default=0,
+                        help='split the sequences into this many shard files, needs a CSR '
+                             'graph; output only depends on the seed and this (default: 0)')
+    parser.add_argument('--weighted', action='store_true', default=False,
+                        help='sample neighbours by edge weight, needs a weighted CSR graph (default: False)')
+    parser.add_argument('--max-degree', type=int, default=0,
+                        help='cap every node to a random sample of this many neighbours, '
+                             '0 for no cap (default: 0)')
+    parser.add_argument('--exclude-exchanges', type=str, default=None,
+                        help='path to known addresses csv; cut exchange addresses out of '
+                             'the graph (default: None)')
+    parser.add_argument('--address-file', type=str, default=None,
+                        help='path to address array, to find exchanges (default: None)')
+    parser.add_argument('--hub-dir', type=str, default=None,
+                        help='where to write the graph with the hub policy applied '
+                             '(default: edges_file-hubs)')
+    parser.add_argument('--max-misses-factor', type=int, default=1000,
+                        help='with a hub policy, guard against a cover that cannot be '
+                             'completed: give up after this many times cover size repeated '
+                             'proposals (default: 1000)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes for sharded generation (default: 1)')
     args: Any = parser.parse_args()
 
     main(args)
@@ -0,0 +1,65 @@
+"""
+Embed every node of a CSR graph with FastRP (src/diff2vec/fastrp.py)
+instead of diffusion + word2vec. The vectors file is read by
+get_neighbors.py like the output of `run_word2vec.py --vectors-file`.
+Given `--ens-csv`, the vectors are scored with the ENS check of
+eval_ens.py, to compare with a diff2vec embedding.
+"""
+import time
+import numpy as np
+from typing import Any, List, Set
+
+from src.diff2vec.graph import CSRGraph
+from src.diff2vec.fastrp import FastRP
+from src.diff2vec.addresses import AddressIndex
+from scripts.diff2vec.eval_ens import get_clusters, evaluate
+
+
+def main(args: Any):
+    graph: CSRGraph = CSRGraph.load(args.graph_dir)
+    model: FastRP = FastRP(
+        dim = args.dim,
+        iteration_weights = args.iteration_weights,
+        normalization_strength = args.normalization_strength,
+        sparsity = args.sparsity,
+        seed = args.seed,
+        block_size = args.block_size,
+        workers = args.workers,
+    )
+    start: float = time.perf_counter()
+    model.embed(graph, args.vectors_file)
+    print(f'embedded {len(graph)} nodes in {time.perf_counter() - start:.1f}s')
+
+    if args.ens_csv is not None:
+        clusters: List[Set[str]] = get_clusters(args.ens_csv)
+        vectors: np.array = np.load(args.vectors_file, mmap_mode='r')
+        index: AddressIndex = AddressIndex(args.address_file)
+        print(evaluate(clusters, vectors, index, k = args.k, metric = args.metric))
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument('graph_dir', type=str, help='path to CSR graph directory')
+    parser.add_argument('vectors_file', type=str, help='where to save vectors (.npy, row i is node i)')
+    parser.add_argument('--dim', type=int, default=128, help='dimensionality (default: 128)')
+    parser.add_argument('--iteration-weights', type=float, nargs='+', default=[1., 1., 1.],
+                        help='weight of each propagation step (default: 1 1 1)')
+    parser.add_argument('--normalization-strength', type=float, default=-0.5,
+                        help='exponent of the degree scaling, negative down-weights hubs (default: -0.5)')
+    parser.add_argument('--sparsity', type=float, default=None,
+                        help='sparsity of the random projection (default: sqrt(dim))')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default: 42)')
+    parser.add_argument('--block-size', type=int, default=2**18,
+                        help='rows multiplied at a time (default: 262144)')
+    parser.add_argument('--workers', type=int, default=4, help='threads (default: 4)')
+    parser.add_argument('--ens-csv', type=str, default=None,
+                        help='csv of ENS names and addresses, to evaluate the vectors (default: None)')
+    parser.add_argument('--address-file', type=str, default=None,
+                        help='path to sorted address array, needed with --ens-csv (default: None)')
+    parser.add_argument('--k', type=int, default=10, help='neighbors in the ENS check (default: 10)')
+    parser.add_argument('--metric', type=str, default='l2', choices=['l2', 'cosine'],
+                        help='distance in the ENS check (default: l2)')
+    args: Any = parser.parse_args()
+
+    main(args)
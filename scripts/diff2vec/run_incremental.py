@@ -0,0 +1,136 @@
+"""
+Embed the addresses first seen in new transactions without retraining
+from scratch:
+
+1) give new addresses ids in a delta segment of the address index
+2) diffuse from each new node over its k-hop neighbourhood in the old
+   CSR graph plus the new edges (src/diff2vec/incremental.py)
+3) add the new nodes to the vocabulary of a trained model and train on
+   those sequences only, with the old vectors frozen or lightly updated
+
+Outputs in `out_dir`: the sequences as a binary corpus, the updated
+model, and the ids / vectors of the new nodes (`new-ids.npy` and
+`new-vectors.npy`). The CSR graph is not changed; new edges join it at
+the next full rebuild.
+
+Step 1 saves the new addresses before anything is trained, so the
+number of addresses known before them is kept in `out_dir/num-known.json`
+until the run finishes. A rerun after a crash reads it back and still
+treats those addresses as new.
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+from typing import Any, List
+
+from src.diff2vec.addresses import AddressIndex
+from src.diff2vec.corpus import BinaryCorpusWriter
+from src.diff2vec.graph import CSRGraph
+from src.diff2vec.incremental import write_incremental_sequences
+from src.diff2vec.word2vec import Word2Vec
+
+
+def main(args: Any):
+    if not os.path.isdir(args.out_dir): os.makedirs(args.out_dir)
+    index: AddressIndex = AddressIndex(args.address_file)
+    state_file: str = os.path.join(args.out_dir, 'num-known.json')
+    if os.path.isfile(state_file):
+        with open(state_file, 'r') as fp:
+            num_known: int = json.load(fp)['num_known']
+        print(f'resuming: addresses from id {num_known} on are new.')
+    else:
+        num_known: int = len(index)
+        with open(f'{state_file}.tmp', 'w') as fp:
+            json.dump({'num_known': num_known}, fp)
+        os.replace(f'{state_file}.tmp', state_file)
+
+    print('reading txs',  end = '', flush=True)
+    from_addresses: List[np.array] = []
+    to_addresses: List[np.array] = []
+    for chunk in pd.read_csv(
+        args.transactions_csv, usecols = ['from_address', 'to_address'], chunksize = args.chunk_size):
+        from_addresses.append(chunk.from_address.to_numpy())
+        to_addresses.append(chunk.to_address.to_numpy())
+        print('.', end = '', flush=True)
+    print('')
+    # one delta segment for all new addresses
+    ids: np.array = index.add(np.concatenate(from_addresses + to_addresses))
+    node_a: np.array = ids[:sum(len(x) for x in from_addresses)]
+    node_b: np.array = ids[len(node_a):]
+    seeds: np.array = np.unique(np.concatenate([node_a, node_b]))
+    seeds: np.array = seeds[seeds >= num_known]
+    print(f'{len(seeds)} new addresses.')
+    if len(seeds) == 0:
+        os.remove(state_file)
+        return
+
+    graph: CSRGraph = CSRGraph.load(args.graph_dir)
+    corpus_dir: str = os.path.join(args.out_dir, 'corpus')
+    with BinaryCorpusWriter(corpus_dir) as writer:
+        count: int = write_incremental_sequences(
+            writer, graph, node_a, node_b, seeds,
+            k = args.k,
+            cover_size = args.cover_size,
+            walks_per_node = args.walks_per_node,
+            max_degree = args.max_degree,
+            seed = args.seed,
+        )
+    print(f'wrote {count} sequences.')
+
+    model: Word2Vec = Word2Vec.load(args.model_file)
+    model.workers = args.workers
+    added: int = model.update(
+        corpus_dir,
+        os.path.join(args.out_dir, 'cache'),
+        epochs = args.epochs,
+        old_lockf = args.old_lockf,
+        min_count = args.min_count,
+    )
+    print(f'added {added} words.')
+    model.save(os.path.join(args.out_dir, 'word2vec-incremental.model'))
+
+    found: np.array = np.array([model.wv.has_index_for(node) for node in seeds.tolist()], dtype=bool)
+    vectors: np.array = np.stack([model.wv.get_vector(node) for node in seeds[found].tolist()]) \
+        if found.any() else np.zeros((0, model.wv.vector_size), dtype=np.float32)
+    np.save(os.path.join(args.out_dir, 'new-ids.npy'), seeds[found])
+    np.save(os.path.join(args.out_dir, 'new-vectors.npy'), vectors)
+    print(f'embedded {int(found.sum())}/{len(seeds)} new addresses.')
+
+    if args.vectors_file is not None:
+        # row i is node i, as read by get_neighbors.py
+        model.save_node_vectors(args.vectors_file, num_nodes = len(index))
+
+    os.remove(state_file)  # done, the next batch starts from the full index
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument('transactions_csv', type=str, help='path to new transaction data')
+    parser.add_argument('address_file', type=str,
+                        help='path to sorted address array (see compress_graph.py); new addresses '
+                             'are saved as delta segments next to it')
+    parser.add_argument('graph_dir', type=str, help='path to CSR graph directory')
+    parser.add_argument('model_file', type=str, help='path to trained word2vec model')
+    parser.add_argument('out_dir', type=str, help='where to save outputs')
+    parser.add_argument('--k', type=int, default=2, help='neighbourhood size in hops (default: 2)')
+    parser.add_argument('--cover-size', type=int, default=80,
+                        help='size of subgraph (default: 80)')
+    parser.add_argument('--walks-per-node', type=int, default=10,
+                        help='sequences per new address (default: 10)')
+    parser.add_argument('--max-degree', type=int, default=1000,
+                        help='expand each node through at most this many neighbours (default: 1000)')
+    parser.add_argument('--epochs', type=int, default=3, help='epochs (default: 3)')
+    parser.add_argument('--old-lockf', type=float, default=0.0,
+                        help='learning rate scale of existing vectors, 0 freezes them (default: 0.0)')
+    parser.add_argument('--min-count', type=int, default=1, help='min count (default: 1)')
+    parser.add_argument('--workers', type=int, default=4, help='workers (default: 4)')
+    parser.add_argument('--chunk-size', type=int, default=1000000,
+                        help='Chunk size (default: 1000000)')
+    parser.add_argument('--vectors-file', type=str, default=None,
+                        help='also save the vectors of every node, row i is node i (default: None)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default: 42)')
+    args: Any = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,122 @@
+"""
+Run the diff2vec pipeline from a transactions csv to the embedding dump,
+the PCA / density arrays and the webapp's neighbour index, skipping the
+stages whose outputs are current (see src/utils/pipeline.py).
+
+All outputs go to `work_dir`. Options of a stage are set in a json
+config keyed by stage name, with the option names of its script:
+
+    {"make_sequences": {"cover-size": 30, "num-shards": 64, "workers": 16},
+     "run_word2vec": {"epochs": 10, "workers": 16}}
+
+Changing an option reruns that stage and the stages downstream of it
+whose inputs changed. Options that do not change the outputs (workers,
+threads, cache pages, ...) are not hashed.
+"""
+import os
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.utils.pipeline import Pipeline, Stage, script_stage
+
+# options that only change how fast a stage runs
+UNTRACKED: List[str] = ['workers', 'threads', 'cache-pages', 'tmp-dir', 'verbose', 'batch-size', 'block-size']
+
+
+def split_options(
+    config: Dict[str, Dict[str, Any]],
+    name: str,
+    defaults: Optional[Dict[str, Any]] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    options: Dict[str, Any] = dict(defaults or {})
+    options.update(config.get(name, {}))
+    tracked: Dict[str, Any] = {k: v for k, v in options.items() if k not in UNTRACKED}
+    untracked: Dict[str, Any] = {k: v for k, v in options.items() if k in UNTRACKED}
+    return tracked, untracked
+
+
+def get_stages(transactions_csv: str, work_dir: str, config: Dict[str, Dict[str, Any]]) -> List[Stage]:
+    path = lambda name: os.path.join(work_dir, name)
+    stages: List[Stage] = []
+
+    def add(name: str, positional: List[str], inputs: List[str], outputs: List[str],
+            defaults: Optional[Dict[str, Any]] = None):
+        options, untracked = split_options(config, name, defaults)
+        stages.append(script_stage(
+            name, f'scripts.diff2vec.{name}', positional, inputs, outputs,
+            options = options, untracked = untracked))
+
+    add('make_graph', [transactions_csv, path('graph.csv')], [transactions_csv], [path('graph.csv')])
+    add('compress_graph',
+        [path('graph.csv'), path('graph-compressed.csv'), path('graph-address.npy')],
+        [path('graph.csv')],
+        [path('graph-compressed.csv'), path('graph-address.npy'), path('csr')],
+        defaults = {'csr-dir': path('csr')})
+    add('make_components', [path('csr'), path('components.jsonl')], [path('csr')], [path('components.jsonl')])
+
+    sequences: Dict[str, Any] = config.get('make_sequences', {})
+    sequences_file: str = path('sequences') if sequences.get('num-shards', 0) > 1 else path('sequences.jsonl')
+    inputs: List[str] = [path('csr'), path('components.jsonl')]
+    outputs: List[str] = [sequences_file]
+    defaults: Dict[str, Any] = {}
+    if sequences.get('exclude-exchanges') is not None:
+        inputs += [sequences['exclude-exchanges'], path('graph-address.npy')]
+        defaults['address-file'] = path('graph-address.npy')
+    if sequences.get('exclude-exchanges') is not None or sequences.get('max-degree', 0) > 0:
+        outputs.append(path('csr-hubs'))
+        defaults['hub-dir'] = path('csr-hubs')
+    add('make_sequences', [path('csr'), path('components.jsonl'), sequences_file], inputs, outputs, defaults)
+
+    add('run_word2vec', [sequences_file, path('model')], [sequences_file],
+        [path('model'), path('vectors.npy')], defaults = {'vectors-file': path('vectors.npy')})
+
+    k: int = config.get('get_neighbors', {}).get('k', 10)
+    add('get_neighbors', [path('vectors.npy'), path('neighbors')], [path('vectors.npy')], [path('neighbors')])
+    add('dump_neighbors',
+        [path(f'neighbors/distances-k{k}.npy'), path(f'neighbors/neighbors-k{k}.npy'),
+         path('graph-address.npy'), path('dump')],
+        [path('neighbors'), path('graph-address.npy')],
+        [path('dump/diff2vec-processed.pgcopy')])
+    add('make_ann', [path('vectors.npy'), path('graph-address.npy'), path('ann')],
+        [path('vectors.npy'), path('graph-address.npy'), path('neighbors')], [path('ann')],
+        defaults = {'index-file': path('neighbors/faiss.index')})
+
+    add('make_reduction', [path('vectors.npy')], [path('vectors.npy')], [path('vectors-pca.npy')])
+    add('make_density', [path('vectors-pca.npy')], [path('vectors-pca.npy')], [path('vectors-pca-density.npy')])
+    return stages
+
+
+def main(args: Any):
+    config: Dict[str, Dict[str, Any]] = {}
+    if args.config is not None:
+        with open(args.config) as fp:
+            config: Dict[str, Dict[str, Any]] = json.load(fp)
+
+    stages: List[Stage] = get_stages(args.transactions_csv, args.work_dir, config)
+    if args.stop_after is not None:
+        names: List[str] = [stage.name for stage in stages]
+        stages: List[Stage] = stages[:names.index(args.stop_after) + 1]
+
+    pipeline: Pipeline = Pipeline(stages, os.path.join(args.work_dir, '.pipeline'))
+    ran: List[str] = pipeline.run(jobs = args.jobs, force = args.force, dry_run = args.dry_run)
+    print(f'{len(ran)} of {len(stages)} stages {"would run" if args.dry_run else "ran"}')
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument('transactions_csv', type=str, help='path to transactions csv')
+    parser.add_argument('work_dir', type=str, help='where to save outputs and pipeline state')
+    parser.add_argument('--config', type=str, default=None,
+                        help='json file of script options per stage (default: None)')
+    parser.add_argument('--jobs', type=int, default=2,
+                        help='stages run at the same time (default: 2)')
+    parser.add_argument('--force', type=str, nargs='*', default=[],
+                        help='rerun these stages and their downstream stages (default: [])')
+    parser.add_argument('--stop-after', type=str, default=None,
+                        help='only run the stages up to this one, in declaration order (default: None)')
+    parser.add_argument('--dry-run', action='store_true', default=False,
+                        help='only print which stages would run (default: False)')
+    args: Any = parser.parse_args()
+
+    main(args)
@@ -32,31 +32,38 @@ class TrainCallback(CallbackAny2Vec):
 
 def main(args: Any):
     cache_dir: str = os.path.join(args.model_dir)
-    Word2Vec(
+    model: Word2Vec = Word2Vec(
         corpus_file = args.corpus_file,
         corpus_size = args.corpus_size,
         vector_size = args.dim,
         workers = args.workers,
         epochs = args.epochs,
         alpha = args.lr,
+        min_count = args.min_count,
         seed = args.seed,
         cache_dir = cache_dir,
         callbacks = [TrainCallback(args.model_dir)],
     )
+    if args.vectors_file is not None:
+        model.save_node_vectors(args.vectors_file)
 
 
 if __name__ == "__main__":
     from argparse import ArgumentParser
     parser: ArgumentParser = ArgumentParser()
-    parser.add_argument('corpus_file', type=str, help='path to cached sequences')
+    parser.add_argument('corpus_file', type=str, 
+                        help='path to cached sequences, a directory of shards, or a binary corpus')
     parser.add_argument('model_dir', type=str, help='path to save model')
-    parser.add_argument('--corpus-size', type=int, default=263644512, help='epochs (default: 263644512)')
+    parser.add_argument('--corpus-size', type=int, default=None, 
+                        help='number of sentences, checked when scanning json sequences (default: None)')
     parser.add_argument('--epochs', type=int, default=5, help='epochs (default: 5)')
     parser.add_argument('--workers', type=int, default=4, help='workers (default: 4)')
     parser.add_argument('--min-count', type=int, default=5, help='min count (default: 5)')
     parser.add_argument('--lr', type=float, default=0.025, help='learning rate (default: 0.025)')
-    parser.add_argument('--dim', type=float, default=128, help='dimensionality (default: 128)')
-    parser.add_argument('--seed', type=float, default=42, help='random seed (default: 42)')
+    parser.add_argument('--dim', type=int, default=128, help='dimensionality (default: 128)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default: 42)')
+    parser.add_argument('--vectors-file', type=str, default=None,
+                        help='also save node vectors as .npy, row i is node i (default: None)')
     args: Any = parser.parse_args()
 
     main(args)
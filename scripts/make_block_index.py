@@ -0,0 +1,22 @@
+"""
+Build the sidecar block offset index for a csv sorted by block number.
+Re-running on a csv that has grown only indexes the appended rows.
+"""
+from typing import Any
+from src.utils.blockindex import BlockIndex
+
+
+def main(args: Any):
+    index: BlockIndex = BlockIndex.load_or_build(args.csv_file, column=args.column)
+    print(f'indexed {len(index.blocks)} blocks ({index.num_rows} rows).')
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument('csv_file', type=str, help='path to csv sorted by block')
+    parser.add_argument('--column', type=str, default='block_number',
+                        help='block number column (default: block_number)')
+    args: Any = parser.parse_args()
+
+    main(args)
@@ -1,4 +1,5 @@
-from typing import Any, Dict, List, Set
+import itertools
+from typing import Any, Dict, List, Set, Tuple
 from src.utils.loader import DataframeLoader
 from src.cluster.deposit import DepositCluster
 
@@ -52,16 +53,31 @@ def main(args: Any):
     else:
         raise Exception(f'Dataset {args.dataset} not supported.')
 
+    # grid of (t_max, a_max) pairs evaluated in a single pass
+    sweep: List[Tuple[float, float]] = []
+    if (args.sweep_t_max is not None) or (args.sweep_a_max is not None):
+        sweep: List[Tuple[float, float]] = list(itertools.product(
+            args.sweep_t_max or [args.t_max],
+            args.sweep_a_max or [args.a_max],
+        ))
+
     algo = DepositCluster(
         loader,
         a_max = args.a_max,
         t_max = args.t_max,
         save_dir = args.save_dir,
+        checkpoint_every = args.checkpoint_every,
+        chunk_bytes = int(args.chunk_mb * 2**20),
+        sweep = sweep,
     )
 
     # this saves user/deposit/exchange columns but does not 
     # compute weakly connected components. See run_nx.py.
-    algo.make_clusters()
+    algo.make_clusters(
+        resume = args.resume,
+        start_block = args.start_block,
+        end_block = args.end_block,
+    )
     print('done.')
 
 
@@ -79,6 +95,22 @@ if __name__ == "__main__":
                         help='maximum amount difference (default: 0.01)')
     parser.add_argument('--t-max', type=float, default=3200,
                         help='maximum time difference (default: 3200)')
+    parser.add_argument('--checkpoint-every', type=int, default=0,
+                        help='save a checkpoint every N chunks, 0 disables (default: 0)')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help='resume from the last checkpoint in save_dir (default: False)')
+    parser.add_argument('--chunk-mb', type=float, default=0,
+                        help='read block-aligned chunks of this many MB via the block index, '
+                             '0 uses fixed row chunks (default: 0)')
+    parser.add_argument('--start-block', type=int, default=None,
+                        help='first block to process, needs --chunk-mb (default: None)')
+    parser.add_argument('--end-block', type=int, default=None,
+                        help='last block to process, needs --chunk-mb (default: None)')
+    parser.add_argument('--sweep-t-max', type=float, nargs='+', default=None,
+                        help='sweep over these maximum time differences, outputs go to '
+                             'save_dir/t{t_max}-a{a_max}/ (default: None)')
+    parser.add_argument('--sweep-a-max', type=float, nargs='+', default=None,
+                        help='sweep over these maximum amount differences (default: None)')
     args: Any = parser.parse_args()
 
     main(args)
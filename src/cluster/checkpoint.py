@@ -0,0 +1,115 @@
+"""
+Checkpointing for long running clustering jobs.
+
+A checkpoint is made of two files inside `save_dir`: a JSON state file
+and a CSV holding the carry-over buffer (the "last chunk"). Both are
+written to a temporary file and moved into place with `os.replace` so
+a crash at any point leaves either the previous or the new checkpoint,
+never a half written one. The state file is always replaced last, and
+it names the buffer file it belongs to.
+"""
+import os
+import json
+import pandas as pd
+from glob import glob
+from typing import Any, Dict, List, Tuple
+
+
+def _fsync_file(path: str):
+    with open(path, 'rb') as fp:
+        os.fsync(fp.fileno())
+
+
+def get_offsets(files: Dict[str, str]) -> Dict[str, int]:
+    """
+    Current size (in bytes) of each output file. Missing files count as 0.
+    """
+    offsets: Dict[str, int] = {}
+    for name, path in files.items():
+        offsets[name] = os.path.getsize(path) if os.path.isfile(path) else 0
+    return offsets
+
+
+def truncate_files(files: Dict[str, str], offsets: Dict[str, int]):
+    """
+    Cut each output file back to the size recorded in a checkpoint. This
+    drops any rows appended after the checkpoint was made.
+    """
+    for name, path in files.items():
+        offset: int = offsets.get(name, 0)
+        size: int = os.path.getsize(path) if os.path.isfile(path) else 0
+        if size < offset:
+            raise Exception(
+                f'{path} is smaller than its checkpoint ({size} < {offset} bytes).')
+        if size > offset:
+            with open(path, 'r+b') as fp:
+                fp.truncate(offset)
+
+
+class Checkpoint:
+    """
+    Save and restore the progress of `DepositCluster.make_clusters`.
+
+    @save_dir: (str) directory holding the checkpoint files
+    @name: (str) prefix for checkpoint files
+    """
+
+    def __init__(self, save_dir: str, name: str = 'checkpoint'):
+        self.save_dir: str = save_dir
+        self.name: str = name
+        self.state_file: str = os.path.join(save_dir, f'{name}.json')
+
+    def _chunk_file(self, chunk_count: int) -> str:
+        return os.path.join(self.save_dir, f'{self.name}-lastchunk-{chunk_count}.csv')
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.state_file)
+
+    def save(
+        self,
+        state: Dict[str, Any],
+        last_chunk: pd.DataFrame,
+        files: Dict[str, str] = {},
+    ):
+        """
+        Persist `state` and the carry-over buffer. Output `files` are synced
+        to disk first so the offsets in `state` are never ahead of the data.
+        """
+        for path in files.values():
+            if os.path.isfile(path):
+                _fsync_file(path)
+
+        chunk_file: str = self._chunk_file(state['chunk_count'])
+        tmp_chunk_file: str = f'{chunk_file}.tmp'
+        last_chunk.to_csv(tmp_chunk_file, index=False)
+        _fsync_file(tmp_chunk_file)
+        os.replace(tmp_chunk_file, chunk_file)
+
+        state: Dict[str, Any] = {**state, 'last_chunk_file': os.path.basename(chunk_file)}
+        tmp_state_file: str = f'{self.state_file}.tmp'
+        with open(tmp_state_file, 'w') as fp:
+            json.dump(state, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_state_file, self.state_file)
+
+        # only now is it safe to drop older buffers
+        for path in glob(os.path.join(self.save_dir, f'{self.name}-lastchunk-*.csv')):
+            if path != chunk_file:
+                os.remove(path)
+
+    def load(self) -> Tuple[Dict[str, Any], pd.DataFrame]:
+        with open(self.state_file, 'r') as fp:
+            state: Dict[str, Any] = json.load(fp)
+        chunk_file: str = os.path.join(self.save_dir, state['last_chunk_file'])
+        # round_trip so floats read back bit for bit: the default parser can
+        # be off in the last digit, which changes the resumed output
+        last_chunk: pd.DataFrame = pd.read_csv(chunk_file, float_precision='round_trip')
+        return state, last_chunk
+
+    def clear(self):
+        paths: List[str] = glob(os.path.join(self.save_dir, f'{self.name}-lastchunk-*'))
+        paths.append(self.state_file)
+        for path in paths:
+            if os.path.isfile(path):
+                os.remove(path)
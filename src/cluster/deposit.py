@@ -3,13 +3,14 @@ import json
 import numpy as np
 import pandas as pd
 from copy import copy
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Iterable, Tuple, Optional
 
 pd.options.mode.chained_assignment = None 
 
-from src.utils.utils import Entity, Heuristic, JSONSetEncoder
+from src.utils.utils import Entity, Heuristic, JSONSetEncoder, isin_sorted
 from src.utils.loader import DataframeLoader
 from src.cluster.base import BaseCluster
+from src.cluster.checkpoint import Checkpoint, get_offsets, truncate_files
 
 
 class DepositCluster(BaseCluster):
@@ -25,12 +26,24 @@ class DepositCluster(BaseCluster):
         a_max: float = 0.01,  # max amount diff (in ether)
         t_max: float = 3200,  # max time diff (in blocks)
         save_dir: str = './',
+        checkpoint_every: int = 0,  # chunks between checkpoints (0 = off)
+        chunk_bytes: int = 0,  # block-aligned chunk budget (0 = fixed rows)
+        sweep: Optional[List[Tuple[float, float]]] = None,  # (t_max, a_max) pairs
     ):
         super().__init__(loader)
+        sweep: List[Tuple[float, float]] = sweep or []
+
+        if len(sweep) > 0:
+            # one pass with the loosest thresholds, filtered per pair
+            t_max: float = max(t for t, _ in sweep)
+            a_max: float = max(a for _, a in sweep)
 
         self.a_max: float = a_max
         self.t_max: float = t_max
+        self.sweep: List[Tuple[float, float]] = sweep
         self.save_dir: str = save_dir
+        self.checkpoint_every: int = checkpoint_every
+        self.chunk_bytes: int = chunk_bytes
         self._last_chunk: pd.DataFrame = pd.DataFrame()
 
     def get_last_chunk(self) -> pd.DataFrame:
@@ -40,92 +53,244 @@ class DepositCluster(BaseCluster):
         df.value = df.value.astype(float) / 10**18
         self._last_chunk: pd.DataFrame = df
 
-    def make_clusters(self):
+    @staticmethod
+    def get_sweep_dir(t_max: float, a_max: float) -> str:
+        return f't{t_max:g}-a{a_max:g}'
+
+    def _get_targets(self) -> List[Tuple[float, float, str]]:
+        """
+        (t_max, a_max, output directory) for every set of outputs to write.
+        """
+        if len(self.sweep) == 0:
+            return [(self.t_max, self.a_max, self.save_dir)]
+        return [
+            (t_max, a_max, os.path.join(self.save_dir, self.get_sweep_dir(t_max, a_max)))
+            for t_max, a_max in self.sweep
+        ]
+
+    def make_clusters(
+        self,
+        resume: bool = False,
+        start_block: Optional[int] = None,
+        end_block: Optional[int] = None,
+    ):
+        """
+        @resume: (bool) continue from the last checkpoint in `save_dir`, if 
+            any. Output rows written after that checkpoint are truncated.
+        @start_block, @end_block: (int) restrict the run to a block window.
+            Only supported with block-aligned chunks (`chunk_bytes > 0`).
+
+        If `chunk_bytes` is set, chunks are read through the sidecar block
+        index: they end on block boundaries and hold at most `chunk_bytes`
+        of csv. The carry-over is then exactly the last `t_max` blocks and
+        a match is only kept in the chunk holding its exchange transaction,
+        so no match is written twice.
+
+        If `sweep` is set, candidate matches are found once with the largest
+        thresholds and every (t_max, a_max) pair gets its own outputs in
+        `save_dir/t{t_max}-a{a_max}/`, obtained by filtering on the block
+        gap and amount difference of each match. Since `merge_asof` keeps
+        the nearest earlier transaction, this is the same as running with
+        each pair separately (up to chunking in the fixed row mode).
+        """
+        block_aligned: bool = self.chunk_bytes > 0
+        assert block_aligned or (start_block is None and end_block is None), \
+            "block windows require chunk_bytes > 0."
+
         # seed last chunk 
         last_chunk: pd.DataFrame = copy(self._last_chunk)
 
         # assumes a maximum of 10k txs per block. 
         max_txs_per_block: int = 10000
-        chunk_size: int = max_txs_per_block * self.t_max
+        chunk_size: int = int(max_txs_per_block * self.t_max)
         chunk_count: int = 0
+        rows_read: int = 0  # number of transaction rows consumed
 
         # save data about (unique) addresses
-        metadata_file: str = os.path.join(self.save_dir, 'metadata.csv')
-        result_file: str = os.path.join(self.save_dir, 'data.csv')
-        tx_file: str = os.path.join(self.save_dir, 'transactions.csv')
+        targets: List[Tuple[float, float, str]] = self._get_targets()
+        out_files: Dict[str, str] = {}
+        for _, _, out_dir in targets:
+            if not os.path.isdir(out_dir): os.makedirs(out_dir)
+            prefix: str = os.path.relpath(out_dir, self.save_dir)
+            prefix: str = '' if prefix == '.' else f'{prefix}/'
+            for name, out_file in self._get_out_files(out_dir).items():
+                out_files[f'{prefix}{name}'] = out_file
+
+        checkpoint: Checkpoint = Checkpoint(self.save_dir)
+        if resume and checkpoint.exists():
+            state, last_chunk = checkpoint.load()
+            assert (state['t_max'] == self.t_max) and (state['a_max'] == self.a_max), \
+                "checkpoint was made with different t_max / a_max."
+            assert state.get('chunk_bytes', 0) == self.chunk_bytes, \
+                "checkpoint was made with a different chunking mode."
+            assert state.get('sweep', []) == [list(pair) for pair in self.sweep], \
+                "checkpoint was made with a different sweep."
+            truncate_files(out_files, state['offsets'])
+            chunk_count: int = state['chunk_count']
+            rows_read: int = state['rows_read']
+            print(f'resuming after block {state["last_block"]} '
+                  f'({chunk_count} chunks, {rows_read} txs).')
+        elif resume:
+            print('no checkpoint found. starting from scratch.')
 
         print('processing txs',  end = '', flush=True)
 
-        for tx_chunk in self.loader.yield_transactions(chunk_size):
+        if block_aligned:
+            if chunk_count > 0:  # resuming
+                start_block: int = state['last_block'] + 1
+            tx_chunks: Iterable[pd.DataFrame] = self.loader.yield_transaction_blocks(
+                self.chunk_bytes, start_block = start_block, end_block = end_block)
+        else:
+            tx_chunks: Iterable[pd.DataFrame] = \
+                self.loader.yield_transactions(chunk_size, skip_rows = rows_read)
+
+        for tx_chunk in tx_chunks:
             # make numeric and convert wei -> eth 
             tx_chunk.value = tx_chunk.value.astype(float) / 10**18
             min_block: int = tx_chunk.block_number.min()
             max_block: int = tx_chunk.block_number.max()
 
-            # join the last chunk and current chunk
-            both_chunks: pd.DataFrame = last_chunk.append(tx_chunk)
+            # join the last chunk and current chunk (appending to the empty
+            # first buffer would change the dtypes of the first chunk)
+            if len(last_chunk) > 0:
+                both_chunks: pd.DataFrame = last_chunk.append(tx_chunk)
+            else:
+                both_chunks: pd.DataFrame = tx_chunk
 
-            result, tx_result = self._cluster_chunk(
+            matches: pd.DataFrame = self._match_chunk(
                 both_chunks,
                 self.loader.get_exchanges(),
                 self.loader.get_miners(),
                 self.loader.get_blacklist(),
+                min_block = min_block if block_aligned else None,
             )
-            result: pd.DataFrame = result
-            tx_result: pd.DataFrame = tx_result
-
-            """
-            Add confidence to dataframe.
-
-            NOTE: some clusters may contain multiple deposits. For now, 
-            we opt for the simple thing and allow multiple deposits in 
-            the same cluster to have different confidences. All EOAs 
-            attached to each deposit will have its corresponding `conf`. 
-
-            An alternative strategy may be to set all elements in the 
-            cluster to a minimum value, although both strategies have 
-            pros and cons. For example, if one deposit has conf 0.99 and
-            the other conf 0.01, it seems wrong to set the former to 0.01.
-            """
-            scores: pd.DataFrame = self._get_confidence(result)
-            result['conf'] = scores
-            tx_result['conf'] = scores
-
-            """
-            Metadata stores information we might be interested in storing 
-            about unique addresses. Does not store anything in memory.
-
-            Data only stores (user, deposit, exchange) tuples. 
-
-            This division is helpful as to prevent a huge file. In clustering, 
-            for example, we do not care about metadata. 
-            """
-            metadata: Dict[str, Dict[str, Any]] = self._make_metadata(result)
-            if chunk_count == 0:
-                metadata.to_csv(metadata_file, index=False)
-                result.to_csv(result_file, index=False)
-                tx_result.to_csv(tx_file, index=False)
-            else:
-                metadata.to_csv(metadata_file, mode='a', header=False, index=False)
-                result.to_csv(result_file, mode='a', header=False, index=False)
-                tx_result.to_csv(tx_file, mode='a', header=False, index=False)
 
-            if (max_block - min_block <= self.t_max):
-                print('Consider choosing a larger chunksize.')
+            for t_max, a_max, out_dir in targets:
+                result, tx_result = self._select_matches(matches, t_max, a_max)
+                result: pd.DataFrame = result
+                tx_result: pd.DataFrame = tx_result
+
+                """
+                Add confidence to dataframe.
+
+                NOTE: some clusters may contain multiple deposits. For now, 
+                we opt for the simple thing and allow multiple deposits in 
+                the same cluster to have different confidences. All EOAs 
+                attached to each deposit will have its corresponding `conf`. 
+
+                An alternative strategy may be to set all elements in the 
+                cluster to a minimum value, although both strategies have 
+                pros and cons. For example, if one deposit has conf 0.99 and
+                the other conf 0.01, it seems wrong to set the former to 0.01.
+                """
+                scores: pd.DataFrame = self._get_confidence(
+                    result, t_max = t_max, a_max = a_max)
+                result['conf'] = scores
+                tx_result['conf'] = scores
+
+                self._write_chunk(out_dir, result, tx_result, append = chunk_count > 0)
+
+            if block_aligned:
+                # exactly the blocks a later exchange tx can reach back to
+                last_chunk: pd.DataFrame = both_chunks[
+                    both_chunks.block_number >= (max_block - self.t_max)
+                ].copy()
+            else:
+                if (max_block - min_block <= self.t_max):
+                    print('Consider choosing a larger chunksize.')
 
-            # this ensures we always have at least t_max
-            # also provides some overlap
-            last_chunk: pd.DataFrame = tx_chunk[
-                tx_chunk.block_number >= (min_block - (self.t_max + 1))
-            ].copy()
+                # this ensures we always have at least t_max
+                # also provides some overlap
+                last_chunk: pd.DataFrame = tx_chunk[
+                    tx_chunk.block_number >= (min_block - (self.t_max + 1))
+                ].copy()
 
             print('.', end = '', flush=True)  # progress bar
             chunk_count += 1
-
-            del metadata, result, tx_result, tx_chunk, scores, both_chunks
+            rows_read += len(tx_chunk)
+
+            if (self.checkpoint_every > 0) and (chunk_count % self.checkpoint_every == 0):
+                state: Dict[str, Any] = {
+                    'chunk_count': chunk_count,
+                    'rows_read': rows_read,
+                    'last_block': int(max_block),
+                    'offsets': get_offsets(out_files),
+                    't_max': self.t_max,
+                    'a_max': self.a_max,
+                    'chunk_bytes': self.chunk_bytes,
+                    'sweep': [list(pair) for pair in self.sweep],
+                }
+                checkpoint.save(state, last_chunk, files = out_files)
+
+            del matches, result, tx_result, tx_chunk, scores, both_chunks
+
+        # a finished run must not be resumed by the next one
+        checkpoint.clear()
 
         self._last_chunk = copy(last_chunk)
 
+    def cluster_blocks(
+        self,
+        start_block: int,
+        end_block: int,
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Replay the heuristic on a single block window, e.g. for debugging.
+        Reads the window plus `t_max` blocks of look-back through the block
+        index, so no full scan is needed. Nothing is written to disk.
+        """
+        tx_chunk: pd.DataFrame = self.loader.read_transaction_blocks(
+            int(start_block - self.t_max), end_block)
+        tx_chunk.value = tx_chunk.value.astype(float) / 10**18
+
+        result, tx_result = self._cluster_chunk(
+            tx_chunk,
+            self.loader.get_exchanges(),
+            self.loader.get_miners(),
+            self.loader.get_blacklist(),
+            min_block = start_block,
+        )
+        scores: pd.DataFrame = self._get_confidence(result)
+        result['conf'] = scores
+        tx_result['conf'] = scores
+
+        return result, tx_result
+
+    @staticmethod
+    def _get_out_files(out_dir: str) -> Dict[str, str]:
+        return {
+            'metadata': os.path.join(out_dir, 'metadata.csv'),
+            'data': os.path.join(out_dir, 'data.csv'),
+            'transactions': os.path.join(out_dir, 'transactions.csv'),
+        }
+
+    def _write_chunk(
+        self,
+        out_dir: str,
+        result: pd.DataFrame,
+        tx_result: pd.DataFrame,
+        append: bool = True,
+    ):
+        """
+        Metadata stores information we might be interested in storing 
+        about unique addresses. Does not store anything in memory.
+
+        Data only stores (user, deposit, exchange) tuples. 
+
+        This division is helpful as to prevent a huge file. In clustering, 
+        for example, we do not care about metadata. 
+        """
+        out_files: Dict[str, str] = self._get_out_files(out_dir)
+        metadata: pd.DataFrame = self._make_metadata(result)
+        if not append:
+            metadata.to_csv(out_files['metadata'], index=False)
+            result.to_csv(out_files['data'], index=False)
+            tx_result.to_csv(out_files['transactions'], index=False)
+        else:
+            metadata.to_csv(out_files['metadata'], mode='a', header=False, index=False)
+            result.to_csv(out_files['data'], mode='a', header=False, index=False)
+            tx_result.to_csv(out_files['transactions'], mode='a', header=False, index=False)
+
     def _make_metadata(self, data: pd.DataFrame):
         """
         Store anything we may want to lookup about these people.
@@ -184,9 +349,32 @@ class DepositCluster(BaseCluster):
         self,
         tx_chunk: pd.DataFrame,
         exchanges: pd.DataFrame,
-        miners: pd.DataFrame,
+        miners: np.array,
         blacklist: pd.DataFrame,
+        min_block: Optional[int] = None,
     ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        @min_block: (int) if given, only keep matches whose exchange 
+            transaction is at or after this block. Earlier rows are only 
+            there to look back into.
+        """
+        deposit: pd.DataFrame = self._match_chunk(
+            tx_chunk, exchanges, miners, blacklist, min_block = min_block)
+        return self._select_matches(deposit, self.t_max, self.a_max)
+
+    def _match_chunk(
+        self,
+        tx_chunk: pd.DataFrame,
+        exchanges: pd.DataFrame,
+        miners: np.array,
+        blacklist: pd.DataFrame,
+        min_block: Optional[int] = None,
+    ) -> pd.DataFrame:
+        """
+        Candidate (user -> deposit -> exchange) matches within `self.t_max`
+        and `self.a_max`, with their block gap `t_diff` and amount
+        difference `a_diff`. See `_cluster_chunk`.
+        """
         exchange_addrs: np.array = exchanges.address
         blacklist_addrs: np.array = blacklist.address
 
@@ -196,7 +384,7 @@ class DepositCluster(BaseCluster):
         tx_chunk['block'] = tx_chunk['block_number']  # dummy column
 
         # sender should not be a miner (avoid mining pools)
-        tx_chunk: pd.DataFrame = tx_chunk[~tx_chunk['from_address'].isin(miners)]
+        tx_chunk: pd.DataFrame = tx_chunk[~isin_sorted(tx_chunk['from_address'], miners)]
 
         # check if receiver is an exchange
         is_exchange: pd.DataFrame = tx_chunk[tx_chunk['to_address'].isin(exchange_addrs)].copy()
@@ -226,7 +414,11 @@ class DepositCluster(BaseCluster):
             suffixes=['_y', '_x'],
         ).dropna()
 
-        deposit['t_diff'] = deposit['block_number_y'] - deposit['block_number_x']
+        if min_block is not None:
+            deposit: pd.DataFrame = deposit[deposit.block_number_y >= min_block]
+
+        # blocks are whole numbers, but the asof merge may have made them floats
+        deposit['t_diff'] = (deposit['block_number_y'] - deposit['block_number_x']).astype(int)
         deposit['a_diff'] = deposit['value_x'] - deposit['value_y']
 
         # round to ignore small errors
@@ -234,6 +426,22 @@ class DepositCluster(BaseCluster):
             (deposit.a_diff.round(3) <= self.a_max) & 
             (deposit.a_diff.round(3) >= 0)
         ]
+        return deposit
+
+    def _select_matches(
+        self,
+        deposit: pd.DataFrame,
+        t_max: float,
+        a_max: float,
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Keep matches from `_match_chunk` within `t_max` and `a_max` and
+        split them into (user, deposit, exchange) rows and transactions.
+        """
+        if (t_max < self.t_max) or (a_max < self.a_max):
+            deposit: pd.DataFrame = deposit[
+                (deposit.t_diff <= t_max) & (deposit.a_diff.round(3) <= a_max)
+            ]
 
         # keep important columns and rename
         results: pd.DataFrame = deposit[
@@ -257,6 +465,8 @@ class DepositCluster(BaseCluster):
         tx_chunk: pd.DataFrame,
         time_weight: float = 1,
         amount_weight: float = 1,
+        t_max: Optional[float] = None,
+        a_max: Optional[float] = None,
     ) -> pd.DataFrame:
         """
         For the deposit reuse heuristic, the confidence of a cluster 
@@ -285,11 +495,17 @@ class DepositCluster(BaseCluster):
 
         Note that this algorithm is not without hyperparameters. There 
         are two hyperparameters fitting the beta distribution.
+
+        @t_max, @a_max: (float) maxima to interpolate to (default: the
+            instance's thresholds). Used by sweeps.
         """
-        t_score: pd.DataFrame = tx_chunk['t_diff'].abs() / self.t_max
+        t_max: float = self.t_max if t_max is None else t_max
+        a_max: float = self.a_max if a_max is None else a_max
+
+        t_score: pd.DataFrame = tx_chunk['t_diff'].abs() / t_max
         t_score: pd.DataFrame = t_score.clip(0, 1)
 
-        a_score: pd.DataFrame = tx_chunk['a_diff'].abs() / self.a_max
+        a_score: pd.DataFrame = tx_chunk['a_diff'].abs() / a_max
         a_score: pd.DataFrame = a_score.clip(0, 1)
 
         def get_confidence(score):
@@ -0,0 +1,270 @@
+"""
+Persistent union-find (disjoint set) for incremental clustering.
+
+Instead of rebuilding a graph over all historical edges to find weakly
+connected components, we keep the disjoint set forest on disk and only
+feed it the new edges of each day. The forest is made of three memory
+mapped arrays indexed by address id:
+
+    parent: int64, parent pointer (roots point to themselves)
+    count:  int64, number of members, only meaningful at roots
+    next:   int64, circular linked list over the members of each set,
+            so a cluster can be listed without scanning all addresses
+
+plus the id <-> address map, an `AddressIndex` (src/diff2vec/addresses.py):
+each call to `add` appends the day's new addresses as a delta segment,
+so neither saving nor opening the store touches the full history. The
+number of addresses in the map is the size of the forest. Arrays grow
+by resizing their files. The id of a cluster is the id of its root.
+
+Sets are merged by size: the smaller set is absorbed and takes the root
+of the larger one, so when a few new addresses join a large cluster only
+their ids change.
+"""
+import os
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional
+
+from src.diff2vec.addresses import AddressIndex, to_fixed_bytes
+
+
+class DiskUnionFind:
+    """
+    Union-find over string addresses, stored in `save_dir`.
+
+    @save_dir: (str) directory holding the arrays and address map
+    @capacity: (int) initial number of slots when creating a new store
+    @width: (int) bytes per address in the address map
+    """
+
+    def __init__(self, save_dir: str, capacity: int = 2**16, width: int = 42):
+        self.save_dir: str = save_dir
+        self.address_file: str = os.path.join(save_dir, 'addresses.npy')
+        self._dtypes: Dict[str, Any] = {
+            'parent': np.int64,
+            'count': np.int64,
+            'next': np.int64,
+        }
+
+        if not os.path.isfile(self.address_file):
+            if not os.path.isdir(save_dir): os.makedirs(save_dir)
+            for name, dtype in self._dtypes.items():
+                with open(self._array_file(name), 'wb') as fp:
+                    fp.truncate(capacity * np.dtype(dtype).itemsize)
+            # the address map is created last, it marks a complete store
+            tmp_file: str = f'{self.address_file}.tmp'
+            with open(tmp_file, 'wb') as fp:
+                np.save(fp, np.array([], dtype=f'S{width}'))
+            os.replace(tmp_file, self.address_file)
+
+        self.index: AddressIndex = AddressIndex(self.address_file)
+        self.capacity: int = os.path.getsize(self._array_file('parent')) // 8
+        self._open()
+
+    def _array_file(self, name: str) -> str:
+        return os.path.join(self.save_dir, f'{name}.bin')
+
+    def _open(self):
+        self.parent: np.memmap = np.memmap(
+            self._array_file('parent'), dtype=np.int64, mode='r+', shape=(self.capacity,))
+        self.count: np.memmap = np.memmap(
+            self._array_file('count'), dtype=np.int64, mode='r+', shape=(self.capacity,))
+        self.next: np.memmap = np.memmap(
+            self._array_file('next'), dtype=np.int64, mode='r+', shape=(self.capacity,))
+
+    def _grow(self, capacity: int):
+        self.flush()
+        del self.parent, self.count, self.next
+        for name, dtype in self._dtypes.items():
+            with open(self._array_file(name), 'r+b') as fp:
+                fp.truncate(capacity * np.dtype(dtype).itemsize)
+        self.capacity: int = capacity
+        self._open()
+
+    @property
+    def size(self) -> int:
+        return len(self.index)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def encode(self, addresses: Iterable[str]) -> np.array:
+        """
+        Ids of `addresses`, -1 for addresses never added.
+        """
+        return self.index.encode(addresses)
+
+    def get_address(self, i: int) -> str:
+        return str(self.index.decode([i])[0])
+
+    def add(self, addresses: Iterable[str]) -> np.array:
+        """
+        Ids of `addresses`. Unseen addresses become new singleton sets.
+
+        Their slots are initialised and synced before the addresses are
+        saved to the map, so after a crash the map never names an id
+        whose slots hold garbage.
+        """
+        values: np.array = to_fixed_bytes(addresses, self.index.width)
+        num_new: int = len(np.unique(values[self.index.encode(values) < 0]))
+        if num_new > 0:
+            start: int = self.size
+            end: int = start + num_new
+            if end > self.capacity:
+                self._grow(max(end, 2 * self.capacity))
+            new_ids: np.array = np.arange(start, end, dtype=np.int64)
+            self.parent[start:end] = new_ids
+            self.count[start:end] = 1
+            self.next[start:end] = new_ids
+            self.flush()
+        return self.index.add(values)
+
+    def find(self, i: int) -> int:
+        # path halving
+        parent: np.memmap = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i: int = int(parent[i])
+        return int(i)
+
+    def union(self, i: int, j: int, moved: Optional[List[int]] = None) -> int:
+        """
+        Merge the sets holding ids `i` and `j`. Returns the new root, or
+        -1 if they already were in the same set.
+
+        @moved: (List[int]) if given, the members of the absorbed set
+            (whose root changes) are appended to it
+        """
+        root_i: int = self.find(i)
+        root_j: int = self.find(j)
+        if root_i == root_j:
+            return -1
+        if self.count[root_i] < self.count[root_j]:
+            root_i, root_j = root_j, root_i
+        if moved is not None:
+            moved.extend(self.member_ids(root_j))
+        self.parent[root_j] = root_i
+        self.count[root_i] += self.count[root_j]
+        # splice the two member lists together
+        self.next[root_i], self.next[root_j] = self.next[root_j], self.next[root_i]
+        return root_i
+
+    def union_edges(
+        self,
+        node_a: Iterable[str],
+        node_b: Iterable[str],
+        pending_file: Optional[str] = None,
+    ) -> np.array:
+        """
+        Ingest edges (node_a[k], node_b[k]). New addresses are registered
+        and saved (in one delta segment) before any union, so an
+        interrupted ingest leaves a valid forest and re-ingesting the same
+        edges is a no-op.
+
+        @pending_file: (str) if given, the returned ids accumulate in this
+            `.npy` file and are returned again by later calls, until the
+            caller removes it once the changes are applied. The endpoints
+            known so far and the first new id are saved to
+            `{pending_file}.ingest` before anything else, and removed at
+            the end: a re-run after a crash finds no new addresses or
+            unions, so every member of their clusters is returned instead.
+
+        Returns the sorted ids whose cluster changed: the new addresses
+        and every member of each absorbed set. Members of the surviving
+        set keep their root, so they are left out.
+        """
+        node_a: np.array = np.asarray(node_a, dtype=bytes)
+        node_b: np.array = np.asarray(node_b, dtype=bytes)
+        assert len(node_a) == len(node_b), "edge lists are uneven sizes."
+        nodes: np.array = np.concatenate([node_a, node_b])
+
+        pending: np.array = np.array([], dtype=np.int64)
+        if pending_file is not None:
+            ingest_file: str = f'{pending_file}.ingest'
+            if os.path.isfile(pending_file):
+                pending: np.array = np.load(pending_file)
+            if os.path.isfile(ingest_file):
+                # an earlier ingest stopped midway, its merges are unknown
+                with np.load(ingest_file) as ingest:
+                    touched: np.array = np.union1d(
+                        ingest['ids'], np.arange(int(ingest['start']), self.size))
+                recovered: List[int] = []
+                for root in np.unique(self.roots(touched)).tolist():
+                    recovered.extend(self.member_ids(root))
+                pending: np.array = np.union1d(pending, recovered)
+                save_ids(pending_file, pending)
+            known: np.array = self.encode(nodes)
+            tmp_file: str = f'{ingest_file}.tmp'
+            with open(tmp_file, 'wb') as fp:
+                np.savez(fp, ids = np.unique(known[known >= 0]), start = self.size)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(tmp_file, ingest_file)
+
+        start: int = self.size
+        ids: np.array = self.add(nodes)
+        moved: List[int] = list(range(start, self.size))
+        for i, j in zip(ids[:len(node_a)].tolist(), ids[len(node_a):].tolist()):
+            self.union(i, j, moved = moved)
+        self.flush()
+
+        moved: np.array = np.union1d(pending, np.asarray(moved, dtype=np.int64))
+        if pending_file is not None:
+            save_ids(pending_file, moved)
+            os.remove(ingest_file)
+        return moved
+
+    def member_ids(self, root: int) -> List[int]:
+        """
+        Ids in the set of id `root`, by walking its member list.
+        """
+        ids: List[int] = [root]
+        i: int = int(self.next[root])
+        while i != root:
+            ids.append(i)
+            i: int = int(self.next[i])
+        return ids
+
+    def members(self, root: int) -> List[str]:
+        """
+        Addresses in the set of id `root`.
+        """
+        return self.index.decode(self.member_ids(root)).tolist()
+
+    def roots(self, ids: Optional[np.array] = None) -> np.array:
+        """
+        Root of each of `ids` (default: every id), following the parent
+        pointers of all of them at once.
+        """
+        if ids is None:
+            ids: np.array = np.arange(self.size, dtype=np.int64)
+        roots: np.array = np.asarray(ids, dtype=np.int64)
+        while True:
+            parent: np.array = np.asarray(self.parent[roots])
+            if np.array_equal(parent, roots):
+                break
+            roots: np.array = parent
+        return roots
+
+    def flush(self):
+        self.parent.flush()
+        self.count.flush()
+        self.next.flush()
+
+    def save(self):
+        """
+        Sync the arrays. The address map is saved by `add`.
+        """
+        self.flush()
+
+
+def save_ids(path: str, ids: np.array):
+    """
+    Write `ids` to the `.npy` file `path` atomically.
+    """
+    tmp_file: str = f'{path}.tmp'
+    with open(tmp_file, 'wb') as fp:
+        np.save(fp, np.asarray(ids, dtype=np.int64))
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_file, path)
@@ -0,0 +1,191 @@
+"""
+Address interning for the diff2vec graph.
+
+Every distinct address is stored once in a sorted array of fixed-width
+byte strings, saved as a `.npy` file. The id of an address is its index
+in that array, so:
+
+    encode: vectorised binary search (`np.searchsorted`)
+    decode: array indexing
+
+and the file is memory mapped, so there is nothing to load up front.
+The array is built in one streaming pass: distinct addresses of each
+chunk are appended to bucket files keyed by their first characters,
+then each bucket is deduplicated and sorted on its own (an external
+bucket sort). Buckets follow the sort order of their keys, so the
+sorted buckets concatenate to the sorted array.
+
+Addresses first seen after the build are appended as delta segments
+(`add`): small sorted arrays saved next to the base file whose ids
+continue after the previous segment, so existing ids never change.
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+from tqdm import tqdm
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class AddressIndex:
+    """
+    Sorted, memory mapped array of distinct addresses (see `build`).
+
+    @addr_file: (str) path to the `.npy` file
+    """
+
+    def __init__(self, addr_file: str):
+        self.addr_file: str = addr_file
+        self.addresses: np.array = np.load(addr_file, mmap_mode='r')
+        self.width: int = self.addresses.dtype.itemsize
+        self._load_segments()
+
+    def _load_segments(self):
+        self.segments: List[np.array] = [self.addresses] + [
+            np.load(path, mmap_mode='r') for path in self.get_delta_files()]
+        self.starts: np.array = np.concatenate(
+            [[0], np.cumsum([len(segment) for segment in self.segments])]).astype(np.int64)
+
+    def get_delta_files(self) -> List[str]:
+        """
+        Delta segments of this index, in the order their ids were given.
+        """
+        return AddressIndex.find_delta_files(self.addr_file)
+
+    @staticmethod
+    def find_delta_files(addr_file: str) -> List[str]:
+        dirname: str = os.path.dirname(os.path.abspath(addr_file))
+        prefix: str = os.path.basename(addr_file)[:-len('.npy')] + '.delta'
+        return [
+            os.path.join(dirname, name) for name in sorted(os.listdir(dirname))
+            if name.startswith(prefix) and name.endswith('.npy')
+        ]
+
+    def __len__(self) -> int:
+        return int(self.starts[-1])
+
+    def encode(self, addresses: Iterable[str]) -> np.array:
+        """
+        Ids of `addresses` (int64), -1 for unknown addresses.
+        """
+        values: np.array = to_fixed_bytes(addresses, self.width)
+        out: np.array = np.full(len(values), -1, dtype=np.int64)
+        for segment, start in zip(self.segments, self.starts[:-1].tolist()):
+            if len(segment) == 0:
+                continue
+            ids: np.array = np.searchsorted(segment, values)
+            ids: np.array = np.minimum(ids, len(segment) - 1)
+            found: np.array = segment[ids] == values
+            out[found] = ids[found] + start
+        return out
+
+    def decode(self, ids: Any) -> np.array:
+        """
+        Addresses (as str) of an array of ids.
+        """
+        ids: np.array = np.asarray(ids, dtype=np.int64)
+        if len(self.segments) == 1:
+            return self.addresses[ids].astype(str)
+        out: np.array = np.empty(ids.shape, dtype=self.addresses.dtype)
+        which: np.array = np.searchsorted(self.starts, ids, side='right') - 1
+        for i, segment in enumerate(self.segments):
+            mask: np.array = which == i
+            if mask.any():
+                out[mask] = segment[ids[mask] - self.starts[i]]
+        return out.astype(str)
+
+    def add(self, addresses: Iterable[str]) -> np.array:
+        """
+        Ids of `addresses`, saving unknown ones as a new delta segment
+        (sorted, with ids after every existing id).
+        """
+        values: np.array = to_fixed_bytes(addresses, self.width)
+        new: np.array = np.unique(values[self.encode(values) < 0])
+        if len(new) > 0:
+            delta_file: str = self.addr_file[:-len('.npy')] + \
+                f'.delta{len(self.segments):04d}.npy'
+            tmp_file: str = f'{delta_file}.tmp'
+            with open(tmp_file, 'wb') as fp:
+                np.save(fp, new)
+            os.replace(tmp_file, delta_file)  # a segment is only visible once complete
+            self._load_segments()
+        return self.encode(values)
+
+    @staticmethod
+    def build(
+        yield_addresses: Iterable[Iterable[str]],
+        addr_file: str,
+        width: int = 42,
+        prefix: int = 4,
+        tmp_dir: Optional[str] = None,
+    ) -> "AddressIndex":
+        """
+        Build the index from chunks of addresses (duplicates allowed).
+        Delta segments of an index previously built at `addr_file` are
+        removed: their ids would follow the new base.
+
+        @width: (int) bytes per address; 42 fits a 0x-prefixed hex address
+        @prefix: (int) bucket on the first `prefix` characters ("0xab" is
+            one of 256 buckets for hex addresses)
+        @tmp_dir: (str) where to put the bucket files (default: next to
+            `addr_file`)
+        """
+        dtype: str = f'S{width}'
+        bucket_dir: str = tempfile.mkdtemp(
+            prefix='buckets-', dir=tmp_dir or os.path.dirname(os.path.abspath(addr_file)))
+        buckets: Dict[bytes, Any] = {}
+
+        print('bucketing addresses', end = '', flush=True)
+        for chunk in yield_addresses:
+            values: np.array = np.unique(to_fixed_bytes(chunk, width))
+            keys: np.array = values.astype(f'S{prefix}')
+            # values are sorted, so each key is a contiguous run
+            starts: np.array = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]])) \
+                if len(keys) > 0 else np.zeros(0, dtype=np.int64)
+            ends: List[int] = starts[1:].tolist() + [len(keys)]
+            for start, end in zip(starts.tolist(), ends):
+                key: bytes = keys[start]
+                if key not in buckets:
+                    buckets[key] = open(os.path.join(bucket_dir, f'{len(buckets)}.bin'), 'wb')
+                values[start:end].tofile(buckets[key])
+            print('.', end = '', flush=True)
+        print()
+
+        for fp in buckets.values():
+            fp.close()
+
+        # dedupe and sort each bucket, then concatenate in key order
+        sorted_files: List[str] = []
+        sizes: List[int] = []
+        for key in tqdm(sorted(buckets.keys())):
+            bucket_file: str = buckets[key].name
+            values: np.array = np.unique(np.fromfile(bucket_file, dtype=dtype))
+            np.save(f'{bucket_file}.npy', values)
+            os.remove(bucket_file)
+            sorted_files.append(f'{bucket_file}.npy')
+            sizes.append(len(values))
+
+        for path in AddressIndex.find_delta_files(addr_file):
+            os.remove(path)
+        out: np.memmap = np.lib.format.open_memmap(
+            addr_file, mode='w+', dtype=dtype, shape=(int(sum(sizes)),))
+        start: int = 0
+        for sorted_file, size in zip(sorted_files, sizes):
+            out[start:start + size] = np.load(sorted_file)
+            start += size
+        out.flush()
+        del out
+        shutil.rmtree(bucket_dir)
+
+        return AddressIndex(addr_file)
+
+
+def to_fixed_bytes(addresses: Iterable[str], width: int) -> np.array:
+    """
+    Addresses as fixed-width byte strings. numpy silently truncates
+    longer strings, so check lengths first.
+    """
+    values: np.array = np.asarray(addresses, dtype=bytes)
+    assert values.dtype.itemsize <= width or len(values) == 0, \
+        f'addresses longer than {width} bytes.'
+    return values.astype(f'S{width}')
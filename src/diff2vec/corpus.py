@@ -0,0 +1,305 @@
+"""
+Binary corpus of integer sentences for word2vec.
+
+The corpus lives in a directory with two flat arrays:
+
+    tokens.bin:  int32, every sentence concatenated
+    offsets.bin: int64, sentence i is tokens[offsets[i]:offsets[i+1]]
+
+plus `corpus.json` with the number of sentences and tokens, which is
+only written once the corpus is complete. Compared to JSON lines of
+node ids this is several times smaller and needs no parsing.
+"""
+import os
+import json
+import numpy as np
+from tqdm import tqdm
+from multiprocessing import Pool
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from src.utils.utils import from_json
+
+
+class BinaryCorpusWriter:
+    """
+    Append sentences to a binary corpus in `corpus_dir`. Has the same
+    `write` / `write_all` methods as a `jsonlines.Writer`, so it can be
+    passed to `EulerianDiffusion.diffuse`.
+
+    @buffer_size: (int) number of tokens held in memory between writes
+    """
+
+    def __init__(self, corpus_dir: str, buffer_size: int = 2**22):
+        if not os.path.isdir(corpus_dir): os.makedirs(corpus_dir)
+        self.corpus_dir: str = corpus_dir
+        self.buffer_size: int = buffer_size
+        self.num_sentences: int = 0
+        self.num_tokens: int = 0
+
+        tokens_file, offsets_file, self.meta_file = BinaryCorpus.get_files(corpus_dir)
+        if os.path.isfile(self.meta_file):
+            os.remove(self.meta_file)  # incomplete until closed
+        self._tokens_fp = open(tokens_file, 'wb')
+        self._offsets_fp = open(offsets_file, 'wb')
+        self._tokens: List[int] = []
+        self._offsets: List[int] = [0]
+
+    def write(self, sentence: List[int]):
+        self._tokens.extend(sentence)
+        self.num_tokens += len(sentence)
+        self.num_sentences += 1
+        self._offsets.append(self.num_tokens)
+        if len(self._tokens) >= self.buffer_size:
+            self.flush()
+
+    def write_all(self, sentences: List[List[int]]):
+        for sentence in sentences:
+            self.write(sentence)
+
+    def flush(self):
+        tokens: np.array = np.asarray(self._tokens, dtype=np.int64)
+        if len(tokens) > 0:
+            assert tokens.min() >= 0 and tokens.max() < 2**31, \
+                'tokens must be non-negative int32 node ids.'
+        tokens.astype(np.int32).tofile(self._tokens_fp)
+        np.asarray(self._offsets, dtype=np.int64).tofile(self._offsets_fp)
+        self._tokens: List[int] = []
+        self._offsets: List[int] = []
+
+    def close(self):
+        self.flush()
+        self._tokens_fp.close()
+        self._offsets_fp.close()
+        with open(self.meta_file, 'w') as fp:
+            json.dump({'num_sentences': self.num_sentences, 'num_tokens': self.num_tokens}, fp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args: Any):
+        self.close()
+
+
+class BinaryCorpus:
+    """
+    Read-only view of a binary corpus. Iterating yields each sentence as
+    an int32 numpy slice of the memory mapped token array.
+    """
+
+    def __init__(self, corpus_dir: str):
+        tokens_file, offsets_file, meta_file = BinaryCorpus.get_files(corpus_dir)
+        assert os.path.isfile(meta_file), f'{corpus_dir} is not a complete binary corpus.'
+        meta: Dict[str, int] = from_json(meta_file)
+        self.corpus_dir: str = corpus_dir
+        self.num_sentences: int = meta['num_sentences']
+        self.num_tokens: int = meta['num_tokens']
+
+        # np.memmap refuses empty files
+        self.tokens: np.array = np.memmap(
+            tokens_file, dtype=np.int32, mode='r', shape=(self.num_tokens,)) \
+            if self.num_tokens > 0 else np.zeros(0, dtype=np.int32)
+        self.offsets: np.array = np.memmap(
+            offsets_file, dtype=np.int64, mode='r', shape=(self.num_sentences + 1,))
+
+    @staticmethod
+    def get_files(corpus_dir: str) -> Tuple[str, str, str]:
+        return (
+            os.path.join(corpus_dir, 'tokens.bin'),
+            os.path.join(corpus_dir, 'offsets.bin'),
+            os.path.join(corpus_dir, 'corpus.json'),
+        )
+
+    def __len__(self) -> int:
+        return self.num_sentences
+
+    def __getitem__(self, i: int) -> np.array:
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self) -> Iterator[np.array]:
+        return self.iter_range(0, self.num_sentences)
+
+    def iter_range(
+        self,
+        start: int,
+        end: int,
+        block_size: int = 2**16,
+    ) -> Iterator[np.array]:
+        """
+        Sentences `start` to `end`, reading offsets a block at a time.
+        """
+        tokens: np.array = self.tokens
+        for lo in range(start, end, block_size):
+            hi: int = min(lo + block_size, end)
+            offsets: List[int] = np.asarray(self.offsets[lo:hi + 1]).tolist()
+            for a, b in zip(offsets[:-1], offsets[1:]):
+                yield tokens[a:b]
+
+    def iter_blocks(self, block_size: int = 2**26) -> Iterator[np.array]:
+        """
+        The token array in blocks, ignoring sentence boundaries.
+        """
+        for start in range(0, self.num_tokens, block_size):
+            yield np.asarray(self.tokens[start:start + block_size])
+
+
+def get_corpus_files(source: Any) -> List[str]:
+    """
+    JSON lines files behind a corpus: a single file, a list of files, or a
+    directory of shards (see `SubGraphSequences.get_sequences_sharded`),
+    in name order.
+    """
+    if isinstance(source, (list, tuple)):
+        return list(source)
+    if os.path.isdir(source):
+        return [
+            os.path.join(source, name) for name in sorted(os.listdir(source))
+            if name.endswith('.jsonl')
+        ]
+    return [source]
+
+
+def is_binary_corpus(path: Any) -> bool:
+    return isinstance(path, str) and os.path.isfile(BinaryCorpus.get_files(path)[2])
+
+
+def jsonl_to_binary(
+    source: Any,
+    corpus_dir: str,
+    total: Optional[int] = None,
+) -> BinaryCorpus:
+    """
+    Convert JSON lines of integer sentences (one file or several shards,
+    read in order) into a binary corpus.
+    """
+    with BinaryCorpusWriter(corpus_dir) as writer:
+        pbar = tqdm(total=total)
+        for path in get_corpus_files(source):
+            with open(path, 'r') as fp:
+                for line in fp:
+                    line: str = line.strip()
+                    if len(line) == 0:
+                        continue
+                    writer.write(json.loads(line))
+                    pbar.update()
+        pbar.close()
+
+    return BinaryCorpus(corpus_dir)
+
+
+def get_range_bounds(corpus_file: Any, num_ranges: int) -> List[int]:
+    """
+    Split a corpus into `num_ranges` contiguous pieces of about the same
+    number of tokens. For a binary corpus the bounds are sentence indices;
+    for JSON lines they are byte offsets into the files read back to back.
+    """
+    if is_binary_corpus(corpus_file):
+        corpus: BinaryCorpus = BinaryCorpus(corpus_file)
+        targets: np.array = np.linspace(0, corpus.num_tokens, num_ranges + 1)
+        bounds: np.array = np.searchsorted(corpus.offsets, targets[1:-1])
+        return [0] + bounds.tolist() + [corpus.num_sentences]
+
+    size: int = sum(os.path.getsize(path) for path in get_corpus_files(corpus_file))
+    return np.linspace(0, size, num_ranges + 1).astype(np.int64).tolist()
+
+
+def iter_corpus_range(corpus_file: Any, start: int, end: int) -> Iterator[List[int]]:
+    """
+    Sentences (as lists) in the range `[start, end)` given by `get_range_bounds`.
+    A JSON line belongs to the range where it starts, so adjacent ranges
+    never share or drop a sentence.
+    """
+    if is_binary_corpus(corpus_file):
+        for sentence in BinaryCorpus(corpus_file).iter_range(start, end):
+            yield sentence.tolist()
+        return
+
+    base: int = 0
+    for path in get_corpus_files(corpus_file):
+        size: int = os.path.getsize(path)
+        if base + size <= start or base >= end:
+            base += size
+            continue
+        with open(path, 'rb') as fp:
+            pos: int = max(start - base, 0)
+            if pos > 0:
+                # skip the line in progress; a line starting at `pos` is kept
+                fp.seek(pos - 1)
+                fp.readline()
+            while base + fp.tell() < end:
+                line: bytes = fp.readline()
+                if not line:
+                    break
+                if line.strip():
+                    yield json.loads(line)
+        base += size
+
+
+def add_counts(a: np.array, b: np.array) -> np.array:
+    """
+    Sum two bincounts of different lengths.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    a[:len(b)] += b
+    return a
+
+
+def _count_range(task: Tuple[Any, int, int]) -> Tuple[np.array, int, int]:
+    corpus_file, start, end = task
+    counts: np.array = np.zeros(0, dtype=np.int64)
+    if is_binary_corpus(corpus_file):
+        corpus: BinaryCorpus = BinaryCorpus(corpus_file)
+        lo: int = int(corpus.offsets[start])
+        hi: int = int(corpus.offsets[end])
+        for block in range(lo, hi, 2**26):
+            tokens: np.array = np.asarray(corpus.tokens[block:min(block + 2**26, hi)])
+            counts: np.array = add_counts(counts, np.bincount(tokens))
+        return counts, end - start, hi - lo
+
+    num_sentences: int = 0
+    num_tokens: int = 0
+    buffer: List[int] = []
+    for sentence in iter_corpus_range(corpus_file, start, end):
+        buffer.extend(sentence)
+        num_sentences += 1
+        if len(buffer) >= 2**24:
+            counts: np.array = add_counts(counts, np.bincount(np.asarray(buffer, dtype=np.int64)))
+            num_tokens += len(buffer)
+            buffer: List[int] = []
+    counts: np.array = add_counts(counts, np.bincount(np.asarray(buffer, dtype=np.int64)))
+    num_tokens += len(buffer)
+    return counts, num_sentences, num_tokens
+
+
+def count_tokens(
+    corpus_file: Any,
+    workers: int = 1,
+    num_shards: int = 0,
+) -> Tuple[np.array, np.array, int, int]:
+    """
+    Count every token of a corpus (binary or JSON lines) by splitting it
+    into `num_shards` ranges of about the same size and bincounting each
+    range in one of `workers` processes.
+
+    Returns the sorted distinct tokens, their counts, and the number of
+    sentences and tokens in the corpus.
+    """
+    num_shards: int = num_shards or 4 * workers
+    bounds: List[int] = get_range_bounds(corpus_file, num_shards)
+    tasks: List[Tuple[Any, int, int]] = [
+        (corpus_file, bounds[i], bounds[i + 1]) for i in range(num_shards)]
+
+    counts: np.array = np.zeros(0, dtype=np.int64)
+    num_sentences: int = 0
+    num_tokens: int = 0
+    pbar = tqdm(total=num_shards)
+    with Pool(workers) as pool:
+        for shard_counts, shard_sentences, shard_tokens in pool.imap_unordered(_count_range, tasks):
+            counts: np.array = add_counts(counts, shard_counts)
+            num_sentences += shard_sentences
+            num_tokens += shard_tokens
+            pbar.update()
+    pbar.close()
+
+    words: np.array = np.flatnonzero(counts)
+    return words, counts[words], num_sentences, num_tokens
@@ -1,13 +1,17 @@
 """
 Eulerian Diffusion.
 """
-import random
+import os
+import json
+import hashlib
 import numpy as np
+import pandas as pd
 import jsonlines
 from tqdm import tqdm
-import networkx as nx
-from typing import List, Dict, Set
-from src.diff2vec.graph import UndirectedGraph
+from multiprocessing import Pool
+from typing import Any, List, Dict, Optional, Set, Tuple, Union
+from src.diff2vec.graph import UndirectedGraph, CSRGraph, load_graph, write_alias_tables
+from src.diff2vec.addresses import AddressIndex
 
 
 class EulerianDiffusion:
@@ -19,57 +23,342 @@ class EulerianDiffusion:
     to be created; also denoted by `l` in the paper.
 
     Assumes all nodes in the graph are integers.
+
+    The diffusion tree lives in preallocated arrays (infected nodes and
+    the index of the node that infected each one). Every edge of the tree
+    is doubled, so an Eulerian circuit from the source is a DFS walk over
+    the tree that records a node when it is entered and again each time
+    the walk returns to it, stopping before the final return.
+
+    If `weighted`, neighbours are drawn in proportion to edge weights
+    through the alias tables of a weighted CSRGraph, at the same cost.
+
+    On a graph changed by a `HubPolicy` fewer than `cover_size` nodes may
+    be reachable from a source, so `max_misses` bounds the number of
+    proposals of already infected nodes before giving up on the rest of
+    the cover (default: no bound).
     """
 
     def __init__(
         self,
-        graph: UndirectedGraph,
-        component: Set[int],
-        cover_size: int):
-        self.graph: UndirectedGraph = graph
-        self.component: Set[int] = component
+        graph: Union[UndirectedGraph, CSRGraph],
+        component: Union[Set[int], List[int]],
+        cover_size: int,
+        rng: Optional[np.random.Generator] = None,
+        weighted: bool = False,
+        max_misses: Optional[int] = None,
+    ):
+        if weighted:
+            assert isinstance(graph, CSRGraph) and graph.is_weighted(), \
+                'weighted diffusion needs a CSR graph with alias tables (see make_csr.py).'
+        self.graph: Union[UndirectedGraph, CSRGraph] = graph
+        self.component: Union[Set[int], List[int]] = component
         self.cover_size: int = cover_size
+        self.rng: np.random.Generator = rng if rng is not None else np.random.default_rng()
+        self.weighted: bool = weighted
+        self.max_misses: int = max_misses if max_misses is not None else 2**62
+
+        # buffers reused across source nodes
+        self._infected: np.array = np.zeros(cover_size, dtype=np.int64)
+        self._parents: np.array = np.zeros(cover_size, dtype=np.int64)
+        self._euler: np.array = np.zeros(2 * cover_size - 1, dtype=np.int64)
+        self._draws: List[float] = []
+        self._draws_pos: int = 0
 
     def _diffuse(self, node: int) -> List[int]:
         """
         Generate diffusion tree from source node.
+
+        Each infected node's neighbour array (a view for CSR graphs) and
+        degree are fetched once, when it is infected, so a proposal costs
+        two uniform draws from a bulk buffer and one array lookup.
         """
-        infected: List[int] = [node] 
+        if self.weighted:
+            return self._diffuse_weighted(node)
 
-        subgraph: nx.DiGraph = nx.DiGraph()  # subgraphs we assume are small enough for nx
-        subgraph.add_node(node)  # start with such this node
+        infected: np.array = self._infected
+        parents: np.array = self._parents
+        infected[0] = node
+        index: Set[int] = {node}
+        neighbors: List[np.array] = [self.graph.neighbors(node, as_set=False)]
+        degrees: List[int] = [len(neighbors[0])]
         counter: int = 1
+        misses: int = 0
 
+        if degrees[0] == 0:  # nothing to do!
+            return []
+
+        draws: List[float] = self._draws
+        pos: int = self._draws_pos
         while counter < self.cover_size:
-            w: int = random.sample(infected, 1)[0]
-            neighbors: List[int] = self.graph._edges[w]  
+            if pos + 2 > len(draws):
+                # draw random numbers in bulk; one rng call per draw is slow
+                draws: List[float] = self.rng.random(8192).tolist()
+                pos: int = 0
+            w: int = int(draws[pos] * counter)  # random infected node
+            u: int = int(neighbors[w][int(draws[pos + 1] * degrees[w])])
+            pos += 2
 
-            if len(neighbors) == 0:  # nothing to do!
-                break
+            if u not in index:
+                index.add(u)
+                infected[counter] = u
+                parents[counter] = w
+                neighbors.append(self.graph.neighbors(u, as_set=False))
+                degrees.append(len(neighbors[-1]))
+                counter += 1
+            else:
+                misses += 1
+                if misses > self.max_misses:  # rest of the cover is unreachable
+                    break
 
-            u: int = random.sample(neighbors, 1)[0]
-            
-            if u not in infected:
+        self._draws, self._draws_pos = draws, pos
+        return self._euler_tour(counter)
+
+    def _diffuse_weighted(self, node: int) -> List[int]:
+        """
+        Same as `_diffuse`, but a neighbour is drawn with the alias method:
+        the integer part of draw * degree picks a slot and its fractional
+        part decides between the slot and its alias, so a proposal still
+        costs two uniform draws.
+        """
+        infected: np.array = self._infected
+        parents: np.array = self._parents
+        infected[0] = node
+        index: Set[int] = {node}
+        tables: List[Tuple[np.array, np.array, np.array]] = [self.graph.alias_table(node)]
+        degrees: List[int] = [len(tables[0][0])]
+        counter: int = 1
+        misses: int = 0
+
+        if degrees[0] == 0:  # nothing to do!
+            return []
+
+        draws: List[float] = self._draws
+        pos: int = self._draws_pos
+        while counter < self.cover_size:
+            if pos + 2 > len(draws):
+                draws: List[float] = self.rng.random(8192).tolist()
+                pos: int = 0
+            w: int = int(draws[pos] * counter)  # random infected node
+            neighbors, prob, alias = tables[w]
+            x: float = draws[pos + 1] * degrees[w]
+            k: int = int(x)
+            if x - k >= prob[k]:
+                k: int = int(alias[k])
+            u: int = int(neighbors[k])
+            pos += 2
+
+            if u not in index:
+                index.add(u)
+                infected[counter] = u
+                parents[counter] = w
+                tables.append(self.graph.alias_table(u))
+                degrees.append(len(tables[-1][0]))
                 counter += 1
-                infected.append(u)
-                # double graph
-                subgraph.add_edges_from([(u, w), (w, u)])
+            else:
+                misses += 1
+                if misses > self.max_misses:
+                    break
+
+        self._draws, self._draws_pos = draws, pos
+        return self._euler_tour(counter)
+
+    def _euler_tour(self, size: int) -> List[int]:
+        """
+        Eulerian circuit of the doubled diffusion tree over the first
+        `size` infected nodes. Children are visited in infection order.
+        """
+        if size < 2:
+            return []
+
+        # group children by parent (counting sort keeps infection order)
+        children: np.array = np.argsort(self._parents[1:size], kind='stable') + 1
+        counts: np.array = np.bincount(self._parents[1:size], minlength=size)
+        first_child: np.array = np.concatenate([[0], np.cumsum(counts)])
+        first_child: List[int] = first_child.tolist()
+        children: List[int] = children.tolist()
+        infected: List[int] = self._infected[:size].tolist()
 
-                if counter == self.cover_size:
+        euler: np.array = self._euler
+        length: int = 0
+        stack: List[int] = [0]
+        cursor: List[int] = first_child[:size]  # next child to visit per node
+        while True:
+            vertex: int = stack[-1]
+            euler[length] = infected[vertex]
+            length += 1
+            if cursor[vertex] < first_child[vertex + 1]:
+                child: int = children[cursor[vertex]]
+                cursor[vertex] += 1
+                stack.append(child)
+            else:
+                stack.pop()
+                if len(stack) == 0:
                     break
 
-        euler: List[int] = [int(u) for u, _ in nx.eulerian_circuit(subgraph, node)]
-        return euler
+        return euler[:length - 1].tolist()  # drop the final return to source
 
-    def diffuse(self, writer: jsonlines.Writer) -> Dict[int, List[int]]:
-        pbar = tqdm(total=len(self.component))
+    def diffuse(self, writer: jsonlines.Writer, verbose: bool = True):
+        pbar = tqdm(total=len(self.component), disable=not verbose)
         for node in self.component:
             seq: List[int] = self._diffuse(node)
-            writer.write(seq)
+            if len(seq) > 0:  # isolated, e.g. once hubs are excluded
+                writer.write(seq)
             pbar.update()
         pbar.close()
 
 
+class HubPolicy:
+    """
+    What to do with hubs (exchange hot wallets, popular contracts) before
+    diffusion. A hub with millions of neighbours is reached by most
+    diffusions near it, so it dominates the sequences, and reading its
+    neighbour list costs time and pages in every one of them.
+
+    The policy is applied once to a CSR graph, writing a new graph
+    directory that diffusion then reads as usual:
+
+        cap:     every node keeps a uniform random sample of at most
+                 `max_degree` neighbours (its row is sorted as before).
+                 Only the rows of hubs change, so their neighbours still
+                 reach them, but a hub leads to a bounded subset.
+        exclude: nodes in `exclude` lose every edge, in both directions.
+
+    Weights are kept and alias tables rebuilt for a weighted graph. The
+    result only depends on the graph, the policy and `seed`.
+
+    @max_degree: (int) cap on the neighbours per node, 0 for no cap
+    @exclude: (np.array) node ids to cut out of the graph
+    @seed: (int) random seed for the neighbour samples
+    """
+
+    def __init__(
+        self,
+        max_degree: int = 0,
+        exclude: Optional[np.array] = None,
+        seed: int = 42,
+    ):
+        self.max_degree: int = max_degree
+        self.exclude: np.array = np.unique(np.asarray(
+            exclude if exclude is not None else [], dtype=np.int64))
+        self.seed: int = seed
+
+    @classmethod
+    def from_known_addresses(
+        cls,
+        known_addresses_csv: str,
+        addr_file: str,
+        max_degree: int = 0,
+        seed: int = 42,
+    ):
+        """
+        Exclude every exchange address in the known addresses csv (see
+        `DataframeLoader`) that is a node of the graph.
+        """
+        known_addresses: pd.DataFrame = pd.read_csv(known_addresses_csv)
+        exchanges: pd.DataFrame = known_addresses[known_addresses.entity == 'exchange']
+        index: AddressIndex = AddressIndex(addr_file)
+        ids: np.array = index.encode(exchanges.address.str.strip().str.lower())
+        print(f'excluding {int(np.sum(ids >= 0))}/{len(exchanges)} exchanges found in the graph.')
+        return cls(max_degree = max_degree, exclude = ids[ids >= 0], seed = seed)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'max_degree': self.max_degree,
+            'seed': self.seed,
+            'num_excluded': len(self.exclude),
+            'exclude_md5': hashlib.md5(self.exclude.tobytes()).hexdigest(),
+        }
+
+    def apply(self, graph_dir: str, out_dir: str, block_size: int = 2**24) -> str:
+        """
+        Write the graph at `graph_dir` with this policy applied to `out_dir`,
+        a block of rows at a time. If `out_dir` already holds the same
+        policy applied, it is reused. Returns `out_dir`.
+        """
+        policy_file: str = os.path.join(out_dir, 'hub-policy.json')
+        if os.path.isfile(policy_file):
+            with open(policy_file, 'r') as fp:
+                if json.load(fp) == self.to_dict():
+                    print(f'reusing hub graph in {out_dir}.')
+                    return out_dir
+            os.remove(policy_file)
+        if not os.path.isdir(out_dir): os.makedirs(out_dir)
+
+        graph: CSRGraph = CSRGraph.load(graph_dir)
+        offsets: np.array = graph._offsets
+        num_nodes: int = len(graph)
+        weighted: bool = graph._weights is not None
+        excluded: np.array = np.zeros(num_nodes, dtype=bool)
+        excluded[self.exclude[self.exclude < num_nodes]] = True
+        rng: np.random.Generator = np.random.default_rng(self.seed)
+
+        offsets_file, indices_file = CSRGraph.get_files(out_dir)
+        weights_file: str = CSRGraph.get_weight_files(out_dir)[0]
+        tmp_file: str = os.path.join(out_dir, 'indices.tmp')
+        tmp_weights_file: str = os.path.join(out_dir, 'weights.tmp')
+        new_degrees: np.array = np.zeros(num_nodes, dtype=np.int64)
+
+        print('applying hub policy',  end = '', flush=True)
+        with open(tmp_file, 'wb') as fp, open(tmp_weights_file, 'wb') as wfp:
+            lo: int = 0
+            while lo < num_nodes:
+                hi: int = int(np.searchsorted(offsets, offsets[lo] + block_size, side='right')) - 1
+                hi: int = min(max(hi, lo + 1), num_nodes)
+                start, end = int(offsets[lo]), int(offsets[hi])
+                rows: np.array = np.repeat(np.arange(lo, hi), np.diff(offsets[lo:hi + 1]))
+                values: np.array = np.asarray(graph._indices[start:end])
+                keep: np.array = ~excluded[rows] & ~excluded[values]
+
+                if self.max_degree > 0:
+                    degrees: np.array = np.bincount(rows[keep] - lo, minlength=hi - lo)
+                    hubs: np.array = np.flatnonzero(keep & (degrees[rows - lo] > self.max_degree))
+                    if len(hubs) > 0:
+                        # random keys, keep the `max_degree` smallest per row:
+                        # a uniform sample without replacement
+                        keys: np.array = rng.random(len(hubs))
+                        order: np.array = np.lexsort((keys, rows[hubs]))
+                        hub_rows: np.array = rows[hubs][order]
+                        first: np.array = np.flatnonzero(np.r_[True, hub_rows[1:] != hub_rows[:-1]])
+                        rank: np.array = np.arange(len(hub_rows)) - \
+                            np.repeat(first, np.diff(np.r_[first, len(hub_rows)]))
+                        keep[hubs[order[rank >= self.max_degree]]] = False
+
+                values[keep].astype(np.int32).tofile(fp)
+                if weighted:
+                    np.asarray(graph._weights[start:end])[keep].astype(np.float32).tofile(wfp)
+                new_degrees[lo:hi] = np.bincount(rows[keep] - lo, minlength=hi - lo)
+                lo = hi
+                print('.', end = '', flush=True)
+        print('')
+
+        new_offsets: np.array = np.zeros(num_nodes + 1, dtype=np.int64)
+        new_offsets[1:] = np.cumsum(new_degrees)
+        np.save(offsets_file, new_offsets)
+        size: int = int(new_offsets[-1])
+        copies: List[Tuple[str, str, Any]] = [(tmp_file, indices_file, np.int32)]
+        if weighted:
+            copies.append((tmp_weights_file, weights_file, np.float32))
+        for src, dst, dtype in copies:
+            out: np.memmap = np.lib.format.open_memmap(dst, mode='w+', dtype=dtype, shape=(size,))
+            if size > 0:  # np.memmap refuses empty files
+                buffer: np.memmap = np.memmap(src, dtype=dtype, mode='r', shape=(size,))
+                for start in range(0, size, block_size):
+                    out[start:start + block_size] = buffer[start:start + block_size]
+                del buffer
+            out.flush()
+            del out
+        os.remove(tmp_file)
+        os.remove(tmp_weights_file)
+        if weighted:
+            write_alias_tables(out_dir)
+
+        print(f'kept {size}/{len(graph._indices)} neighbour entries.')
+        with open(policy_file, 'w') as fp:  # written last: marks the graph complete
+            json.dump(self.to_dict(), fp)
+        return out_dir
+
+
 class SubGraphSequences:
     """
     Algorithm 2 in https://arxiv.org/pdf/2001.07463.pdf.
@@ -77,14 +366,24 @@ class SubGraphSequences:
     Separate the original graph and run diffusion on each node 
     in subgraph.
     """
-    def __init__(self, graph: UndirectedGraph, vertex_card: int, seed: int = 42):
-        self.graph: UndirectedGraph = graph
+    def __init__(
+        self,
+        graph: Optional[Union[UndirectedGraph, CSRGraph]],
+        vertex_card: int,
+        seed: int = 42,
+        weighted: bool = False,
+        max_misses: Optional[int] = None,
+    ):
+        self.graph: Optional[Union[UndirectedGraph, CSRGraph]] = graph
         self.vertex_card: int = vertex_card  # number of nodes per sample
+        self.weighted: bool = weighted  # sample neighbours by edge weight
+        self.max_misses: Optional[int] = max_misses  # see EulerianDiffusion
 
         self.set_random_seed(seed)
 
     def set_random_seed(self, seed: int):
-        random.seed(seed)
+        self.seed: int = seed
+        self.rng: np.random.Generator = np.random.default_rng(seed)
     
     def extract_components(self, component_file: str) -> List[Set[int]]:
         with jsonlines.open(component_file) as reader:
@@ -110,6 +409,119 @@ class SubGraphSequences:
                     self.vertex_card: int = card
 
                 print(f'Component: ({c+1}/{len(components)})')
-                euler: EulerianDiffusion = \
-                    EulerianDiffusion(self.graph, component, self.vertex_card)
+                euler: EulerianDiffusion = EulerianDiffusion(
+                    self.graph, component, self.vertex_card, rng = self.rng,
+                    weighted = self.weighted, max_misses = self.max_misses)
                 euler.diffuse(writer)
+
+    def get_sequences_sharded(
+        self,
+        components_file: str,
+        out_dir: str,
+        graph_path: str,
+        num_shards: int = 64,
+        workers: int = 1,
+        cache_pages: int = 0,
+    ):
+        """
+        Sharded version of `get_sequences`. Source nodes (in the same order
+        as `get_sequences`) are split into `num_shards` contiguous ranges of
+        roughly equal work. Shard i draws from its own generator, spawned
+        from the master seed, and writes `out_dir/sequences-shard{i:04d}.jsonl`.
+        The output only depends on the seed and `num_shards`, not on the
+        number of workers, and shards already on disk are skipped so an
+        interrupted run can be restarted.
+
+        Each worker opens the CSR graph at `graph_path` itself, so they all
+        share the memory mapped arrays through the page cache.
+
+        @graph_path: (str) CSR graph directory (see make_csr.py)
+        @num_shards: (int) number of shard files
+        @workers: (int) number of worker processes
+        @cache_pages: (int) if > 0, workers read through a page cache
+        """
+        assert os.path.isdir(graph_path), \
+            f'{graph_path} is not a CSR graph directory.'
+        if not os.path.isdir(out_dir): os.makedirs(out_dir)
+
+        print('loading connected components...')
+        components: List[Set[int]] = self.extract_components(components_file)
+        components: List[Set[int]] = [c for c in components if len(c) > 1]
+        sizes: np.array = np.array([len(c) for c in components], dtype=np.int64)
+
+        # flat plan: source node and cover size, saved for the workers to mmap
+        nodes: np.array = np.fromiter(
+            (node for component in components for node in component),
+            dtype=np.int64, count=int(sizes.sum()))
+        covers: np.array = np.repeat(np.minimum(sizes, self.vertex_card), sizes)
+        del components
+        np.save(os.path.join(out_dir, 'plan-nodes.npy'), nodes)
+        np.save(os.path.join(out_dir, 'plan-covers.npy'), covers)
+
+        # cut where the cumulative work (~ cover size) crosses each quantile
+        work: np.array = np.cumsum(covers)
+        cuts: np.array = np.searchsorted(
+            work, np.linspace(0, work[-1] if len(work) else 0, num_shards + 1)[1:-1])
+        bounds: List[int] = [0] + cuts.tolist() + [len(nodes)]
+        seeds: List[np.random.SeedSequence] = \
+            np.random.SeedSequence(self.seed).spawn(num_shards)
+
+        tasks: List[Tuple[Any, ...]] = []
+        for shard in range(num_shards):
+            out_file: str = get_shard_file(out_dir, shard)
+            if os.path.isfile(out_file):
+                continue
+            tasks.append(
+                (out_dir, shard, bounds[shard], bounds[shard + 1], seeds[shard],
+                 self.weighted, self.max_misses))
+        print(f'{len(tasks)}/{num_shards} shards to write')
+
+        pbar = tqdm(total=len(tasks))
+        if workers > 1:
+            with Pool(workers, initializer=_init_worker, initargs=(graph_path, cache_pages)) as pool:
+                for _ in pool.imap_unordered(_write_shard, tasks):
+                    pbar.update()
+        else:
+            _init_worker(graph_path, cache_pages)
+            for task in tasks:
+                _write_shard(task)
+                pbar.update()
+        pbar.close()
+
+
+def get_shard_file(out_dir: str, shard: int) -> str:
+    return os.path.join(out_dir, f'sequences-shard{shard:04d}.jsonl')
+
+
+_worker_graph: Optional[CSRGraph] = None
+
+
+def _init_worker(graph_path: str, cache_pages: int):
+    global _worker_graph
+    _worker_graph = load_graph(graph_path, cache_pages = cache_pages)
+
+
+def _write_shard(task: Tuple[Any, ...]) -> int:
+    """
+    Diffuse from every source node in one shard of the plan. Nodes are
+    grouped into runs of equal cover size so buffers are reused.
+    """
+    out_dir, shard, start, end, seed, weighted, max_misses = task
+    rng: np.random.Generator = np.random.default_rng(seed)
+    nodes: np.array = np.load(os.path.join(out_dir, 'plan-nodes.npy'), mmap_mode='r')[start:end]
+    covers: np.array = np.load(os.path.join(out_dir, 'plan-covers.npy'), mmap_mode='r')[start:end]
+    runs: List[int] = [0] + (np.flatnonzero(np.diff(covers)) + 1).tolist() + [len(covers)]
+
+    out_file: str = get_shard_file(out_dir, shard)
+    tmp_file: str = f'{out_file}.tmp'
+    with jsonlines.open(tmp_file, mode='w') as writer:
+        for a, b in zip(runs[:-1], runs[1:]):
+            if a == b:
+                continue
+            euler: EulerianDiffusion = EulerianDiffusion(
+                _worker_graph, nodes[a:b].tolist(), int(covers[a]), rng = rng,
+                weighted = weighted, max_misses = max_misses)
+            euler.diffuse(writer, verbose=False)
+    os.replace(tmp_file, out_file)  # a shard is only visible once complete
+
+    return end - start
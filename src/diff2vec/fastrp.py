@@ -0,0 +1,145 @@
+"""
+FastRP node embeddings (Chen et al., 2019): an alternative to the
+diffusion -> corpus -> word2vec chain that needs no training.
+
+Every node gets a very sparse random vector (entries +-sqrt(s) with
+probability 1/2s each, zero otherwise), scaled by its degree^beta so
+hubs can be down-weighted. These are propagated along the transition
+matrix P = D^-1 A of the CSR graph (edge weights included when the
+graph has them):
+
+    N_1 = P R,  N_i = P N_{i-1},  embedding = sum_i alpha_i normalize(N_i)
+
+where normalize scales every row to unit length. By the
+Johnson-Lindenstrauss lemma the random projection preserves the inner
+products of the rows of P^i, so nodes with similar i-hop neighbourhoods
+end up close.
+
+Each product is computed a block of rows at a time as a scipy.sparse
+matrix over slices of the memory mapped CSR arrays, so the only
+dense arrays are the n x dim iterates, kept in memory mapped files.
+The output is an `.npy` array whose row i is node i, the layout read
+by get_neighbors.py.
+"""
+import os
+import numpy as np
+from tqdm import tqdm
+from scipy.sparse import csr_matrix
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+
+from src.diff2vec.graph import CSRGraph
+
+
+class FastRP:
+    """
+    @dim: (int) embedding size
+    @iteration_weights: (List[float]) alpha_i of each power of P
+    @normalization_strength: (float) beta, the exponent of the degree
+        scaling of the random vectors (negative down-weights hubs)
+    @sparsity: (Optional[float]) s, defaults to sqrt(dim) as in the paper's
+        "very sparse" projections
+    @seed: (int) random seed
+    @block_size: (int) rows multiplied at a time
+    @workers: (int) threads multiplying blocks (scipy releases the GIL)
+    """
+
+    def __init__(
+        self,
+        dim: int = 128,
+        iteration_weights: List[float] = [1., 1., 1.],
+        normalization_strength: float = -0.5,
+        sparsity: Optional[float] = None,
+        seed: int = 42,
+        block_size: int = 2**18,
+        workers: int = 1,
+    ):
+        self.dim: int = dim
+        self.iteration_weights: List[float] = iteration_weights
+        self.normalization_strength: float = normalization_strength
+        self.sparsity: float = sparsity or float(np.sqrt(dim))
+        self.seed: int = seed
+        self.block_size: int = block_size
+        self.workers: int = workers
+
+    def random_vectors(self, degrees: np.array, out: np.array):
+        """
+        Degree scaled very sparse random projection, one seeded block at a
+        time so the result does not depend on the number of workers.
+        """
+        s: float = self.sparsity
+        total: float = float(degrees.sum())
+
+        def fill(start: int):
+            rng: np.random.Generator = np.random.default_rng([self.seed, start])
+            rows: int = min(self.block_size, len(out) - start)
+            u: np.array = rng.random((rows, self.dim), dtype=np.float32)
+            values: np.array = np.sqrt(s) * ((u < 0.5 / s).astype(np.float32) - (u > 1 - 0.5 / s))
+            degree: np.array = degrees[start:start + rows].astype(np.float64)
+            scale: np.array = np.zeros(rows)
+            scale[degree > 0] = (degree[degree > 0] / total) ** self.normalization_strength
+            out[start:start + rows] = values * scale[:, None].astype(np.float32)
+
+        self._map(fill, len(out), desc='random vectors')
+
+    def transition_block(self, graph: CSRGraph, start: int, end: int) -> csr_matrix:
+        """
+        Rows start .. end - 1 of P = D^-1 A (weighted degree if weighted).
+        """
+        offsets: np.array = np.asarray(graph._offsets[start:end + 1])
+        indices: np.array = np.asarray(graph._indices[offsets[0]:offsets[-1]])
+        if graph._weights is not None:
+            # a copy: the slice of a memory mapped array is read-only
+            data: np.array = np.array(graph._weights[offsets[0]:offsets[-1]], dtype=np.float32, copy=True)
+        else:
+            data: np.array = np.ones(len(indices), dtype=np.float32)
+        local: np.array = offsets - offsets[0]
+        nonempty: np.array = local[1:] > local[:-1]
+        row_sums: np.array = np.zeros(end - start, dtype=np.float32)
+        if len(data) > 0:
+            row_sums[nonempty] = np.add.reduceat(data, local[:-1][nonempty])
+        data /= np.repeat(np.where(row_sums > 0, row_sums, 1), np.diff(local))
+        return csr_matrix((data, indices, local), shape=(end - start, len(graph)))
+
+    def _map(self, fn: Any, size: int, desc: str):
+        starts: List[int] = list(range(0, size, self.block_size))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for _ in tqdm(executor.map(fn, starts), total=len(starts), desc=desc):
+                pass
+
+    def embed(self, graph: CSRGraph, out_file: str, work_dir: Optional[str] = None):
+        """
+        Write the embedding of every node of `graph` to `out_file`.
+        Two n x dim scratch arrays go to `work_dir` (default: next to
+        `out_file`) and are removed at the end.
+        """
+        size: int = len(graph)
+        work_dir: str = work_dir or os.path.dirname(os.path.abspath(out_file))
+        scratch: List[str] = [os.path.join(work_dir, f'fastrp-{i}.tmp.npy') for i in range(2)]
+        try:
+            prev: np.memmap = np.lib.format.open_memmap(
+                scratch[0], mode='w+', dtype=np.float32, shape=(size, self.dim))
+            cur: np.memmap = np.lib.format.open_memmap(
+                scratch[1], mode='w+', dtype=np.float32, shape=(size, self.dim))
+            out: np.memmap = np.lib.format.open_memmap(
+                out_file, mode='w+', dtype=np.float32, shape=(size, self.dim))
+
+            self.random_vectors(graph.degrees(), prev)
+            for i, alpha in enumerate(self.iteration_weights):
+
+                def step(start: int):
+                    end: int = min(start + self.block_size, size)
+                    block: np.array = self.transition_block(graph, start, end) @ prev
+                    norms: np.array = np.linalg.norm(block, axis=1, keepdims=True)
+                    cur[start:end] = block
+                    out[start:end] += alpha * block / np.where(norms > 0, norms, 1)
+
+                self._map(step, size, desc=f'iteration {i + 1}')
+                prev, cur = cur, prev
+
+            out.flush()
+            del prev, cur, out
+        finally:
+            for path in scratch:
+                if os.path.isfile(path):
+                    os.remove(path)
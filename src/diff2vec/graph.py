@@ -7,12 +7,13 @@ import sys
 import csv
 import json
 import pickle
+import shutil
 import jsonlines
+import numpy as np
 import pandas as pd
-from glob import glob
 from tqdm import tqdm
-from collections import defaultdict
-from typing import Optional, List, Set, Tuple, Dict, Union
+from collections import defaultdict, OrderedDict
+from typing import Callable, Iterable, Optional, List, Set, Tuple, Dict, Union
 
 
 class UndirectedGraph:
@@ -46,7 +47,8 @@ class UndirectedGraph:
     def _dfs(
         self,
         node: int,
-        visited: Dict[int, bool]
+        visited: Dict[int, bool],
+        verbose: bool = False,
     ) -> List[int]:
         """
         Iterative DFS because recursive ones are more storage costly
@@ -69,7 +71,7 @@ class UndirectedGraph:
                 if not visited[v]:
                     stack.append(v)
 
-            print(len(stack), len(path))
+            if verbose: print(len(stack), len(path))
 
         return path
 
@@ -205,138 +207,654 @@ class UndirectedGraph:
         return self._size
 
 
-class UndirectedGraphCSVSplits:
-
-    def __init__(self, edges_dir: str):
-        _edges_files: List[str] = glob(os.path.join(edges_dir, '*.csv'))
-        _edges_files: List[str] = sorted(
-            _edges_files, key=lambda x: int(x.split('.')[-2].split('-')[1]))
-        self._size: int = pd.read_csv(_edges_files[-1]).nodes.max()
-        self._split_size: int = len(pd.read_csv(_edges_files[0]))
-        self._edges_dir: str = edges_dir
+class CSRGraph:
+    """
+    Undirected graph in compressed sparse row format. Neighbours of node
+    `i` are `indices[offsets[i]:offsets[i+1]]`, sorted and deduplicated,
+    without self loops. Nodes are the integers 0 .. len(graph) - 1.
+
+    A graph written with `write_csr` is opened with `np.load(mmap_mode='r')`
+    so loading is instant and worker processes share the page cache.
+
+    A weighted graph also has, aligned with `indices`, the edge weights
+    and a per-node alias table (see `alias_tables`), so a weighted
+    neighbour is drawn in O(1).
+
+    @offsets: (np.array) int64 array of size num_nodes + 1
+    @indices: (np.array) int32 array of neighbours
+    @names: (np.array) optional node names, e.g. ids in the parent graph
+        for a subgraph
+    @weights: (np.array) optional float32 edge weights
+    @alias_prob: (np.array) optional float64 alias probabilities (float64
+        because comparing a Python float to a float32 scalar is slow)
+    @alias_index: (np.array) optional int32 alias slots (within the row)
+    """
 
-    def _dfs(
+    def __init__(
         self,
-        node: int,
-        visited: Dict[int, bool]
-    ) -> List[int]:
+        offsets: np.array,
+        indices: np.array,
+        names: Optional[np.array] = None,
+        weights: Optional[np.array] = None,
+        alias_prob: Optional[np.array] = None,
+        alias_index: Optional[np.array] = None,
+    ):
+        # plain ndarray views of memmaps: same pages, cheaper slicing
+        self._offsets: np.array = np.asarray(offsets)
+        self._indices: Optional[np.array] = None if indices is None else np.asarray(indices)
+        self._names: Optional[np.array] = names
+        self._size: int = len(offsets) - 1
+        self._weights: Optional[np.array] = None if weights is None else np.asarray(weights)
+        self._alias_prob: Optional[np.array] = None if alias_prob is None else np.asarray(alias_prob)
+        self._alias_index: Optional[np.array] = None if alias_index is None else np.asarray(alias_index)
+
+    @staticmethod
+    def get_files(graph_dir: str) -> Tuple[str, str]:
+        return (os.path.join(graph_dir, 'offsets.npy'),
+                os.path.join(graph_dir, 'indices.npy'))
+
+    @staticmethod
+    def get_weight_files(graph_dir: str) -> Tuple[str, str, str]:
+        return (os.path.join(graph_dir, 'weights.npy'),
+                os.path.join(graph_dir, 'alias_prob.npy'),
+                os.path.join(graph_dir, 'alias_index.npy'))
+
+    @classmethod
+    def load(cls, graph_dir: str, mmap: bool = True):
+        offsets_file, indices_file = cls.get_files(graph_dir)
+        mmap_mode: Optional[str] = 'r' if mmap else None
+        # weights and alias tables are optional
+        weight_arrays: List[Optional[np.array]] = [
+            np.load(path, mmap_mode=mmap_mode) if os.path.isfile(path) else None
+            for path in cls.get_weight_files(graph_dir)
+        ]
+        return cls(np.load(offsets_file, mmap_mode=mmap_mode),
+                   np.load(indices_file, mmap_mode=mmap_mode),
+                   weights = weight_arrays[0],
+                   alias_prob = weight_arrays[1],
+                   alias_index = weight_arrays[2])
+
+    @classmethod
+    def from_graph(cls, graph: UndirectedGraph):
         """
-        Iterative DFS because recursive ones are more storage costly
+        Convert an UndirectedGraph (e.g. loaded from pickle). Node ids are
+        kept, so nodes missing from `graph` become isolated.
         """
-        path: List[int] = []  # create stack for DFS
-        visited[node] = True  # mark current vertex as visited
-        path.append(node)     # add vertex to path
+        node_a: np.array = np.fromiter(
+            (node for node, links in graph._edges.items() for _ in links), dtype=np.int64)
+        node_b: np.array = np.fromiter(
+            (link for links in graph._edges.values() for link in links), dtype=np.int64)
+        num_nodes: int = max(graph._edges.keys()) + 1 if len(graph._edges) > 0 else 0
+        return cls.from_edges(node_a, node_b, num_nodes)
+
+    @classmethod
+    def from_edges(cls, node_a: np.array, node_b: np.array, num_nodes: int):
+        """
+        Build an in-memory graph from edge arrays. See `write_csr` for
+        graphs that do not fit in memory.
+        """
+        keep: np.array = node_a != node_b
+        src: np.array = np.concatenate([node_a[keep], node_b[keep]]).astype(np.int64)
+        dst: np.array = np.concatenate([node_b[keep], node_a[keep]]).astype(np.int64)
+        # sort by (src, dst) and drop repeats
+        keys: np.array = np.unique(src * num_nodes + dst)
+        src, dst = keys // num_nodes, keys % num_nodes
+        offsets: np.array = np.zeros(num_nodes + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(src, minlength=num_nodes))
+        return cls(offsets, dst.astype(np.int32))
+
+    def save(self, graph_dir: str):
+        if not os.path.isdir(graph_dir): os.makedirs(graph_dir)
+        offsets_file, indices_file = self.get_files(graph_dir)
+        np.save(offsets_file, np.asarray(self._offsets))
+        np.save(indices_file, np.asarray(self._indices))
+        for path, array in zip(
+            self.get_weight_files(graph_dir), 
+            [self._weights, self._alias_prob, self._alias_index],
+        ):
+            if array is not None:
+                np.save(path, np.asarray(array))
+
+    def is_weighted(self) -> bool:
+        return self._alias_prob is not None
+
+    def alias_table(self, node: int) -> Tuple[np.array, np.array, np.array]:
+        """
+        Neighbours of `node` with their alias probabilities and alias slots.
+        """
+        start: int = int(self._offsets[node])
+        end: int = int(self._offsets[node + 1])
+        return (self._indices[start:end], 
+                self._alias_prob[start:end], 
+                self._alias_index[start:end])
 
-        while len(path) > 0:
-            vertex: int = path.pop()
+    def has_node(self, node: int) -> bool:
+        return (0 <= node < self._size) and (self.degree(node) > 0)
 
-            if not visited[vertex]:
-                visited[vertex] = True
-            
-            for v in self.neighbors(vertex):
-                if not visited[v]:
-                    path.append(v)
+    def nodes(self) -> np.array:
+        """
+        Nodes with at least one edge.
+        """
+        return np.flatnonzero(self.degrees() > 0)
 
-            print(len(path))
+    def degree(self, node: int) -> int:
+        return int(self._offsets[node + 1] - self._offsets[node])
 
-        return path
+    def degrees(self) -> np.array:
+        return np.diff(self._offsets)
 
-    def neighbors(self, node: int) -> Set[int]:
-        index: int = node // self._split_size
-        df: pd.DataFrame = pd.read_csv(os.path.join(self._edges_dir, f'edges-{index}.csv'))
-        edges: str = df.iloc[node % self._split_size].edges
-        edges: List[int] = json.loads(edges)
-        return set(edges) - {node}
+    def neighbors(self, node: int, as_set=True) -> Union[Set[int], np.array]:
+        neighbors: np.array = self._indices[self._offsets[node]:self._offsets[node + 1]]
+        if as_set:
+            return set(neighbors.tolist())
+        return neighbors
 
-    def connected_components(self, component_file: str) -> List[Set[int]]:
-        visited: Dict[int, bool] = defaultdict(lambda: False)
+    def neighbors_batch(self, nodes: np.array) -> Tuple[np.array, np.array]:
+        """
+        Neighbours of many nodes at once, as a CSR pair (offsets, indices):
+        the neighbours of nodes[k] are indices[offsets[k]:offsets[k+1]].
+        """
+        nodes: np.array = np.asarray(nodes, dtype=np.int64)
+        starts: np.array = np.asarray(self._offsets[nodes])
+        lengths: np.array = np.asarray(self._offsets[nodes + 1]) - starts
+        offsets: np.array = np.zeros(len(nodes) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        positions: np.array = np.repeat(starts - offsets[:-1], lengths) + \
+            np.arange(offsets[-1], dtype=np.int64)
+        return offsets, self._get_indices(positions)
+
+    def _get_indices(self, positions: np.array) -> np.array:
+        return np.asarray(self._indices[positions])
+
+    def get_name(self, node: int) -> int:
+        return node if self._names is None else int(self._names[node])
+
+    def _yield_edges(self, block_size: int = 2**26) -> Iterable[Tuple[np.array, np.array]]:
+        """
+        Edge arrays (src, dst), a block of rows at a time.
+        """
+        lo: int = 0
+        while lo < self._size:
+            hi: int = int(np.searchsorted(
+                self._offsets, self._offsets[lo] + block_size, side='right')) - 1
+            hi: int = min(max(hi, lo + 1), self._size)
+            src: np.array = np.repeat(
+                np.arange(lo, hi, dtype=np.int64), np.diff(self._offsets[lo:hi + 1]))
+            dst: np.array = np.asarray(
+                self._get_indices(np.arange(self._offsets[lo], self._offsets[hi])), dtype=np.int64)
+            yield src, dst
+            lo = hi
+
+    def component_labels(self, verbose: bool = False) -> np.array:
+        """
+        Label every node with the smallest node id in its component.
+
+        Array-based union-find: each round hooks the larger of the two
+        roots of every edge onto the smaller one, then compresses paths
+        by pointer jumping until every node points at its root. Stops
+        once a round hooks nothing. The number of rounds is small (about
+        log of the component diameter) and each is a vectorised pass.
+        """
+        parent: np.array = np.arange(self._size, dtype=np.int64)
+        rounds: int = 0
+        while True:
+            hooked: int = 0
+            for src, dst in self._yield_edges():
+                keep: np.array = src < dst  # rows are symmetric
+                root_src: np.array = parent[src[keep]]
+                root_dst: np.array = parent[dst[keep]]
+                differ: np.array = root_src != root_dst
+                if not differ.any():
+                    continue
+                high: np.array = np.maximum(root_src[differ], root_dst[differ])
+                low: np.array = np.minimum(root_src[differ], root_dst[differ])
+                np.minimum.at(parent, high, low)
+                hooked += len(high)
+
+            # pointer jumping
+            while True:
+                grand: np.array = parent[parent]
+                if np.array_equal(grand, parent):
+                    break
+                parent: np.array = grand
+
+            rounds += 1
+            if verbose: print(f'round {rounds}: {hooked} hooks')
+            if hooked == 0:
+                break
+
+        return parent
+
+    def connected_components(self, component_file: str, verbose: bool = False):
+        """
+        Write each component with more than one node as a json line,
+        ordered by smallest node id.
+        """
+        labels: np.array = self.component_labels(verbose = verbose)
+        order: np.array = np.argsort(labels, kind='stable')
+        sorted_labels: np.array = labels[order]
+        starts: np.array = np.flatnonzero(
+            np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+        ends: np.array = np.r_[starts[1:], len(order)]
+        names: np.array = order if self._names is None else np.asarray(self._names)[order]
 
         with jsonlines.open(component_file, mode='w') as writer:
-            pbar = tqdm(total=self._size)
-            for node in range(self._size):
-                if not visited[node]:
-                    component: List[int] = self._dfs(node, visited)
-                    component: Set[int] = set(component)
-                    if len(component) > 1:
-                        writer.write(list(component))
-                pbar.update()
-            pbar.close()
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                if end - start > 1:
+                    writer.write(names[start:end].tolist())
+        if verbose: print(f'{np.sum(ends - starts > 1)} components.')
 
-    def subgraph(self, component: Set[int]):
-        subgraph: UndirectedGraph = UndirectedGraph()
-        subgraph.add_nodes_from(component)
+    def subgraph(self, component: Union[Set[int], np.array]):
+        """
+        Produce a CSRGraph with only the nodes in the component. Nodes are
+        relabelled 0 .. len(component) - 1; `get_name` maps them back to
+        ids in this graph.
 
-        for node in component:
-            links: Set[int] = self.neighbors(node)
-            links: Set[int] = links.intersection(component)
-            subgraph._edges[node] = list(links) 
+        The neighbour lists of all members are gathered at once and the
+        induced edges kept with one vectorised membership test.
+        """
+        names: np.array = np.unique(np.fromiter(component, dtype=np.int64) \
+            if isinstance(component, set) else np.asarray(component, dtype=np.int64))
 
-        return subgraph
+        offsets, indices = self.neighbors_batch(names)
+        rows: np.array = np.repeat(np.arange(len(names)), np.diff(offsets))
+        pos: np.array = np.minimum(np.searchsorted(names, indices), max(len(names) - 1, 0))
+        keep: np.array = names[pos] == indices if len(names) > 0 else np.array([], dtype=bool)
+
+        offsets: np.array = np.zeros(len(names) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(rows[keep], minlength=len(names)))
+        return CSRGraph(offsets, pos[keep].astype(np.int32), names = names)
 
     def __len__(self) -> int:
         return self._size
 
 
-class UndirectedGraphCSV:
+class PagedCSRGraph(CSRGraph):
+    """
+    CSRGraph whose neighbour array stays on disk and is read in fixed size
+    pages through a bounded LRU cache, for graphs larger than RAM. Unlike
+    `CSRGraph.load`, memory use does not grow with the number of pages
+    touched. Offsets are memory mapped.
+
+    @graph_dir: (str) directory written by `write_csr` / `CSRGraph.save`
+    @page_size: (int) number of neighbours per page
+    @cache_pages: (int) maximum number of pages kept in memory
+    """
 
-    def __init__(self, edges_file: str):
-        self._edges: pd.DataFrame = pd.read_csv(edges_file)
+    def __init__(self, graph_dir: str, page_size: int = 2**16, cache_pages: int = 1024):
+        self.graph_dir: str = graph_dir
+        offsets_file, indices_file = self.get_files(graph_dir)
+        super().__init__(np.load(offsets_file, mmap_mode='r'), None)
+
+        with open(indices_file, 'rb') as fp:
+            version: Tuple[int, int] = np.lib.format.read_magic(fp)
+            read_header: Callable = np.lib.format.read_array_header_1_0 \
+                if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, _, dtype = read_header(fp)
+            self._data_start: int = fp.tell()
+        self._dtype: np.dtype = np.dtype(dtype)
+        self._num_indices: int = int(shape[0])
+        self._fd: int = os.open(indices_file, os.O_RDONLY)
+
+        self.page_size: int = page_size
+        self.cache_pages: int = cache_pages
+        self._pages: OrderedDict = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def _get_page(self, page: int) -> np.array:
+        data: Optional[np.array] = self._pages.get(page)
+        if data is not None:
+            self._pages.move_to_end(page)
+            self.hits += 1
+            return data
+
+        self.misses += 1
+        start: int = page * self.page_size
+        count: int = min(self.page_size, self._num_indices - start)
+        buffer: bytes = os.pread(
+            self._fd, count * self._dtype.itemsize,
+            self._data_start + start * self._dtype.itemsize)
+        data: np.array = np.frombuffer(buffer, dtype=self._dtype)
+        self._pages[page] = data
+        if len(self._pages) > self.cache_pages:
+            self._pages.popitem(last=False)  # least recently used
+        return data
+
+    def neighbors(self, node: int, as_set=True) -> Union[Set[int], np.array]:
+        start: int = int(self._offsets[node])
+        end: int = int(self._offsets[node + 1])
+        first: int = start // self.page_size
+        last: int = (end - 1) // self.page_size
+        if end <= start:
+            neighbors: np.array = np.array([], dtype=self._dtype)
+        elif first == last:  # common case: a single page
+            page_start: int = first * self.page_size
+            neighbors: np.array = self._get_page(first)[start - page_start:end - page_start]
+        else:
+            neighbors: np.array = self._get_indices(np.arange(start, end))
+        if as_set:
+            return set(neighbors.tolist())
+        return neighbors
 
-    def _dfs(
-        self,
-        node: int,
-        visited: Dict[int, bool]
-    ) -> List[int]:
+    def _get_indices(self, positions: np.array) -> np.array:
         """
-        Iterative DFS because recursive ones are more storage costly
+        Gather entries page by page, so each page is read at most once.
         """
-        path: List[int] = []  # create stack for DFS
-        visited[node] = True  # mark current vertex as visited
-        path.append(node)     # add vertex to path
-
-        while len(path) > 0:
-            vertex: int = path.pop()
-
-            if not visited[vertex]:
-                visited[vertex] = True
-            
-            for v in self.neighbors(vertex):
-                if not visited[v]:
-                    path.append(v)
-
-            print(len(path))
-
-        return path
+        out: np.array = np.empty(len(positions), dtype=self._dtype)
+        if len(positions) == 0:
+            return out
+        pages: np.array = positions // self.page_size
+        order: np.array = np.argsort(pages, kind='stable')
+        sorted_pages: np.array = pages[order]
+        bounds: np.array = np.flatnonzero(np.r_[True, sorted_pages[1:] != sorted_pages[:-1]])
+        bounds: np.array = np.r_[bounds, len(order)]
+        for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            page: int = int(sorted_pages[lo])
+            which: np.array = order[lo:hi]
+            out[which] = self._get_page(page)[positions[which] - page * self.page_size]
+        return out
+
+    def save(self, graph_dir: str):
+        """
+        Copy the graph files (weights and alias tables too, if any) instead
+        of reading the neighbour array through the page cache.
+        """
+        if not os.path.isdir(graph_dir): os.makedirs(graph_dir)
+        for path in self.get_files(self.graph_dir) + self.get_weight_files(self.graph_dir):
+            target: str = os.path.join(graph_dir, os.path.basename(path))
+            if os.path.isfile(path) and not (
+                    os.path.isfile(target) and os.path.samefile(path, target)):
+                shutil.copyfile(path, target)
+
+    def close(self):
+        os.close(self._fd)
+        self._pages.clear()
+
+
+def write_csr(
+    yield_edges: Callable[[], Iterable[Tuple[np.array, ...]]],
+    graph_dir: str,
+    num_nodes: Optional[int] = None,
+    block_size: int = 2**27,
+    weighted: bool = False,
+):
+    """
+    Out-of-core CSR construction. `yield_edges` is called twice and must
+    yield the same (node_a, node_b) integer array chunks each time:
 
-    def neighbors(self, node: int) -> Set[int]:
-        edges: str = self._edges.iloc[node].edges
-        edges: List[int] = json.loads(edges)
-        return set(edges) - {node}
+    1) count degrees to lay out the rows
+    2) scatter both directions of every edge into a memmapped buffer
+    3) sort and deduplicate the rows a block of at most `block_size`
+       entries at a time, compacting the buffer in place
 
-    def connected_components(self, component_file: str) -> List[Set[int]]:
-        visited: Dict[int, bool] = defaultdict(lambda: False)
+    Only the degree arrays and one block need to fit in memory.
 
-        with jsonlines.open(component_file, mode='w') as writer:
-            pbar = tqdm(total=self._size)
-            for node in range(self._size):
-                if not visited[node]:
-                    component: List[int] = self._dfs(node, visited)
-                    component: Set[int] = set(component)
-                    if len(component) > 1:
-                        writer.write(list(component))
-                pbar.update()
-            pbar.close()
+    If `weighted`, chunks are (node_a, node_b, weight) and the weights of
+    repeated edges (in either direction) are summed. The weights and
+    their alias tables are written next to the graph.
+    """
+    if not os.path.isdir(graph_dir): os.makedirs(graph_dir)
+    offsets_file, indices_file = CSRGraph.get_files(graph_dir)
+    weights_file: str = CSRGraph.get_weight_files(graph_dir)[0]
+    buffer_file: str = os.path.join(graph_dir, 'indices.tmp')
+    weight_buffer_file: str = os.path.join(graph_dir, 'weights.tmp')
+
+    print('counting degrees',  end = '', flush=True)
+    degrees: np.array = np.zeros(num_nodes or 0, dtype=np.int64)
+    for edges in yield_edges():
+        node_a, node_b = edges[0], edges[1]
+        keep: np.array = node_a != node_b
+        ends: np.array = np.concatenate([node_a[keep], node_b[keep]])
+        if len(ends) == 0:
+            continue
+        counts: np.array = np.bincount(ends, minlength=len(degrees))
+        degrees: np.array = np.pad(degrees, (0, len(counts) - len(degrees)))
+        degrees += counts
+        print('.', end = '', flush=True)
+    print('')
+    num_nodes: int = len(degrees)
+    offsets: np.array = np.zeros(num_nodes + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(degrees)
+
+    print('filling rows',  end = '', flush=True)
+    buffer: np.memmap = np.memmap(
+        buffer_file, dtype=np.int32, mode='w+', shape=(max(int(offsets[-1]), 1),))
+    if weighted:
+        weight_buffer: np.memmap = np.memmap(
+            weight_buffer_file, dtype=np.float64, mode='w+', shape=(max(int(offsets[-1]), 1),))
+    cursor: np.array = offsets[:-1].copy()
+    for edges in yield_edges():
+        node_a, node_b = edges[0], edges[1]
+        keep: np.array = node_a != node_b
+        src: np.array = np.concatenate([node_a[keep], node_b[keep]]).astype(np.int64)
+        dst: np.array = np.concatenate([node_b[keep], node_a[keep]])
+        order: np.array = np.argsort(src, kind='stable')
+        src, dst = src[order], dst[order]
+        # position of each entry within its run of equal src
+        starts: np.array = np.flatnonzero(np.r_[True, src[1:] != src[:-1]])
+        run_lengths: np.array = np.diff(np.r_[starts, len(src)])
+        rank: np.array = np.arange(len(src)) - np.repeat(starts, run_lengths)
+        buffer[cursor[src] + rank] = dst
+        if weighted:
+            weight: np.array = np.concatenate([edges[2][keep], edges[2][keep]])
+            weight_buffer[cursor[src] + rank] = weight[order]
+        cursor[src[starts]] += run_lengths
+        print('.', end = '', flush=True)
+    print('')
+
+    print('deduplicating rows',  end = '', flush=True)
+    new_degrees: np.array = np.zeros(num_nodes, dtype=np.int64)
+    write: int = 0
+    lo: int = 0
+    while lo < num_nodes:
+        # grow the block until it holds `block_size` entries (at least one node)
+        hi: int = int(np.searchsorted(offsets, offsets[lo] + block_size, side='right')) - 1
+        hi: int = min(max(hi, lo + 1), num_nodes)
+        rows: np.array = np.repeat(np.arange(lo, hi), degrees[lo:hi])
+        values: np.array = np.array(buffer[offsets[lo]:offsets[hi]])
+        order: np.array = np.lexsort((values, rows))
+        rows, values = rows[order], values[order]
+        keep: np.array = np.r_[True, (rows[1:] != rows[:-1]) | (values[1:] != values[:-1])] \
+            if len(rows) > 0 else np.array([], dtype=bool)
+        if weighted and len(rows) > 0:
+            weight: np.array = np.array(weight_buffer[offsets[lo]:offsets[hi]])[order]
+            weight_buffer[write:write + int(keep.sum())] = \
+                np.add.reduceat(weight, np.flatnonzero(keep))  # sum repeats
+        rows, values = rows[keep], values[keep]
+        buffer[write:write + len(values)] = values  # never ahead of the read
+        new_degrees[lo:hi] = np.bincount(rows - lo, minlength=hi - lo)
+        write += len(values)
+        lo = hi
+        print('.', end = '', flush=True)
+    print('')
+
+    new_offsets: np.array = np.zeros(num_nodes + 1, dtype=np.int64)
+    new_offsets[1:] = np.cumsum(new_degrees)
+    np.save(offsets_file, new_offsets)
+
+    indices: np.memmap = np.lib.format.open_memmap(
+        indices_file, mode='w+', dtype=np.int32, shape=(write,))
+    for start in range(0, write, block_size):
+        end: int = min(start + block_size, write)
+        indices[start:end] = buffer[start:end]
+    indices.flush()
+    del indices, buffer
+    os.remove(buffer_file)
+
+    if weighted:
+        weights: np.memmap = np.lib.format.open_memmap(
+            weights_file, mode='w+', dtype=np.float32, shape=(write,))
+        for start in range(0, write, block_size):
+            end: int = min(start + block_size, write)
+            weights[start:end] = weight_buffer[start:end]
+        weights.flush()
+        del weights, weight_buffer
+        os.remove(weight_buffer_file)
+        write_alias_tables(graph_dir, block_size = block_size)
+
+
+def _segment_cumsum(values: np.array, groups: np.array) -> np.array:
+    """
+    Cumulative sum restarting at each group (`groups` must be sorted).
+    """
+    if len(values) == 0:
+        return values.copy()
+    total: np.array = np.cumsum(values)
+    first: np.array = np.r_[True, groups[1:] != groups[:-1]]
+    before: np.array = (total - values)[first]
+    return total - before[np.cumsum(first) - 1]
 
-    def subgraph(self, component: Set[int]):
-        subgraph: UndirectedGraph = UndirectedGraph()
-        subgraph.add_nodes_from(component)
 
-        for node in component:
-            links: Set[int] = self.neighbors(node)
-            links: Set[int] = links.intersection(component)
-            subgraph._edges[node] = list(links) 
+def alias_tables(degrees: np.array, weights: np.array) -> Tuple[np.array, np.array]:
+    """
+    Walker alias tables for consecutive rows of `degrees` entries each, all
+    rows at once. To sample from a row of degree d, draw a slot k uniformly
+    and keep it with probability prob[k], else take slot alias[k].
+
+    Per row, with q = weight * d / sum(weight), the usual construction
+    walks the small slots (q < 1) in order, filling each one from the
+    current large slot (q >= 1); a large slot whose mass drops below 1
+    becomes small and is filled from the next large slot. Along that walk,
+    small slot i is filled from the first large slot whose cumulative
+    excess reaches the cumulative deficit before i, and large slot j drops
+    below 1 at the first small slot whose cumulative deficit passes its
+    cumulative excess. Both are binary searches, so every row is built
+    with array operations. Rows whose weights sum to 0 are uniform.
+
+    Returns (prob, alias) with alias slots local to each row.
+    """
+    num_rows: int = len(degrees)
+    size: int = len(weights)
+    rows: np.array = np.repeat(np.arange(num_rows), degrees)
+    starts: np.array = np.cumsum(degrees) - degrees
+    local: np.array = np.arange(size) - starts[rows]
+    prob: np.array = np.ones(size, dtype=np.float64)
+    alias: np.array = local.copy()
+    if size == 0:
+        return prob, alias
+
+    totals: np.array = np.bincount(rows, weights=weights, minlength=num_rows)[rows]
+    q: np.array = np.where(
+        totals > 0, weights * degrees[rows] / np.where(totals > 0, totals, 1), 1.0)
+
+    # offset each row so values increase across rows (row r lies in
+    # [base[r], base[r] + degree[r]], below base[r + 1])
+    base: np.array = (starts + np.arange(num_rows)).astype(np.float64)
+    small: np.array = np.flatnonzero(q < 1.0)
+    large: np.array = np.flatnonzero(q >= 1.0)
+    small_rows: np.array = rows[small]
+    large_rows: np.array = rows[large]
+    deficit: np.array = 1.0 - q[small]
+    filled: np.array = _segment_cumsum(deficit, small_rows) + base[small_rows]
+    excess: np.array = _segment_cumsum(q[large] - 1.0, large_rows) + base[large_rows]
+
+    # small slots: filled from the first large slot with enough excess
+    first_large: np.array = np.searchsorted(large_rows, small_rows, side='left')
+    end_large: np.array = np.searchsorted(large_rows, small_rows, side='right')
+    donor: np.array = np.searchsorted(excess, filled - deficit, side='left')
+    donor: np.array = np.clip(donor, first_large, np.maximum(end_large - 1, first_large))
+    has_donor: np.array = end_large > first_large  # else rounding left no large slot
+    prob[small] = np.where(has_donor, q[small], 1.0)
+    alias[small] = np.where(has_donor, local[large[np.minimum(donor, len(large) - 1)]], local[small])
+
+    # large slots: drop below 1 once the deficits pass their excess, and
+    # are then filled from the next large slot of the row
+    if len(large) > 1:
+        drop: np.array = np.searchsorted(filled, excess, side='right')
+        next_in_row: np.array = np.r_[large_rows[1:] == large_rows[:-1], False]
+        valid: np.array = drop < len(small)
+        valid[valid] &= small_rows[drop[valid]] == large_rows[valid]
+        valid &= next_in_row
+        which: np.array = np.flatnonzero(valid)
+        prob[large[which]] = np.clip(1.0 - (filled[drop[which]] - excess[which]), 0.0, 1.0)
+        alias[large[which]] = local[large[which + 1]]
+
+    return prob, alias
+
+
+def write_alias_tables(graph_dir: str, block_size: int = 2**27):
+    """
+    Build the alias tables of a weighted CSR graph from its weights, a
+    block of rows at a time.
+    """
+    offsets_file, _ = CSRGraph.get_files(graph_dir)
+    weights_file, prob_file, index_file = CSRGraph.get_weight_files(graph_dir)
+    offsets: np.array = np.load(offsets_file, mmap_mode='r')
+    weights: np.array = np.load(weights_file, mmap_mode='r')
+    num_nodes: int = len(offsets) - 1
+
+    alias_prob: np.memmap = np.lib.format.open_memmap(
+        prob_file, mode='w+', dtype=np.float64, shape=(len(weights),))
+    alias_index: np.memmap = np.lib.format.open_memmap(
+        index_file, mode='w+', dtype=np.int32, shape=(len(weights),))
+
+    print('building alias tables',  end = '', flush=True)
+    lo: int = 0
+    while lo < num_nodes:
+        hi: int = int(np.searchsorted(offsets, offsets[lo] + block_size, side='right')) - 1
+        hi: int = min(max(hi, lo + 1), num_nodes)
+        start, end = int(offsets[lo]), int(offsets[hi])
+        prob, alias = alias_tables(
+            np.diff(offsets[lo:hi + 1]), np.asarray(weights[start:end], dtype=np.float64))
+        alias_prob[start:end] = prob
+        alias_index[start:end] = alias
+        lo = hi
+        print('.', end = '', flush=True)
+    print('')
+
+    alias_prob.flush()
+    alias_index.flush()
+
+
+def csr_from_csv(
+    edges_csv: str,
+    graph_dir: str,
+    num_nodes: Optional[int] = None,
+    chunk_size: int = 10000000,
+    weight_column: Optional[str] = None,
+    log_weights: bool = False,
+):
+    """
+    Write a CSR graph from a csv with integer `from_address` and
+    `to_address` columns (see scripts/diff2vec/compress_graph.py).
 
-        return subgraph
+    @weight_column: (str) if set, weight edges by this column, e.g. `size`
+        (number of transactions) or `value` (see make_graph.py)
+    @log_weights: (bool) use log(1 + weight), to damp heavy tails
+    """
+    columns: List[str] = ['from_address', 'to_address']
+    if weight_column is not None:
+        columns.append(weight_column)
+
+    def yield_edges() -> Iterable[Tuple[np.array, ...]]:
+        reader: Iterable[pd.DataFrame] = pd.read_csv(
+            edges_csv, usecols = columns, chunksize = chunk_size)
+        for chunk in reader:
+            edges: Tuple[np.array, ...] = (
+                chunk.from_address.to_numpy().astype(np.int64),
+                chunk.to_address.to_numpy().astype(np.int64))
+            if weight_column is not None:
+                weight: np.array = np.maximum(chunk[weight_column].to_numpy().astype(np.float64), 0)
+                if log_weights:
+                    weight: np.array = np.log1p(weight)
+                edges: Tuple[np.array, ...] = edges + (weight,)
+            yield edges
+
+    write_csr(yield_edges, graph_dir, num_nodes = num_nodes, weighted = weight_column is not None)
+
+
+def load_graph(path: str, cache_pages: int = 0) -> Union[UndirectedGraph, CSRGraph]:
+    """
+    Open a CSR graph directory, or an edges pickle (see make_pickle.py).
 
-    def __len__(self) -> int:
-        return self._size
+    @cache_pages: (int) if > 0, read the CSR neighbours through a bounded
+        page cache (`PagedCSRGraph`) instead of memory mapping them.
+    """
+    if os.path.isdir(path):
+        if cache_pages > 0:
+            return PagedCSRGraph(path, cache_pages = cache_pages)
+        return CSRGraph.load(path)
+    graph: UndirectedGraph = UndirectedGraph()
+    graph.from_pickle(path)
+    return graph
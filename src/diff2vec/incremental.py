@@ -0,0 +1,161 @@
+"""
+Diffusion sequences around newly seen nodes, for incremental embedding
+updates (see `Word2Vec.update` and scripts/diff2vec/run_incremental.py).
+
+New nodes come with a day of new edges. Rather than regenerating the
+whole corpus, we gather the k-hop neighbourhood of the new nodes in the
+old graph plus the new edges, build a small in-memory CSR graph over it
+and diffuse from every new node a few times. Hubs would pull millions of
+nodes into the neighbourhood, so each node expands through at most
+`max_degree` (sampled) neighbours.
+"""
+import numpy as np
+from typing import Any, List, Optional
+
+from src.diff2vec.graph import CSRGraph
+from src.diff2vec.euler import EulerianDiffusion
+
+
+def sample_neighbors(
+    graph: CSRGraph,
+    nodes: np.array,
+    max_degree: int,
+    rng: np.random.Generator,
+) -> np.array:
+    """
+    Neighbours of `nodes` (concatenated). A node with more than
+    `max_degree` neighbours contributes `max_degree` of them, drawn with
+    replacement, so hubs are never read in full.
+    """
+    nodes: np.array = np.asarray(nodes, dtype=np.int64)
+    degrees: np.array = np.asarray(graph._offsets[nodes + 1] - graph._offsets[nodes])
+    small: np.array = nodes[degrees <= max_degree]
+    large: np.array = nodes[degrees > max_degree]
+
+    _, neighbors = graph.neighbors_batch(small)
+    if len(large) == 0:
+        return neighbors
+
+    starts: np.array = np.asarray(graph._offsets[large])
+    draws: np.array = rng.random((len(large), max_degree))
+    positions: np.array = starts[:, None] + \
+        (draws * degrees[degrees > max_degree][:, None]).astype(np.int64)
+    return np.concatenate([neighbors, graph._get_indices(positions.ravel())])
+
+
+def k_hop_nodes(
+    graph: CSRGraph,
+    new_a: np.array,
+    new_b: np.array,
+    seeds: np.array,
+    k: int = 2,
+    max_degree: int = 1000,
+    rng: Optional[np.random.Generator] = None,
+) -> np.array:
+    """
+    Sorted nodes within `k` hops of `seeds`, through the edges of `graph`
+    (nodes 0 .. len(graph) - 1) and the new edges (new_a[i], new_b[i]).
+    """
+    rng: np.random.Generator = rng if rng is not None else np.random.default_rng()
+    new: CSRGraph = _relabelled_graph(new_a, new_b)
+
+    ball: np.array = np.unique(np.asarray(seeds, dtype=np.int64))
+    frontier: np.array = ball
+    for _ in range(k):
+        old: np.array = frontier[frontier < len(graph)]
+        reached: List[np.array] = [sample_neighbors(graph, old, max_degree, rng)]
+
+        pos: np.array = np.searchsorted(new._names, frontier[np.isin(frontier, new._names)])
+        reached.append(new._names[sample_neighbors(new, pos, max_degree, rng)])
+
+        frontier: np.array = np.setdiff1d(np.concatenate(reached), ball)
+        ball: np.array = np.union1d(ball, frontier)
+        if len(frontier) == 0:
+            break
+
+    return ball
+
+
+def local_graph(
+    graph: CSRGraph,
+    new_a: np.array,
+    new_b: np.array,
+    nodes: np.array,
+    max_degree: int = 1000,
+    rng: Optional[np.random.Generator] = None,
+) -> CSRGraph:
+    """
+    Graph induced on `nodes` (sorted) by the old and new edges. Nodes are
+    relabelled 0 .. len(nodes) - 1 and `get_name` maps them back.
+
+    Rows of hubs (more than `max_degree` neighbours) are sampled as in
+    `sample_neighbors`, not read in full. Rows are symmetric, so an edge
+    between a hub and a smaller node is still found from the smaller
+    node's row; only edges between two hubs may be missed.
+    """
+    rng: np.random.Generator = rng if rng is not None else np.random.default_rng()
+    old: np.array = nodes[nodes < len(graph)]
+    degrees: np.array = np.asarray(graph._offsets[old + 1] - graph._offsets[old])
+    small: np.array = old[degrees <= max_degree]
+    large: np.array = old[degrees > max_degree]
+    offsets, neighbors = graph.neighbors_batch(small)
+    node_a: np.array = np.concatenate(
+        [np.repeat(small, np.diff(offsets)), np.repeat(large, max_degree), new_a])
+    node_b: np.array = np.concatenate([
+        np.asarray(neighbors, dtype=np.int64),
+        np.asarray(sample_neighbors(graph, large, max_degree, rng), dtype=np.int64),
+        new_b,
+    ])
+
+    keep: np.array = np.isin(node_a, nodes) & np.isin(node_b, nodes)
+    local: CSRGraph = CSRGraph.from_edges(
+        np.searchsorted(nodes, node_a[keep]), np.searchsorted(nodes, node_b[keep]), len(nodes))
+    return CSRGraph(local._offsets, local._indices, names = nodes)
+
+
+def _relabelled_graph(node_a: np.array, node_b: np.array) -> CSRGraph:
+    names: np.array = np.unique(np.concatenate([node_a, node_b]).astype(np.int64))
+    graph: CSRGraph = CSRGraph.from_edges(
+        np.searchsorted(names, node_a), np.searchsorted(names, node_b), len(names))
+    return CSRGraph(graph._offsets, graph._indices, names = names)
+
+
+def write_incremental_sequences(
+    writer: Any,
+    graph: CSRGraph,
+    new_a: np.array,
+    new_b: np.array,
+    seeds: np.array,
+    k: int = 2,
+    cover_size: int = 80,
+    walks_per_node: int = 10,
+    max_degree: int = 1000,
+    max_misses_factor: int = 1000,
+    seed: int = 42,
+) -> int:
+    """
+    Diffuse `walks_per_node` times from every seed over its k-hop
+    neighbourhood and write the sequences (in node ids of `graph`) to
+    `writer` (e.g. a `BinaryCorpusWriter`). Returns the number written.
+    """
+    rng: np.random.Generator = np.random.default_rng(seed)
+    new_a: np.array = np.asarray(new_a, dtype=np.int64)
+    new_b: np.array = np.asarray(new_b, dtype=np.int64)
+    nodes: np.array = k_hop_nodes(
+        graph, new_a, new_b, seeds, k = k, max_degree = max_degree, rng = rng)
+    local: CSRGraph = local_graph(
+        graph, new_a, new_b, nodes, max_degree = max_degree, rng = rng)
+    print(f'{len(seeds)} new nodes, {len(nodes)} nodes within {k} hops.')
+
+    cover: int = min(cover_size, len(nodes))
+    euler: EulerianDiffusion = EulerianDiffusion(
+        local, [], cover, rng = rng, max_misses = max_misses_factor * cover)
+    sources: np.array = np.searchsorted(nodes, np.unique(seeds))
+
+    count: int = 0
+    for node in np.repeat(sources, walks_per_node).tolist():
+        seq: List[int] = euler._diffuse(node)
+        if len(seq) > 0:
+            writer.write(nodes[seq].tolist())
+            count += 1
+    return count
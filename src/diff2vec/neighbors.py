@@ -0,0 +1,115 @@
+"""
+Approximate nearest neighbours of the diff2vec vectors with FAISS.
+
+Index types (see `get_index_description`):
+
+    ivfflat: inverted lists of raw vectors (4 * dim bytes per vector)
+    ivfpq:   inverted lists of product-quantized codes (m bytes per vector
+             with 8 bit codes), distances are approximate
+    opq:     ivfpq after a learned rotation (OPQ), which spreads variance
+             across the sub-quantizers and usually recovers some recall
+
+`nprobe` (inverted lists visited per query) trades speed for recall;
+scripts/diff2vec/bench_neighbors.py measures that against exact search.
+"""
+import faiss
+import numpy as np
+from tqdm import tqdm
+from typing import Optional, Tuple
+
+
+def get_index_description(index_type: str, nlist: int, m: int = 16, nbits: int = 8) -> str:
+    """
+    `faiss.index_factory` string for an index type.
+    """
+    if index_type == 'ivfflat':
+        return f'IVF{nlist},Flat'
+    if index_type == 'ivfpq':
+        return f'IVF{nlist},PQ{m}x{nbits}'
+    if index_type == 'opq':
+        return f'OPQ{m},IVF{nlist},PQ{m}x{nbits}'
+    raise ValueError(f'unknown index type: {index_type}.')
+
+
+def default_nlist(size: int) -> int:
+    # https://github.com/facebookresearch/faiss/issues/112
+    return max(int(4 * np.sqrt(size)), 1)
+
+
+def build_index(
+    vectors: np.array,
+    index_type: str = 'ivfflat',
+    nlist: Optional[int] = None,
+    m: int = 16,
+    nbits: int = 8,
+    train_size: int = 2**20,
+    batch_size: int = 2**16,
+    seed: int = 42,
+) -> faiss.Index:
+    """
+    Train an index on a random sample of `train_size` vectors, then add
+    every vector a batch at a time (`vectors` may be memory mapped).
+    """
+    size, dim = vectors.shape
+    nlist: int = nlist or default_nlist(size)
+    if index_type != 'ivfflat':
+        assert dim % m == 0, f'dim {dim} is not a multiple of m={m}.'
+    index: faiss.Index = faiss.index_factory(
+        dim, get_index_description(index_type, nlist, m = m, nbits = nbits), faiss.METRIC_L2)
+
+    rng: np.random.Generator = np.random.default_rng(seed)
+    sample: np.array = np.sort(rng.choice(size, min(train_size, size), replace=False))
+    print(f'training {get_index_description(index_type, nlist, m = m, nbits = nbits)} '
+          f'on {len(sample)} vectors...', end=' ', flush=True)
+    index.train(np.ascontiguousarray(vectors[sample], dtype=np.float32))
+    print('done')
+    assert index.is_trained
+
+    for start in tqdm(range(0, size, batch_size), desc='adding'):
+        index.add(np.ascontiguousarray(vectors[start:start + batch_size], dtype=np.float32))
+    return index
+
+
+def set_nprobe(index: faiss.Index, nprobe: int):
+    faiss.extract_index_ivf(index).nprobe = nprobe
+
+
+def search(
+    index: faiss.Index,
+    queries: np.array,
+    k: int,
+    batch_size: int = 2**16,
+    distances: Optional[np.array] = None,
+    neighbors: Optional[np.array] = None,
+    verbose: bool = True,
+) -> Tuple[np.array, np.array]:
+    """
+    Search `queries` a batch at a time. FAISS spreads each batch over its
+    OpenMP threads, so large batches keep them busy. Results are written
+    into `distances` / `neighbors` if given (e.g. `open_memmap` arrays).
+    """
+    size: int = len(queries)
+    if distances is None:
+        distances: np.array = np.empty((size, k), dtype=np.float32)
+    if neighbors is None:
+        neighbors: np.array = np.empty((size, k), dtype=np.int64)
+
+    num_batches: int = (size + batch_size - 1) // batch_size
+    for i in tqdm(range(num_batches), disable=not verbose):
+        start: int = i * batch_size
+        query: np.array = np.ascontiguousarray(queries[start:start + batch_size], dtype=np.float32)
+        D, I = index.search(query, k)
+        distances[start:start + len(query)] = D
+        neighbors[start:start + len(query)] = I
+
+    return distances, neighbors
+
+
+def recall_at_k(found: np.array, truth: np.array) -> float:
+    """
+    Average fraction of the exact k nearest neighbours that were found.
+    """
+    k: int = truth.shape[1]
+    hits: int = sum(
+        len(np.intersect1d(a[a >= 0], b)) for a, b in zip(found, truth))
+    return hits / float(k * len(truth))
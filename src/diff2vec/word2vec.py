@@ -15,13 +15,12 @@ import os
 import heapq
 import jsonlines
 from timeit import default_timer
-from collections import defaultdict, namedtuple
+from collections import namedtuple
 from collections.abc import Iterable
 from types import GeneratorType
 import threading
 import itertools
 import copy
-from tqdm import tqdm
 from queue import Queue, Empty
 
 from numpy import float32 as REAL
@@ -34,6 +33,7 @@ from gensim import utils, matutils
 from smart_open.compression import get_supported_extensions
 
 from src.utils.utils import to_json, from_json
+from src.diff2vec.corpus import get_corpus_files, get_range_bounds, iter_corpus_range, count_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -49,25 +49,6 @@ try:
 except ImportError:
     raise utils.NO_CYTHON
 
-try:
-    from gensim.models.word2vec_corpusfile import train_epoch_sg, train_epoch_cbow, CORPUSFILE_VERSION
-except ImportError:
-    # file-based word2vec is not supported
-    CORPUSFILE_VERSION = -1
-
-    def train_epoch_sg(
-            model, corpus_file, offset, _cython_vocab, _cur_epoch, _expected_examples, _expected_words,
-            _work, _neu1, compute_loss,
-        ):
-        raise RuntimeError("Training with corpus_file argument is not supported")
-
-    def train_epoch_cbow(
-            model, corpus_file, offset, _cython_vocab, _cur_epoch, _expected_examples, _expected_words,
-            _work, _neu1, compute_loss,
-        ):
-        raise RuntimeError("Training with corpus_file argument is not supported")
-
-
 class Word2Vec(utils.SaveLoad):
     def __init__(
             self,corpus_file, corpus_size, vector_size=100, alpha=0.025, window=5, min_count=5,
@@ -108,7 +89,8 @@ class Word2Vec(utils.SaveLoad):
         self.sorted_vocab = sorted_vocab
         self.null_word = null_word
         self.cum_table = None  # for negative sampling
-        self.raw_vocab = None
+        self.raw_words = None  # distinct words (node ids), and their counts
+        self.raw_counts = None
 
         if not os.path.isdir(cache_dir): os.makedirs(cache_dir)
         self.cache_dir = cache_dir
@@ -150,9 +132,10 @@ class Word2Vec(utils.SaveLoad):
 
             vocab_stats = from_json(cache_vocab_stats)
             self.total_words = vocab_stats['total_words']
+            self.corpus_total_words = vocab_stats['total_words']
             self.corpus_count = vocab_stats['corpus_count']
 
-            self.wv.load(cache_wv_file)
+            self.wv = KeyedVectors.load(cache_wv_file)
             self.cum_table = np.load(cache_cum_table)
             self.init_weights()
 
@@ -174,45 +157,82 @@ class Word2Vec(utils.SaveLoad):
         self.prepare_weights(update=update)
         self.add_lifecycle_event("build_vocab", update=update, trim_rule=str(trim_rule))
 
-    def _scan_vocab(self, sentences, size, progress_per, trim_rule):
-        sentence_no = -1
-        total_words = 0
-        min_reduce = 1
-        vocab = defaultdict(int)
-        checked_string_types = 0
-        print('building vocab')
-        pbar = tqdm(total=size)
-        for sentence_no, sentence in enumerate(sentences):
-            if not checked_string_types:
-                if isinstance(sentence, str):
-                    logger.warning(
-                        "Each 'sentences' item should be a list of words (usually unicode strings). "
-                        "First item here is instead plain %s.",
-                        type(sentence),
-                    )
-                checked_string_types += 1
-            if sentence_no % progress_per == 0:
-                logger.info(
-                    "PROGRESS: at sentence #%i, processed %i words, keeping %i word types",
-                    sentence_no, total_words, len(vocab),
-                )
-            for word in sentence:
-                vocab[word] += 1
-            total_words += len(sentence)
+    def update(
+            self, corpus_file, cache_dir, epochs=3, old_lockf=0.0, min_count=None,
+            alpha=None, callbacks=(),
+        ):
+        """Add the words of a new `corpus_file` (e.g. sequences around newly seen nodes,
+        see scripts/diff2vec/run_incremental.py) to the vocabulary, and train on that
+        corpus alone for `epochs`.
 
-            if self.max_vocab_size and len(vocab) > self.max_vocab_size:
-                utils.prune_vocab(vocab, min_reduce, trim_rule=trim_rule)
-                min_reduce += 1
+        Through `wv.vectors_lockf`, updates to the vectors that existed before are
+        scaled by `old_lockf`: 0.0 freezes them, a small value lets them adjust lightly.
+        New vectors are trained at the full rate. The vocabulary of `corpus_file` is
+        cached in `cache_dir`, which must not be the cache of the original corpus.
 
-            pbar.update()
-        pbar.close()
+        Returns the number of words added.
+        """
+        if not os.path.isdir(cache_dir): os.makedirs(cache_dir)
+        assert os.path.abspath(cache_dir) != os.path.abspath(self.cache_dir), \
+            "use a new cache_dir for each update."
+        self.cache_dir = cache_dir
+        num_old = len(self.wv)
+
+        self._check_corpus_sanity(corpus_file=corpus_file, passes=1)
+        total_words, corpus_count = self.scan_vocab(corpus_file, None)
+        self.prepare_vocab(update=True, min_count=min_count)
+        self.prepare_weights(update=True)
+
+        lockf = np.ones(len(self.wv), dtype=REAL)
+        lockf[:num_old] = old_lockf
+        self.wv.vectors_lockf = lockf
+        try:
+            self.train(
+                corpus_file=corpus_file, corpus_size=None, total_examples=corpus_count,
+                total_words=total_words, epochs=epochs, start_alpha=alpha or self.alpha,
+                end_alpha=self.min_alpha, callbacks=callbacks)
+        finally:
+            self.wv.vectors_lockf = np.ones(1, dtype=REAL)
+
+        self.add_lifecycle_event(
+            "update", msg=f"added {len(self.wv) - num_old} words, old_lockf={old_lockf}")
+        return len(self.wv) - num_old
+
+    def save_node_vectors(self, vectors_file, num_nodes=None):
+        """Save the word vectors as an `.npy` array whose row i is the vector of node i
+        (zeros for nodes outside the vocabulary), the layout read by get_neighbors.py."""
+        keys = self.wv.index_to_key
+        rows = np.array([i for i, key in enumerate(keys) if not isinstance(key, str)], dtype=np.int64)
+        nodes = np.array([keys[i] for i in rows.tolist()], dtype=np.int64)
+        num_nodes = num_nodes or (int(nodes.max()) + 1 if len(nodes) else 0)
+
+        vectors = np.lib.format.open_memmap(
+            vectors_file, mode='w+', dtype=REAL, shape=(num_nodes, self.wv.vector_size))
+        keep = nodes < num_nodes
+        vectors[nodes[keep]] = self.wv.vectors[rows[keep]]
+        vectors.flush()
+        del vectors
+
+    def _scan_vocab(self, corpus_file, size, workers, trim_rule):
+        """Count words with :func:`~src.diff2vec.corpus.count_tokens`, which bincounts
+        ranges of the corpus in `workers` processes (words are integer node ids)."""
+        print('building vocab')
+        words, counts, corpus_count, total_words = count_tokens(corpus_file, workers=workers)
+        assert size is None or corpus_count == size, "Incorrect corpus size?"
+
+        # same rule as utils.prune_vocab, applied to the arrays
+        min_reduce = 1
+        while self.max_vocab_size and len(words) > self.max_vocab_size:
+            keep = counts >= min_reduce
+            words, counts = words[keep], counts[keep]
+            min_reduce += 1
 
-        corpus_count = sentence_no + 1
-        assert corpus_count == self.corpus_size, "Incorrect corpus size?"
-        self.raw_vocab = vocab
+        self.raw_words, self.raw_counts = words, counts
 
-        cache_vocab = os.path.join(self.cache_dir, 'vocab.json')
-        to_json(vocab, cache_vocab)
+        cache_words = os.path.join(self.cache_dir, 'vocab-words.npy')
+        cache_counts = os.path.join(self.cache_dir, 'vocab-counts.npy')
+        np.save(cache_words, words)
+        np.save(cache_counts, counts)
 
         cache_stats = os.path.join(self.cache_dir, 'vocab-stats.json')
         to_json({'total_words': total_words, 'corpus_count': corpus_count}, cache_stats)
@@ -221,23 +241,33 @@ class Word2Vec(utils.SaveLoad):
 
     def scan_vocab(self, corpus_file, corpus_size, progress_per=10000, workers=None, trim_rule=None):
         logger.info("collecting all words and their counts")
-        corpus_iterable = JSONLineSentence(corpus_file)
 
-        cache_vocab = os.path.join(self.cache_dir, 'vocab.json')
+        cache_words = os.path.join(self.cache_dir, 'vocab-words.npy')
+        cache_counts = os.path.join(self.cache_dir, 'vocab-counts.npy')
+        cache_vocab = os.path.join(self.cache_dir, 'vocab.json')  # older caches
         cache_stats = os.path.join(self.cache_dir, 'vocab-stats.json')
-        if os.path.isfile(cache_vocab) and os.path.isfile(cache_stats):
+        if os.path.isfile(cache_words) and os.path.isfile(cache_counts) and os.path.isfile(cache_stats):
             print('loading vocabulary from cache file.')
-            self.raw_vocab = from_json(cache_vocab)
+            self.raw_words, self.raw_counts = np.load(cache_words), np.load(cache_counts)
+            stats = from_json(cache_stats)
+            total_words = stats['total_words']
+            corpus_count = stats['corpus_count']
+        elif os.path.isfile(cache_vocab) and os.path.isfile(cache_stats):
+            print('loading vocabulary from cache file.')
+            # json keys are strings but the words are integer node ids
+            vocab = from_json(cache_vocab)
+            self.raw_words = np.array([int(word) for word in vocab.keys()], dtype=np.int64)
+            self.raw_counts = np.array(list(vocab.values()), dtype=np.int64)
             stats = from_json(cache_stats)
             total_words = stats['total_words']
             corpus_count = stats['corpus_count']
         else:
             total_words, corpus_count = self._scan_vocab(
-                corpus_iterable, corpus_size, progress_per, trim_rule)
+                corpus_file, corpus_size, workers or self.workers, trim_rule)
 
         logger.info(
             "collected %i word types from a corpus of %i raw words and %i sentences",
-            len(self.raw_vocab), total_words, corpus_count
+            len(self.raw_words), total_words, corpus_count
         )
 
         return total_words, corpus_count
@@ -259,7 +289,7 @@ class Word2Vec(utils.SaveLoad):
         """
         min_count = min_count or self.min_count
         sample = sample or self.sample
-        drop_total = drop_unique = 0
+        words, counts = self.raw_words, self.raw_counts
 
         # set effective_min_count to min_count in case max_final_vocab isn't set
         self.effective_min_count = min_count
@@ -267,11 +297,11 @@ class Word2Vec(utils.SaveLoad):
         # If max_final_vocab is specified instead of min_count,
         # pick a min_count which satisfies max_final_vocab as well as possible.
         if self.max_final_vocab is not None:
-            sorted_vocab = sorted(self.raw_vocab.keys(), key=lambda word: self.raw_vocab[word], reverse=True)
             calc_min_count = 1
 
-            if self.max_final_vocab < len(sorted_vocab):
-                calc_min_count = self.raw_vocab[sorted_vocab[self.max_final_vocab]] + 1
+            if self.max_final_vocab < len(counts):
+                # count of the (max_final_vocab + 1)-th most frequent word
+                calc_min_count = int(-np.partition(-counts, self.max_final_vocab)[self.max_final_vocab]) + 1
 
             self.effective_min_count = max(calc_min_count, min_count)
             self.add_lifecycle_event(
@@ -282,39 +312,31 @@ class Word2Vec(utils.SaveLoad):
                 )
             )
 
+        if trim_rule is None:
+            keep = counts >= self.effective_min_count
+        else:
+            keep = np.array([
+                keep_vocab_item(word, v, self.effective_min_count, trim_rule=trim_rule)
+                for word, v in zip(words.tolist(), counts.tolist())
+            ], dtype=bool)
+        drop_unique = int(np.count_nonzero(~keep))
+        drop_total = int(counts[~keep].sum())
+        retain_words = words[keep].tolist()
+        retain_counts = counts[keep]
+
         if not update:
             logger.info("Creating a fresh vocabulary")
-            retain_total, retain_words = 0, []
-            # Discard words less-frequent than min_count
+            retain_total = int(retain_counts.sum())
             if not dry_run:
-                self.wv.index_to_key = []
+                print('populating wv index')
                 # make stored settings match these applied settings
                 self.min_count = min_count
                 self.sample = sample
-                self.wv.key_to_index = {}
-
-            print('populating wv index')
-            pbar = tqdm(total=len(self.raw_vocab))
-            for word, v in self.raw_vocab.items():
-                if keep_vocab_item(word, v, self.effective_min_count, trim_rule=trim_rule):
-                    retain_words.append(word)
-                    retain_total += v
-                    if not dry_run:
-                        self.wv.key_to_index[word] = len(self.wv.index_to_key)
-                        self.wv.index_to_key.append(word)
-                else:
-                    drop_unique += 1
-                    drop_total += v
-                pbar.update()
-            pbar.close()
-            if not dry_run:
-                # now update counts
-                print('updating wv counts')
-                pbar = tqdm(total=len(self.wv.index_to_key))
-                for word in self.wv.index_to_key:
-                    self.wv.set_vecattr(word, 'count', self.raw_vocab[word])
-                    pbar.update()
-                pbar.close()
+                self.wv.index_to_key = retain_words
+                self.wv.key_to_index = {word: i for i, word in enumerate(retain_words)}
+                self.wv.expandos = {}
+                self.wv.allocate_vecattrs(attrs=['count'], types=[np.int64])
+                self.wv.expandos['count'][:] = retain_counts
             original_unique_total = len(retain_words) + drop_unique
             retain_unique_pct = len(retain_words) * 100 / max(original_unique_total, 1)
             self.add_lifecycle_event(
@@ -339,27 +361,21 @@ class Word2Vec(utils.SaveLoad):
             new_total = pre_exist_total = 0
             new_words = []
             pre_exist_words = []
-            for word, v in self.raw_vocab.items():
-                if keep_vocab_item(word, v, self.effective_min_count, trim_rule=trim_rule):
-                    if self.wv.has_index_for(word):
-                        pre_exist_words.append(word)
-                        pre_exist_total += v
-                        if not dry_run:
-                            pass
-                    else:
-                        new_words.append(word)
-                        new_total += v
-                        if not dry_run:
-                            self.wv.key_to_index[word] = len(self.wv.index_to_key)
-                            self.wv.index_to_key.append(word)
+            for word, v in zip(retain_words, retain_counts.tolist()):
+                if self.wv.has_index_for(word):
+                    pre_exist_words.append(word)
+                    pre_exist_total += v
                 else:
-                    drop_unique += 1
-                    drop_total += v
+                    new_words.append(word)
+                    new_total += v
+                    if not dry_run:
+                        self.wv.key_to_index[word] = len(self.wv.index_to_key)
+                        self.wv.index_to_key.append(word)
             if not dry_run:
                 # now update counts
-                self.wv.allocate_vecattrs(attrs=['count'], types=[type(0)])
-                for word in self.wv.index_to_key:
-                    self.wv.set_vecattr(word, 'count', self.wv.get_vecattr(word, 'count') + self.raw_vocab.get(word, 0))
+                self.wv.allocate_vecattrs(attrs=['count'], types=[np.int64])
+                indices = np.array([self.wv.get_index(word) for word in retain_words], dtype=np.int64)
+                self.wv.expandos['count'][indices] += retain_counts
             original_unique_total = len(pre_exist_words) + len(new_words) + drop_unique
             pre_exist_unique_pct = len(pre_exist_words) * 100 / max(original_unique_total, 1)
             new_unique_pct = len(new_words) * 100 / max(original_unique_total, 1)
@@ -371,7 +387,6 @@ class Word2Vec(utils.SaveLoad):
                     f"pre-existing words ({pre_exist_unique_pct}%% of original {original_unique_total})"
                 ),
             )
-            retain_words = new_words + pre_exist_words
             retain_total = new_total + pre_exist_total
 
         # Precalculate each vocabulary item's threshold for sampling
@@ -386,25 +401,21 @@ class Word2Vec(utils.SaveLoad):
             threshold_count = int(sample * (3 + np.sqrt(5)) / 2)
 
         print('processing retained words')
-        pbar = tqdm(total=len(retain_words))
-        downsample_total, downsample_unique = 0, 0
-        for w in retain_words:
-            v = self.raw_vocab[w]
-            word_probability = (np.sqrt(v / threshold_count) + 1) * (threshold_count / v)
-            if word_probability < 1.0:
-                downsample_unique += 1
-                downsample_total += word_probability * v
-            else:
-                word_probability = 1.0
-                downsample_total += v
-            if not dry_run:
-                self.wv.set_vecattr(w, 'sample_int', np.uint32(word_probability * (2**32 - 1)))
-            pbar.update()
-        pbar.close()
+        v = retain_counts.astype(np.float64)
+        word_probability = (np.sqrt(v / threshold_count) + 1) * (threshold_count / v)
+        downsampled = word_probability < 1.0
+        word_probability[~downsampled] = 1.0
+        downsample_unique = int(np.count_nonzero(downsampled))
+        downsample_total = float((word_probability * v).sum())
+        if not dry_run:
+            self.wv.allocate_vecattrs(attrs=['sample_int'], types=[np.uint32])
+            indices = np.array([self.wv.get_index(word) for word in retain_words], dtype=np.int64) \
+                if update else np.arange(len(retain_words))
+            self.wv.expandos['sample_int'][indices] = (word_probability * (2**32 - 1)).astype(np.uint32)
 
         if not dry_run and not keep_raw_vocab:
-            logger.info("deleting the raw counts dictionary of %i items", len(self.raw_vocab))
-            self.raw_vocab = defaultdict(int)
+            logger.info("deleting the raw counts of %i items", len(self.raw_words))
+            self.raw_words, self.raw_counts = None, None
 
         logger.info("sample=%g downsamples %i most-common words", sample, downsample_unique)
         self.add_lifecycle_event(
@@ -494,26 +505,13 @@ class Word2Vec(utils.SaveLoad):
 
         """
         vocab_size = len(self.wv.index_to_key)
+        print('making cum table')
+        counts = self.wv.expandos.get('count', np.zeros(0))[:vocab_size].astype(np.float64)
+        cumulative = np.cumsum(counts**float(self.ns_exponent))
         self.cum_table = np.zeros(vocab_size, dtype=np.uint32)
-        # compute sum of all power (Z in paper)
-        train_words_pow = 0.0
-        print('making cum table: pass 1')
-        pbar = tqdm(total=vocab_size)
-        for word_index in range(vocab_size):
-            count = self.wv.get_vecattr(word_index, 'count')
-            train_words_pow += count**float(self.ns_exponent)
-            pbar.update()
-        pbar.close()
-        print('making cum table: pass 2')
-        pbar = tqdm(total=vocab_size)
-        cumulative = 0.0
-        for word_index in range(vocab_size):
-            count = self.wv.get_vecattr(word_index, 'count')
-            cumulative += count**float(self.ns_exponent)
-            self.cum_table[word_index] = round(cumulative / train_words_pow * domain)
-            pbar.update()
-        pbar.close()
-        if len(self.cum_table) > 0:
+        if vocab_size > 0:
+            train_words_pow = cumulative[-1]  # sum of all powers (Z in paper)
+            self.cum_table[:] = np.round(cumulative / train_words_pow * domain)
             assert self.cum_table[-1] == domain
 
     def prepare_weights(self, update=False):
@@ -583,21 +581,44 @@ class Word2Vec(utils.SaveLoad):
         self.wv.init_sims(replace=replace)
 
     def _do_train_epoch(
-            self, corpus_file, thread_id, offset, cython_vocab, thread_private_mem, cur_epoch,
+            self, corpus_file, thread_id, start, end, thread_private_mem, progress_queue, cur_epoch,
             total_examples=None, total_words=None, **kwargs,
         ):
-        work, neu1 = thread_private_mem
+        """Train on the sentences in `[start, end)` of `corpus_file` (see
+        :func:`~src.diff2vec.corpus.get_range_bounds`), in batches of at most `batch_words` words.
 
-        if self.sg:
-            examples, tally, raw_tally = train_epoch_sg(
-                self, corpus_file, offset, cython_vocab, cur_epoch,
-                total_examples, total_words, work, neu1, self.compute_loss
-            )
-        else:
-            examples, tally, raw_tally = train_epoch_cbow(
-                self, corpus_file, offset, cython_vocab, cur_epoch,
-                total_examples, total_words, work, neu1, self.compute_loss
-            )
+        The learning rate decays with this thread's progress through its own range; ranges hold
+        about the same number of words, so the threads stay in step. The Cython batch updates
+        release the GIL, so only reading and batching the sentences is serialised.
+
+        """
+        batch, batch_size = [], 0
+        examples, tally, raw_tally = 0, 0, 0
+        expected_words = max(1, total_words // self.workers)
+
+        def train_batch():
+            alpha = self._get_next_alpha(min(1.0, raw_tally / expected_words), cur_epoch)
+            batch_tally, batch_raw = self._do_train_job(batch, alpha, thread_private_mem)
+            progress_queue.put((len(batch), batch_tally, batch_raw))
+            return batch_tally, batch_raw
+
+        for sentence in iter_corpus_range(corpus_file, start, end):
+            # longer sentences are truncated by the batch routines, as in gensim
+            sentence = sentence[:self.batch_words]
+            if batch and batch_size + len(sentence) > self.batch_words:
+                batch_tally, batch_raw = train_batch()
+                examples += len(batch)
+                tally += batch_tally
+                raw_tally += batch_raw
+                batch, batch_size = [], 0
+            batch.append(sentence)
+            batch_size += len(sentence)
+
+        if batch:
+            batch_tally, batch_raw = train_batch()
+            examples += len(batch)
+            tally += batch_tally
+            raw_tally += batch_raw
 
         return examples, tally, raw_tally
 
@@ -693,24 +714,25 @@ class Word2Vec(utils.SaveLoad):
         return trained_word_count, raw_word_count
 
     def _worker_loop_corpusfile(
-            self, corpus_file, thread_id, offset, cython_vocab, progress_queue, cur_epoch=0,
+            self, corpus_file, thread_id, start, end, progress_queue, cur_epoch=0,
             total_examples=None, total_words=None, **kwargs,
         ):
-        """Train the model on a `corpus_file` in LineSentence format.
+        """Train the model on one range of a `corpus_file`.
 
-        This function will be called in parallel by multiple workers (threads or processes) to make
+        This function will be called in parallel by multiple worker threads to make
         optimal use of multicore machines.
 
         Parameters
         ----------
         corpus_file : str
-            Path to a corpus file in :class:`~gensim.models.word2vec.LineSentence` format.
+            Path to a binary corpus, a JSON lines file or a directory of JSON lines shards.
         thread_id : int
             Thread index starting from 0 to `number of workers - 1`.
-        offset : int
-            Offset (in bytes) in the `corpus_file` for particular worker.
-        cython_vocab : :class:`~gensim.models.word2vec_inner.CythonVocab`
-            Copy of the vocabulary in order to access it without GIL.
+        start : int
+            Start of the range read by this worker (a sentence index for a binary corpus,
+            else a byte offset).
+        end : int
+            End of the range, exclusive.
         progress_queue : Queue of (int, int, int)
             A queue of progress reports. Each report is represented as a tuple of these 3 elements:
                 * Size of data chunk processed, for example number of sentences in the corpus chunk.
@@ -722,11 +744,10 @@ class Word2Vec(utils.SaveLoad):
         """
         thread_private_mem = self._get_thread_working_mem()
 
-        examples, tally, raw_tally = self._do_train_epoch(
-            corpus_file, thread_id, offset, cython_vocab, thread_private_mem, cur_epoch,
+        self._do_train_epoch(
+            corpus_file, thread_id, start, end, thread_private_mem, progress_queue, cur_epoch,
             total_examples=total_examples, total_words=total_words, **kwargs)
 
-        progress_queue.put((examples, tally, raw_tally))
         progress_queue.put(None)
 
     def _job_producer(self, data_iterator, job_queue, cur_epoch=0, total_examples=None, total_words=None):
@@ -882,7 +903,7 @@ class Word2Vec(utils.SaveLoad):
         Parameters
         ----------
         corpus_file : str
-            Path to a corpus file in :class:`~gensim.models.word2vec.LineSentence` format.
+            Path to a binary corpus, a JSON lines file or a directory of JSON lines shards.
         cur_epoch : int, optional
             The current training epoch, needed to compute the training parameters for each job.
             For example in many implementations the learning rate would be dropping with the number of epochs.
@@ -891,7 +912,7 @@ class Word2Vec(utils.SaveLoad):
             in a corpus, used to log progress.
         total_words : int
             Count of total objects in `data_iterator`. In the usual case this would correspond to the number of raw
-            words in a corpus, used to log progress. Must be provided in order to seek in `corpus_file`.
+            words in a corpus, used to log progress. Must be provided to decay the learning rate.
         **kwargs : object
             Additional key word parameters for the specific model inheriting from this class.
 
@@ -907,13 +928,10 @@ class Word2Vec(utils.SaveLoad):
         if not total_words:
             raise ValueError("total_words must be provided alongside corpus_file argument.")
 
-        from gensim.models.word2vec_corpusfile import CythonVocab
-        from gensim.models.fasttext import FastText
-        cython_vocab = CythonVocab(self.wv, hs=self.hs, fasttext=isinstance(self, FastText))
-
         progress_queue = Queue()
 
-        corpus_file_size = os.path.getsize(corpus_file)
+        # contiguous ranges with about the same number of words each
+        bounds = get_range_bounds(corpus_file, self.workers)
 
         thread_kwargs = copy.copy(kwargs)
         thread_kwargs['cur_epoch'] = cur_epoch
@@ -923,7 +941,7 @@ class Word2Vec(utils.SaveLoad):
             threading.Thread(
                 target=self._worker_loop_corpusfile,
                 args=(
-                    corpus_file, thread_id, corpus_file_size / self.workers * thread_id, cython_vocab, progress_queue
+                    corpus_file, thread_id, bounds[thread_id], bounds[thread_id + 1], progress_queue
                 ),
                 kwargs=thread_kwargs
             ) for thread_id in range(self.workers)
@@ -998,8 +1016,8 @@ class Word2Vec(utils.SaveLoad):
             raise TypeError("Either one of corpus_file or corpus_iterable value must be provided")
         if corpus_file is not None and corpus_iterable is not None:
             raise TypeError("Both corpus_file and corpus_iterable must not be provided at the same time")
-        if corpus_iterable is None and not os.path.isfile(corpus_file):
-            raise TypeError("Parameter corpus_file must be a valid path to a file, got %r instead" % corpus_file)
+        if corpus_iterable is None and not (os.path.isfile(corpus_file) or os.path.isdir(corpus_file)):
+            raise TypeError("Parameter corpus_file must be a valid path to a file or shard directory, got %r instead" % corpus_file)
         if corpus_iterable is not None and not isinstance(corpus_iterable, Iterable):
             raise TypeError(
                 "The corpus_iterable must be an iterable of lists of strings, got %r instead" % corpus_iterable)
@@ -1566,11 +1584,11 @@ class JSONLineSentence:
         self.source = source
 
     def __iter__(self):
-        """Iterate through the lines in the source."""
-        # If it didn't work like a file, use it as a string filename
-        with jsonlines.open(self.source, 'r') as reader:
-            for line in reader:
-                yield line
+        """Iterate through the lines in the source, shard by shard."""
+        for path in get_corpus_files(self.source):
+            with jsonlines.open(path, 'r') as reader:
+                for line in reader:
+                    yield line
 
 
 class LineSentence:
@@ -0,0 +1,299 @@
+"""
+Sidecar index mapping block numbers to byte offsets in a CSV that is
+sorted by block number (e.g. the BigQuery transactions export).
+
+With the index we can seek straight to any block range instead of
+scanning the file from the top, and cut the file into chunks that end
+on block boundaries and stay under a byte (memory) budget.
+
+Assumes rows do not contain quoted newlines, which holds for the
+transaction and block tables we export. Blank lines are rejected: the
+offsets come from counting newlines, so every line has to be a row.
+"""
+import io
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from typing import Iterable, List, Optional, Tuple
+
+
+def _yield_row_offsets(
+    fp: io.BufferedReader,
+    start: int,
+    buffer_size: int = 2**26,
+) -> Iterable[np.array]:
+    """
+    Yield the byte offset at which every row starts, in order, by
+    scanning for newlines `buffer_size` bytes at a time.
+    """
+    fp.seek(start)
+    base: int = start
+    row_start: int = start
+    while True:
+        buffer: bytes = fp.read(buffer_size)
+        if len(buffer) == 0:
+            break
+        newlines: np.array = np.flatnonzero(
+            np.frombuffer(buffer, dtype=np.uint8) == ord('\n')) + base
+        if len(newlines) > 0:
+            yield np.concatenate([[row_start], newlines[:-1] + 1])
+            row_start: int = int(newlines[-1]) + 1
+        base += len(buffer)
+    if row_start < base:  # last row without trailing newline
+        yield np.array([row_start])
+
+
+def hash_head(csv_file: str, size: int = 2**16) -> str:
+    """
+    Fingerprint the start of a file to tell an append from a rewrite.
+    """
+    with open(csv_file, 'rb') as fp:
+        return hashlib.md5(fp.read(size)).hexdigest()
+
+
+class _OffsetReader:
+    """
+    Hand out row offsets from `_yield_row_offsets` in arbitrary counts.
+    """
+
+    def __init__(self, offsets: Iterable[np.array]):
+        self._offsets: Iterable[np.array] = offsets
+        self._buffer: np.array = np.array([], dtype=np.int64)
+
+    def take(self, count: int) -> np.array:
+        parts: List[np.array] = [self._buffer]
+        size: int = len(self._buffer)
+        while size < count:
+            part: np.array = next(self._offsets)
+            parts.append(part)
+            size += len(part)
+        buffer: np.array = np.concatenate(parts).astype(np.int64)
+        self._buffer = buffer[count:]
+        return buffer[:count]
+
+
+class BlockIndex:
+    """
+    Index of a block-sorted CSV. For every distinct block we store the
+    byte offset and row number of its first row.
+
+    @csv_file: (str) path to the indexed csv
+    @column: (str) name of the block number column
+    """
+
+    def __init__(self, csv_file: str, column: str = 'block_number'):
+        self.csv_file: str = csv_file
+        self.column: str = column
+        self.header: List[str] = []
+        self.blocks: np.array = np.array([], dtype=np.int64)
+        self.offsets: np.array = np.array([], dtype=np.int64)
+        self.rows: np.array = np.array([], dtype=np.int64)  # row index of each block start
+        self.num_rows: int = 0
+        self.end: int = 0  # byte offset up to which the file is indexed
+        self.head: str = ''
+
+    @staticmethod
+    def get_index_file(csv_file: str) -> str:
+        return f'{csv_file}.blockindex.npz'
+
+    def build(self, chunk_size: int = 1000000, verbose: bool = True):
+        """
+        One pass over the csv: pandas parses the block column while a
+        vectorised newline scan tracks where every row starts.
+        """
+        with open(self.csv_file, 'rb') as fp:
+            header_line: bytes = fp.readline()
+            self.header = pd.read_csv(io.BytesIO(header_line), nrows=0).columns.tolist()
+            self.blocks = np.array([], dtype=np.int64)
+            self.offsets = np.array([], dtype=np.int64)
+            self.rows = np.array([], dtype=np.int64)
+            self.num_rows = 0
+            self.end = len(header_line)
+            self._scan(fp, chunk_size, verbose)
+        self.head = hash_head(self.csv_file)
+
+    def extend(self, chunk_size: int = 1000000, verbose: bool = True) -> bool:
+        """
+        Index rows appended to the csv since the index was built. Returns
+        False (and rebuilds) if the file was rewritten rather than appended to.
+        """
+        size: int = os.path.getsize(self.csv_file)
+        if (size < self.end) or (hash_head(self.csv_file) != self.head):
+            self.build(chunk_size, verbose)
+            return False
+        if size > self.end:
+            with open(self.csv_file, 'rb') as fp:
+                self._scan(fp, chunk_size, verbose)
+        return True
+
+    def _scan(self, fp: io.BufferedReader, chunk_size: int, verbose: bool):
+        start: int = self.end
+        if start >= os.path.getsize(self.csv_file):
+            return
+
+        blocks: List[np.array] = [self.blocks]
+        offsets: List[np.array] = [self.offsets]
+        rows: List[np.array] = [self.rows]
+        prev_block: Optional[int] = int(self.blocks[-1]) if len(self.blocks) > 0 else None
+        num_rows: int = self.num_rows
+
+        if verbose: print('indexing blocks', end = '', flush=True)
+        with open(self.csv_file, 'rb') as offset_fp:
+            row_offsets: _OffsetReader = _OffsetReader(_yield_row_offsets(offset_fp, start))
+            fp.seek(start)
+            reader: Iterable[pd.DataFrame] = pd.read_csv(
+                fp, names = self.header, usecols = [self.column], chunksize = chunk_size,
+                skip_blank_lines = False)
+            for chunk in reader:
+                if chunk[self.column].isna().any():
+                    row: int = num_rows + int(np.flatnonzero(chunk[self.column].isna())[0])
+                    raise Exception(
+                        f'{self.csv_file} has a blank or empty {self.column} at row {row}.')
+                chunk_blocks: np.array = chunk[self.column].to_numpy().astype(np.int64)
+                chunk_offsets: np.array = row_offsets.take(len(chunk_blocks))
+
+                first: int = chunk_blocks[0] - 1 if prev_block is None else prev_block
+                previous: np.array = np.concatenate([[first], chunk_blocks[:-1]])
+                assert np.all(chunk_blocks >= previous), \
+                    f'{self.csv_file} must be sorted by {self.column}.'
+
+                # rows where a new block begins
+                starts: np.array = np.flatnonzero(chunk_blocks != previous)
+                blocks.append(chunk_blocks[starts])
+                offsets.append(chunk_offsets[starts])
+                rows.append(starts + num_rows)
+
+                num_rows += len(chunk_blocks)
+                prev_block: int = int(chunk_blocks[-1])
+                if verbose: print('.', end = '', flush=True)
+        if verbose: print('')
+
+        self.blocks = np.concatenate(blocks).astype(np.int64)
+        self.offsets = np.concatenate(offsets).astype(np.int64)
+        self.rows = np.concatenate(rows).astype(np.int64)
+        self.num_rows = num_rows
+        self.end = os.path.getsize(self.csv_file)
+
+    @property
+    def counts(self) -> np.array:
+        """
+        Number of rows in each block.
+        """
+        return np.diff(np.append(self.rows, self.num_rows))
+
+    def save(self, index_file: Optional[str] = None):
+        index_file: str = index_file or self.get_index_file(self.csv_file)
+        with open(index_file, 'wb') as fp:
+            np.savez(
+                fp,
+                blocks = self.blocks,
+                offsets = self.offsets,
+                rows = self.rows,
+                num_rows = np.array([self.num_rows], dtype=np.int64),
+                end = np.array([self.end], dtype=np.int64),
+                header = np.array(self.header),
+                column = np.array([self.column]),
+                head = np.array([self.head]),
+            )
+
+    @classmethod
+    def load(cls, csv_file: str, index_file: Optional[str] = None):
+        index_file: str = index_file or cls.get_index_file(csv_file)
+        data = np.load(index_file)
+        index: BlockIndex = cls(csv_file, column = str(data['column'][0]))
+        index.blocks = data['blocks']
+        index.offsets = data['offsets']
+        index.rows = data['rows']
+        index.num_rows = int(data['num_rows'][0])
+        index.end = int(data['end'][0])
+        index.header = data['header'].tolist()
+        index.head = str(data['head'][0])
+        return index
+
+    @classmethod
+    def load_or_build(
+        cls,
+        csv_file: str,
+        column: str = 'block_number',
+        index_file: Optional[str] = None,
+    ):
+        """
+        Load the sidecar index if present (indexing any appended rows),
+        otherwise build it and save it next to the csv.
+        """
+        index_file: str = index_file or cls.get_index_file(csv_file)
+        if os.path.isfile(index_file):
+            index: BlockIndex = cls.load(csv_file, index_file)
+            if (index.end != os.path.getsize(csv_file)) or \
+               (index.head != hash_head(csv_file)):
+                index.extend()
+                index.save(index_file)
+        else:
+            index: BlockIndex = cls(csv_file, column)
+            index.build()
+            index.save(index_file)
+        return index
+
+    def _sizes(self) -> np.array:
+        """
+        Number of bytes taken by each block.
+        """
+        return np.diff(np.append(self.offsets, self.end))
+
+    def find(self, start_block: Optional[int], end_block: Optional[int]) -> Tuple[int, int]:
+        """
+        Positions [lo, hi) in the index covering blocks in [start_block, end_block].
+        """
+        lo: int = 0 if start_block is None else \
+            int(np.searchsorted(self.blocks, start_block, side='left'))
+        hi: int = len(self.blocks) if end_block is None else \
+            int(np.searchsorted(self.blocks, end_block, side='right'))
+        return lo, hi
+
+    def byte_range(self, start_block: Optional[int], end_block: Optional[int]) -> Tuple[int, int]:
+        lo, hi = self.find(start_block, end_block)
+        if lo >= hi:
+            return 0, 0
+        end: int = int(self.offsets[hi]) if hi < len(self.offsets) else self.end
+        return int(self.offsets[lo]), end
+
+    def plan_chunks(
+        self,
+        max_bytes: int,
+        start_block: Optional[int] = None,
+        end_block: Optional[int] = None,
+    ) -> List[Tuple[int, int]]:
+        """
+        Split blocks in [start_block, end_block] into consecutive (first, last)
+        block ranges of at most `max_bytes` each. A single block larger than
+        the budget gets a chunk of its own.
+        """
+        lo, hi = self.find(start_block, end_block)
+        cumsum: np.array = np.concatenate([[0], np.cumsum(self._sizes()[lo:hi])])
+
+        chunks: List[Tuple[int, int]] = []
+        i: int = 0
+        while i < hi - lo:
+            j: int = int(np.searchsorted(cumsum, cumsum[i] + max_bytes, side='right')) - 1
+            j: int = max(j, i + 1)  # at least one block
+            chunks.append((int(self.blocks[lo + i]), int(self.blocks[lo + j - 1])))
+            i = j
+        return chunks
+
+    def read_blocks(
+        self,
+        start_block: Optional[int] = None,
+        end_block: Optional[int] = None,
+        **kwargs,
+    ) -> pd.DataFrame:
+        """
+        Random access: read all rows with block in [start_block, end_block].
+        """
+        start, end = self.byte_range(start_block, end_block)
+        with open(self.csv_file, 'rb') as fp:
+            fp.seek(start)
+            data: bytes = fp.read(end - start)
+        if len(data) == 0:
+            return pd.DataFrame(columns = self.header)
+        return pd.read_csv(io.BytesIO(data), names = self.header, **kwargs)
@@ -1,7 +1,14 @@
 import os
-from typing import Any, Iterable, Dict, Optional, Set
+import csv
+import itertools
+from collections import deque
+from typing import Any, Iterable, Dict, List, Optional
+import numpy as np
 import pandas as pd
 
+from src.utils.blockindex import BlockIndex, hash_head
+from src.utils.utils import from_json, to_json, to_sorted_bytes
+
 
 class DataLoader:
     """
@@ -11,7 +18,8 @@ class DataLoader:
     def get_blocks(self) -> Iterable[Any]:
         raise NotImplementedError
     
-    def yield_transactions(self, chunk_size: int = 10000) -> Iterable[Any]:
+    def yield_transactions(
+        self, chunk_size: int = 10000, skip_rows: int = 0) -> Iterable[Any]:
         raise NotImplementedError
 
 
@@ -50,16 +58,17 @@ class DataframeLoader(DataLoader):
 
         # find miners
         print('fetching miners...')
-        miners_file: str = os.path.join(cache_dir, 'miners.csv')
-        miners: pd.Series = self._find_miners(block_csv, cache_file = miners_file)
+        miners_file: str = os.path.join(cache_dir, 'miners.npy')
+        miners: np.array = self._find_miners(block_csv, cache_file = miners_file)
 
         self._exchanges: pd.DataFrame = exchanges
-        self._miners: pd.Series = miners
+        self._miners: np.array = miners
         self._blacklist: pd.DataFrame = blacklist
 
         self._block_csv = block_csv
         self._transaction_csv = transaction_csv
         self._known_addresses_csv = known_addresses_csv
+        self._block_index: Optional[BlockIndex] = None
 
     def get_exchanges(self) -> pd.DataFrame:
         return self._exchanges
@@ -72,7 +81,7 @@ class DataframeLoader(DataLoader):
         del metadata['address']  # don't need this
         return metadata
 
-    def get_miners(self) -> pd.DataFrame:
+    def get_miners(self) -> np.array:
         return self._miners
 
     def get_blacklist(self) -> pd.DataFrame:
@@ -81,36 +90,115 @@ class DataframeLoader(DataLoader):
     def _find_miners(
         self,
         block_csv: str,
-        chunk_size: int = 10000,
+        chunk_size: int = 100000,
         cache_file: Optional[str] = None,
-    ) -> pd.Series:
+    ) -> np.array:
         """
         Load a segment of the block csv at a time and store unique
         miner addresses. Otherwise, it is too large.
+
+        The cache is a sorted byte array (see `isin_sorted`) plus a JSON
+        sidecar recording the block range it covers and where it stopped
+        reading `block_csv`. Blocks appended to the csv are read from
+        that byte offset; if the csv was rewritten (e.g. the live daily
+        export) we only keep blocks outside the cached range.
         """
-        if os.path.isfile(cache_file):
-            miners = pd.read_csv(cache_file)
+        meta_file: str = os.path.splitext(cache_file)[0] + '.json'
+        if os.path.isfile(cache_file) and os.path.isfile(meta_file):
+            miners: np.array = np.load(cache_file)
+            meta: Dict[str, Any] = from_json(meta_file)
         else:
-            miners: Set = set()
-            for chunk in pd.read_csv(block_csv, chunksize = chunk_size):
+            miners: np.array = to_sorted_bytes([])
+            meta: Dict[str, Any] = {
+                'min_block': None, 'max_block': None, 'end': 0, 'head': ''}
+
+        size: int = os.path.getsize(block_csv)
+        head_size: int = min(meta['end'], 2**16)  # bytes hashed when cached
+        appended: bool = (size >= meta['end']) and \
+            (hash_head(block_csv, head_size) == meta['head'])
+        if appended and size == meta['end']:
+            print(f'found {len(miners)} miners.')
+            return miners
+
+        min_block: Optional[int] = meta['min_block']
+        max_block: Optional[int] = meta['max_block']
+        new_miners: List[np.array] = [miners]
+        with open(block_csv, 'rb') as fp:
+            header: List[str] = next(csv.reader([fp.readline().decode('utf-8')]))
+            if appended and meta['end'] > 0: fp.seek(meta['end'])
+            reader: Iterable[pd.DataFrame] = pd.read_csv(
+                fp, names = header, usecols = ['number', 'miner'], chunksize = chunk_size)
+            for chunk in reader:
                 chunk: pd.DataFrame = chunk
-                chunk_miners: pd.DataFrame = chunk.miner.drop_duplicates()
-                chunk_miners: Set = set(chunk_miners)
-                miners: Set = miners.union(chunk_miners)
-            miners: pd.Series = pd.Series(list(miners))
-            
-            cache_dir: str = os.path.dirname(cache_file)
-            if not os.path.isdir(cache_dir): os.makedirs(cache_dir)
-            miners.to_csv(cache_file)
+                if not appended and min_block is not None:
+                    # rewritten file: skip blocks we already cover
+                    chunk: pd.DataFrame = chunk[
+                        (chunk.number < min_block) | (chunk.number > max_block)]
+                if len(chunk) == 0:
+                    continue
+                new_miners.append(to_sorted_bytes(chunk.miner.dropna()))
+                chunk_min: int = int(chunk.number.min())
+                chunk_max: int = int(chunk.number.max())
+                min_block: int = chunk_min if min_block is None else min(min_block, chunk_min)
+                max_block: int = chunk_max if max_block is None else max(max_block, chunk_max)
+        miners: np.array = to_sorted_bytes(np.concatenate(new_miners))
+
+        cache_dir: str = os.path.dirname(cache_file)
+        if not os.path.isdir(cache_dir): os.makedirs(cache_dir)
+        np.save(cache_file, miners)
+        to_json({'min_block': min_block, 'max_block': max_block,
+                 'end': size, 'head': hash_head(block_csv, min(size, 2**16))},
+                meta_file)
         print(f'found {len(miners)} miners.')
         return miners
 
     def yield_transactions(
         self,
         chunk_size: int = 10000,
+        skip_rows: int = 0,
     ) -> Iterable[pd.DataFrame]:
         """
         Load a segment at a time (otherwise too large).
+
+        @skip_rows: (int) number of data rows to skip before the first chunk.
+            Skipped lines are not parsed, which makes resuming a run cheap.
+        """
+        if skip_rows == 0:
+            for chunk in pd.read_csv(self._transaction_csv, chunksize = chunk_size):
+                yield chunk
+            return
+
+        with open(self._transaction_csv, 'r', newline='') as fp:
+            header: List[str] = next(csv.reader([fp.readline()]))
+            deque(itertools.islice(fp, skip_rows), maxlen=0)  # consume lines
+            for chunk in pd.read_csv(fp, names = header, chunksize = chunk_size):
+                yield chunk
+
+    def get_block_index(self) -> BlockIndex:
+        """
+        Sidecar block offset index over the transaction csv. Built on
+        first use and saved next to the csv.
+        """
+        if self._block_index is None:
+            self._block_index = BlockIndex.load_or_build(self._transaction_csv)
+        return self._block_index
+
+    def yield_transaction_blocks(
+        self,
+        max_bytes: int,
+        start_block: Optional[int] = None,
+        end_block: Optional[int] = None,
+    ) -> Iterable[pd.DataFrame]:
+        """
+        Load chunks that start and end on block boundaries and take at
+        most `max_bytes` of csv each (unless a single block is larger).
+        """
+        index: BlockIndex = self.get_block_index()
+        for first, last in index.plan_chunks(max_bytes, start_block, end_block):
+            yield index.read_blocks(first, last)
+
+    def read_transaction_blocks(self, start_block: int, end_block: int) -> pd.DataFrame:
+        """
+        Random access to all transactions in [start_block, end_block].
         """
-        for chunk in pd.read_csv(self._transaction_csv, chunksize = chunk_size):
-            yield chunk
+        return self.get_block_index().read_blocks(start_block, end_block)
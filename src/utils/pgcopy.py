@@ -0,0 +1,108 @@
+"""
+Write Postgres binary COPY files (`COPY ... FROM ... WITH (FORMAT binary)`)
+from numpy arrays, without formatting a single value as text.
+
+Layout (all integers big-endian, see the COPY documentation):
+
+    header:  11-byte signature, int32 flags, int32 extension length
+    tuple:   int16 field count, then per field int32 length + bytes
+    trailer: int16 -1
+
+Rows whose fields all have a fixed width share one structured dtype, so
+a block of rows is filled with array assignments and written with a
+single `write`. One-dimensional arrays without nulls (`bigint[]`,
+`real[]`) are fixed width given their length.
+"""
+import numpy as np
+from typing import Any, List, Tuple
+
+PGCOPY_SIGNATURE: bytes = b'PGCOPY\n\xff\r\n\x00'
+
+# element type oids
+INT8_OID: int = 20
+FLOAT4_OID: int = 700
+
+
+def write_header(fp: Any):
+    fp.write(PGCOPY_SIGNATURE)
+    fp.write(np.array([0, 0], dtype='>i4').tobytes())  # flags, header extension
+
+
+def write_trailer(fp: Any):
+    fp.write(np.array([-1], dtype='>i2').tobytes())
+
+
+def array_dtype(element: str, length: int) -> List[Tuple[Any, ...]]:
+    """
+    Fields of a one-dimensional array value without nulls: the header
+    (ndim, has null, element oid, size, lower bound), then each element
+    as int32 length + data.
+    """
+    return [
+        ('ndim', '>i4'), ('has_null', '>i4'), ('oid', '>i4'), ('size', '>i4'), ('lower', '>i4'),
+        ('elements', [('length', '>i4'), ('value', element)], (length,)),
+    ]
+
+
+def fill_array(field: np.array, values: np.array, oid: int):
+    field['ndim'] = 1
+    field['has_null'] = 0
+    field['oid'] = oid
+    field['size'] = values.shape[1]
+    field['lower'] = 1
+    field['elements']['length'] = np.dtype(field.dtype['elements'].base['value']).itemsize
+    field['elements']['value'] = values
+
+
+def embedding_rows(
+    ids: np.array,
+    addresses: np.array,
+    neighbors: np.array,
+    distances: np.array,
+) -> np.array:
+    """
+    Binary COPY tuples for `embedding(id, address, neighbors, distances)`:
+    bigint, text, bigint[] and real[]. `addresses` are byte strings of
+    one length (see `write_embedding_rows` for mixed lengths).
+    """
+    k: int = neighbors.shape[1]
+    width: int = addresses.dtype.itemsize
+    dtype: np.dtype = np.dtype([
+        ('num_fields', '>i2'),
+        ('id_length', '>i4'), ('id', '>i8'),
+        ('address_length', '>i4'), ('address', f'S{width}'),
+        ('neighbors_length', '>i4'), ('neighbors', array_dtype('>i8', k)),
+        ('distances_length', '>i4'), ('distances', array_dtype('>f4', k)),
+    ])
+    rows: np.array = np.zeros(len(ids), dtype=dtype)
+    rows['num_fields'] = 4
+    rows['id_length'] = 8
+    rows['id'] = ids
+    rows['address_length'] = width
+    rows['address'] = addresses
+    rows['neighbors_length'] = dtype['neighbors'].itemsize
+    fill_array(rows['neighbors'], neighbors, INT8_OID)
+    rows['distances_length'] = dtype['distances'].itemsize
+    fill_array(rows['distances'], distances, FLOAT4_OID)
+    return rows
+
+
+def write_embedding_rows(
+    fp: Any,
+    ids: np.array,
+    addresses: np.array,
+    neighbors: np.array,
+    distances: np.array,
+):
+    """
+    Write rows whose addresses may differ in length: COPY does not care
+    about row order, so rows are written grouped by address length.
+    """
+    addresses: np.array = np.asarray(addresses, dtype=bytes)
+    lengths: np.array = np.char.str_len(addresses)
+    for width in np.unique(lengths).tolist():
+        which: np.array = np.flatnonzero(lengths == width)
+        fp.write(embedding_rows(
+            ids[which], addresses[which].astype(f'S{width}'),
+            neighbors[which], distances[which],
+        ).tobytes())
@@ -0,0 +1,308 @@
+"""
+Run a DAG of script stages, skipping stages whose outputs are current.
+
+A stage declares the files or directories it reads (`inputs`), the ones
+it writes (`outputs`) and the options that change what it writes
+(`params`). Stage B depends on stage A when B reads a path A writes (or
+a path inside it). The key of a stage hashes its command, its params,
+the source of its script and the content of its inputs; after a
+successful run the key and the content hashes of the outputs are saved
+to `{state_dir}/{name}.json`. A stage is current when its key is
+unchanged and its outputs still have the recorded hashes.
+
+Because keys use the content of upstream outputs rather than upstream
+keys, changing a parameter reruns the stage and then only the
+downstream stages whose inputs actually changed.
+
+Content hashes are cached by (size, mtime) in `{state_dir}/hashes.json`,
+so a large file is read once per change. Ready stages run in parallel
+as subprocesses (at most `jobs` at a time); the output of each goes to
+`{state_dir}/{name}.log`.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+
+class Stage:
+    """
+    @name: (str) unique name, also names the state and log files
+    @cmd: (List[str]) command to run
+    @inputs: (List[str]) files or directories read
+    @outputs: (List[str]) files or directories written
+    @params: (Dict[str, Any]) options that change the outputs (hashed)
+    @source: (Optional[str]) script file, hashed so code changes rerun the stage
+    """
+
+    def __init__(
+        self,
+        name: str,
+        cmd: List[str],
+        inputs: List[str],
+        outputs: List[str],
+        params: Optional[Dict[str, Any]] = None,
+        source: Optional[str] = None,
+    ):
+        self.name: str = name
+        self.cmd: List[str] = cmd
+        self.inputs: List[str] = [os.path.normpath(path) for path in inputs]
+        self.outputs: List[str] = [os.path.normpath(path) for path in outputs]
+        self.params: Dict[str, Any] = params or {}
+        self.source: Optional[str] = source
+
+
+def script_stage(
+    name: str,
+    module: str,
+    positional: List[str],
+    inputs: List[str],
+    outputs: List[str],
+    options: Optional[Dict[str, Any]] = None,
+    untracked: Optional[Dict[str, Any]] = None,
+) -> Stage:
+    """
+    Stage running `python -m module positional --option value ...`.
+    `options` are hashed; `untracked` options (workers, threads) are not,
+    as they do not change the outputs. A True value is passed as a flag,
+    None and False are left out.
+    """
+    options: Dict[str, Any] = options or {}
+    untracked: Dict[str, Any] = untracked or {}
+    cmd: List[str] = [sys.executable, '-m', module] + positional
+    for option, value in list(options.items()) + list(untracked.items()):
+        if value is None or value is False:
+            continue
+        cmd.append(f'--{option}')
+        if value is not True:
+            cmd.append(str(value))
+    params: Dict[str, Any] = dict(module = module, positional = positional, options = options)
+    source: str = module.replace('.', os.sep) + '.py'
+    return Stage(name, cmd, inputs, outputs, params = params, source = source)
+
+
+def _is_within(path: str, parent: str) -> bool:
+    return path == parent or path.startswith(parent + os.sep)
+
+
+class Pipeline:
+    """
+    @stages: (List[Stage]) stages, in any order
+    @state_dir: (str) where to keep keys, hashes and logs
+    """
+
+    def __init__(self, stages: List[Stage], state_dir: str):
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f'Duplicate stage {stage.name}.')
+            self.stages[stage.name] = stage
+        self.state_dir: str = state_dir
+        self.deps: Dict[str, Set[str]] = self._get_deps()
+        self.order: List[str] = self._get_order()
+
+        if not os.path.isdir(state_dir): os.makedirs(state_dir)
+        self.hash_file: str = os.path.join(state_dir, 'hashes.json')
+        self.hashes: Dict[str, Tuple[int, int, str]] = {}
+        if os.path.isfile(self.hash_file):
+            with open(self.hash_file) as fp:
+                self.hashes = json.load(fp)
+
+    def _get_deps(self) -> Dict[str, Set[str]]:
+        producers: List[Tuple[str, str]] = []
+        for stage in self.stages.values():
+            for output in stage.outputs:
+                for other, path in producers:
+                    if _is_within(output, path) or _is_within(path, output):
+                        raise ValueError(f'Stages {other} and {stage.name} both write {output}.')
+                producers.append((stage.name, output))
+
+        deps: Dict[str, Set[str]] = {}
+        for stage in self.stages.values():
+            deps[stage.name] = set(
+                name for name, output in producers for path in stage.inputs
+                if name != stage.name and (_is_within(path, output) or _is_within(output, path))
+            )
+        return deps
+
+    def _get_order(self) -> List[str]:
+        order: List[str] = []
+        done: Set[str] = set()
+        while len(order) < len(self.stages):
+            ready: List[str] = [
+                name for name in self.stages if name not in done and self.deps[name] <= done]
+            if len(ready) == 0:
+                raise ValueError(f'Cycle between stages {sorted(set(self.stages) - done)}.')
+            order.extend(ready)
+            done.update(ready)
+        return order
+
+    def downstream(self, names: List[str]) -> Set[str]:
+        """
+        Stages in `names` and every stage that depends on them.
+        """
+        out: Set[str] = set(names)
+        for name in self.order:
+            if self.deps[name] & out:
+                out.add(name)
+        return out
+
+    def hash_file_content(self, path: str, block_size: int = 2**24) -> str:
+        stat: os.stat_result = os.stat(path)
+        cached: Optional[List[Any]] = self.hashes.get(path)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        md5: Any = hashlib.md5()
+        with open(path, 'rb') as fp:
+            for block in iter(lambda: fp.read(block_size), b''):
+                md5.update(block)
+        digest: str = md5.hexdigest()
+        self.hashes[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def hash_path(self, path: str) -> Optional[str]:
+        """
+        Content hash of a file, or of the names and contents of all files
+        under a directory. None if the path does not exist.
+        """
+        if os.path.isfile(path):
+            return self.hash_file_content(path)
+        if not os.path.isdir(path):
+            return None
+        md5: Any = hashlib.md5()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file: str = os.path.join(root, name)
+                md5.update(os.path.relpath(file, path).encode())
+                md5.update(self.hash_file_content(file).encode())
+        return md5.hexdigest()
+
+    def get_key(self, stage: Stage) -> str:
+        inputs: Dict[str, Optional[str]] = {path: self.hash_path(path) for path in stage.inputs}
+        missing: List[str] = [path for path, digest in inputs.items() if digest is None]
+        if len(missing) > 0:
+            raise FileNotFoundError(f'Stage {stage.name} is missing inputs {missing}.')
+        source: Optional[str] = None
+        if stage.source is not None and os.path.isfile(stage.source):
+            source = self.hash_file_content(stage.source)
+        # the interpreter may differ between machines, the rest of the command may not
+        blob: str = json.dumps(dict(
+            cmd = stage.cmd[1:], params = stage.params, source = source, inputs = inputs,
+        ), sort_keys=True, default=str)
+        return hashlib.md5(blob.encode()).hexdigest()
+
+    def get_state_file(self, stage: Stage) -> str:
+        return os.path.join(self.state_dir, f'{stage.name}.json')
+
+    def is_current(self, stage: Stage, key: str) -> bool:
+        state_file: str = self.get_state_file(stage)
+        if not os.path.isfile(state_file):
+            return False
+        with open(state_file) as fp:
+            state: Dict[str, Any] = json.load(fp)
+        if state['key'] != key:
+            return False
+        return all(self.hash_path(path) == digest for path, digest in state['outputs'].items())
+
+    def save_state(self, stage: Stage, key: str, seconds: float):
+        outputs: Dict[str, Optional[str]] = {path: self.hash_path(path) for path in stage.outputs}
+        missing: List[str] = [path for path, digest in outputs.items() if digest is None]
+        if len(missing) > 0:
+            raise RuntimeError(f'Stage {stage.name} did not write {missing}.')
+        state_file: str = self.get_state_file(stage)
+        with open(state_file + '.tmp', 'w') as fp:
+            json.dump(dict(key = key, outputs = outputs, seconds = round(seconds, 3)), fp, indent=2)
+        os.replace(state_file + '.tmp', state_file)
+        self.save_hashes()
+
+    def save_hashes(self):
+        with open(self.hash_file + '.tmp', 'w') as fp:
+            json.dump(self.hashes, fp)
+        os.replace(self.hash_file + '.tmp', self.hash_file)
+
+    def run_stage(self, stage: Stage) -> Tuple[int, float]:
+        for path in stage.outputs:
+            dirname: str = os.path.dirname(path)
+            if len(dirname) > 0 and not os.path.isdir(dirname): os.makedirs(dirname)
+        log_file: str = os.path.join(self.state_dir, f'{stage.name}.log')
+        start: float = time.perf_counter()
+        with open(log_file, 'w') as fp:
+            code: int = subprocess.call(stage.cmd, stdout=fp, stderr=subprocess.STDOUT)
+        return code, time.perf_counter() - start
+
+    def run(self, jobs: int = 1, force: Optional[List[str]] = None, dry_run: bool = False) -> List[str]:
+        """
+        Run every stage that is not current, at most `jobs` at a time.
+        Stages in `force` (and their downstream stages) always run. With
+        `dry_run`, only report, without touching any file: a stage is
+        assumed to rerun if it is forced or any stage it depends on does.
+
+        Returns the names of the stages that ran (or would run).
+        """
+        forced: Set[str] = self.downstream(force or [])
+        if not dry_run:
+            for name in forced:
+                if os.path.isfile(self.get_state_file(self.stages[name])):
+                    os.remove(self.get_state_file(self.stages[name]))
+
+        ran: List[str] = []
+        done: Set[str] = set()
+        running: Dict[Future, Tuple[str, str]] = {}
+        failed: List[str] = []
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            while len(done) < len(self.stages):
+                ready: List[str] = [
+                    name for name in self.order
+                    if name not in done and name not in [n for n, _ in running.values()]
+                    and self.deps[name] <= done
+                ]
+                for name in ready if len(failed) == 0 else []:
+                    stage: Stage = self.stages[name]
+                    if dry_run:
+                        # inputs of a stage after one that would run may not exist yet
+                        stale: bool = name in forced or len(self.deps[name] & set(ran)) > 0 or \
+                            not self.is_current(stage, self.get_key(stage))
+                        print(f'[{name}] {"would run" if stale else "current"}')
+                        if stale: ran.append(name)
+                        done.add(name)
+                        continue
+                    key: str = self.get_key(stage)
+                    if self.is_current(stage, key):
+                        print(f'[{name}] current, skipped')
+                        done.add(name)
+                        continue
+                    state_file: str = self.get_state_file(stage)
+                    if os.path.isfile(state_file): os.remove(state_file)
+                    print(f'[{name}] running: {" ".join(stage.cmd[1:])}')
+                    running[executor.submit(self.run_stage, stage)] = (name, key)
+
+                if len(running) == 0:
+                    if len(ready) > 0 and len(failed) == 0:
+                        continue  # skipped stages may have made others ready
+                    break
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, key = running.pop(future)
+                    code, seconds = future.result()
+                    if code != 0:
+                        print(f'[{name}] failed with exit code {code}, '
+                              f'see {os.path.join(self.state_dir, name + ".log")}')
+                        failed.append(name)
+                        continue
+                    self.save_state(self.stages[name], key, seconds)
+                    print(f'[{name}] done in {seconds:.1f}s')
+                    ran.append(name)
+                    done.add(name)
+
+        if not dry_run:
+            self.save_hashes()
+        if len(failed) > 0:
+            raise RuntimeError(f'Stages {failed} failed.')
+        return ran
@@ -40,6 +40,27 @@ class JSONSetEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+def to_sorted_bytes(values) -> np.array:
+    """
+    Unique, sorted fixed-width byte strings (e.g. addresses). Compact to
+    store and searchable with `np.searchsorted`.
+    """
+    return np.unique(np.asarray(values, dtype=bytes))
+
+
+def isin_sorted(values, sorted_array: np.array) -> np.array:
+    """
+    Boolean mask of which `values` appear in `sorted_array` (as built by
+    `to_sorted_bytes`). Binary search instead of building a hash table.
+    """
+    values: np.array = np.asarray(values, dtype=bytes)
+    if len(sorted_array) == 0:
+        return np.zeros(len(values), dtype=bool)
+    pos: np.array = np.searchsorted(sorted_array, values)
+    pos: np.array = np.minimum(pos, len(sorted_array) - 1)
+    return sorted_array[pos] == values
+
+
 def to_json(obj, path):
     with open(path, 'w') as fp:
         json.dump(obj, fp, cls=JSONSetEncoder)
@@ -0,0 +1,99 @@
+"""
+`src.diff2vec.addresses.AddressIndex`: building, encode / decode across
+the base and delta segments, and rebuilding over existing deltas.
+"""
+import os
+from typing import Iterator, List
+
+import numpy as np
+import pytest
+
+from src.diff2vec.addresses import AddressIndex
+
+
+def make_addresses(rng: np.random.Generator, num: int) -> List[str]:
+    return [f'0x{k:040x}' for k in rng.integers(0, 2**62, size=num)]
+
+
+def yield_chunks(addresses: List[str], chunk_size: int = 100) -> Iterator[List[str]]:
+    for start in range(0, len(addresses), chunk_size):
+        yield addresses[start:start + chunk_size]
+
+
+@pytest.fixture
+def base(tmp_path) -> List[str]:
+    rng: np.random.Generator = np.random.default_rng(0)
+    addresses: List[str] = make_addresses(rng, 500)
+    # duplicates within and across chunks
+    AddressIndex.build(yield_chunks(addresses + addresses[::7]), str(tmp_path / 'addresses.npy'))
+    return addresses
+
+
+def test_build_sorts_and_dedupes(tmp_path, base: List[str]):
+    index: AddressIndex = AddressIndex(str(tmp_path / 'addresses.npy'))
+    assert len(index) == len(set(base))
+    assert index.decode(np.arange(len(index))).tolist() == sorted(set(base))
+    assert os.listdir(tmp_path) == ['addresses.npy']  # bucket files are removed
+
+
+def test_round_trip_across_segments(tmp_path, base: List[str]):
+    rng: np.random.Generator = np.random.default_rng(1)
+    index: AddressIndex = AddressIndex(str(tmp_path / 'addresses.npy'))
+    first: List[str] = make_addresses(rng, 50)
+    second: List[str] = make_addresses(rng, 50)
+
+    ids: np.array = index.add(first + base[:10])
+    assert np.array_equal(ids[-10:], index.encode(base[:10]))
+    assert sorted(ids[:50].tolist()) == list(range(len(base), len(base) + 50))
+    index.add(second)
+    assert len(index.get_delta_files()) == 2
+
+    # reopening picks up the deltas
+    index: AddressIndex = AddressIndex(str(tmp_path / 'addresses.npy'))
+    everything: List[str] = base + first + second
+    ids: np.array = index.encode(everything)
+    assert len(index) == len(everything)
+    assert np.array_equal(np.sort(ids), np.arange(len(everything)))
+    assert index.decode(ids).tolist() == everything
+    # ids of each delta follow the previous segment
+    assert index.encode(first).max() < index.encode(second).min()
+
+
+def test_unknown_addresses(tmp_path, base: List[str]):
+    index: AddressIndex = AddressIndex(str(tmp_path / 'addresses.npy'))
+    index.add(['0x' + 'f' * 40])
+    unknown: List[str] = ['0x' + '0' * 40, '0x' + 'f' * 39 + 'e', 'z', '']
+    assert index.encode(unknown).tolist() == [-1] * len(unknown)
+    assert index.encode(base[:3] + unknown[:1]).tolist()[-1] == -1
+    assert len(index.encode([])) == 0
+
+
+def test_add_known_addresses(tmp_path, base: List[str]):
+    index: AddressIndex = AddressIndex(str(tmp_path / 'addresses.npy'))
+    ids: np.array = index.encode(base)
+    assert np.array_equal(index.add(base), ids)
+    assert index.get_delta_files() == []
+    new: str = '0x' + 'a' * 40
+    assert index.add([new, new]).tolist() == [len(base)] * 2
+    assert np.array_equal(index.add(base + [new]), np.append(ids, len(base)))
+    assert len(index.get_delta_files()) == 1
+    assert len(index) == len(base) + 1
+
+
+def test_build_over_existing_delta(tmp_path, base: List[str]):
+    addr_file: str = str(tmp_path / 'addresses.npy')
+    index: AddressIndex = AddressIndex(addr_file)
+    index.add(['0x' + 'a' * 40])
+    assert len(index.get_delta_files()) == 1
+
+    rebuilt: AddressIndex = AddressIndex.build(yield_chunks(base[:100]), addr_file)
+    assert rebuilt.get_delta_files() == []
+    assert len(rebuilt) == 100
+    assert rebuilt.encode(['0x' + 'a' * 40]).tolist() == [-1]
+    assert rebuilt.decode(rebuilt.encode(base[:100])).tolist() == base[:100]
+
+
+def test_longer_addresses_are_rejected(tmp_path, base: List[str]):
+    index: AddressIndex = AddressIndex(str(tmp_path / 'addresses.npy'))
+    with pytest.raises(AssertionError):
+        index.encode(['0x' + 'a' * 41])
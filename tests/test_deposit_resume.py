@@ -0,0 +1,133 @@
+"""
+Resuming `DepositCluster.make_clusters` from a checkpoint after the
+process is killed must give the same output files, byte for byte, as an
+uninterrupted run. The run is killed with SIGKILL after a random number
+of checkpoints, in both the fixed row and the block-aligned modes.
+
+Run from the repository root: `python -m pytest tests`.
+"""
+import os
+import json
+import sys
+import time
+import signal
+import subprocess
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+
+import pytest
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUT_FILES: List[str] = ['metadata.csv', 'data.csv', 'transactions.csv']
+
+DRIVER: str = """
+import sys
+from src.utils.loader import DataframeLoader
+from src.cluster.deposit import DepositCluster
+data_dir, save_dir, chunk_bytes, resume = sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4] == '1'
+loader = DataframeLoader(
+    f'{data_dir}/blocks.csv', f'{data_dir}/known_addresses.csv',
+    f'{data_dir}/transactions.csv', save_dir)
+DepositCluster(
+    loader, a_max = 0.01, t_max = 2, save_dir = save_dir,
+    checkpoint_every = 1, chunk_bytes = chunk_bytes,
+).make_clusters(resume = resume)
+"""
+
+
+def make_dataset(data_dir: str, num_blocks: int = 1000, seed: int = 0):
+    """
+    Users send to deposit addresses, which forward slightly less to an
+    exchange a block or two later, mixed with unrelated transfers.
+    Values have full wei precision so float round trips show up.
+    """
+    rng: np.random.Generator = np.random.default_rng(seed)
+    address = lambda prefix, i: f'0x{prefix}{i:038x}'
+    exchanges: List[str] = [address('ee', i) for i in range(5)]
+
+    rows: List[Dict] = []
+    for block in range(num_blocks):
+        for i in range(40):
+            user: str = address('aa', int(rng.integers(0, 3000)))
+            deposit: str = address('dd', int(rng.integers(0, 800)))
+            value: int = int(rng.integers(10**16, 9 * 10**18))
+            rows.append(dict(block_number = block, from_address = user, to_address = deposit, value = value))
+            delay: int = int(rng.integers(0, 3))
+            fee: int = int(rng.integers(0, 10**16))
+            rows.append(dict(block_number = block + delay, from_address = deposit,
+                             to_address = exchanges[int(rng.integers(0, 5))], value = value - fee))
+            rows.append(dict(block_number = block, from_address = address('bb', int(rng.integers(0, 5000))),
+                             to_address = address('cc', int(rng.integers(0, 5000))),
+                             value = int(rng.integers(10**15, 9 * 10**18))))
+    txs: pd.DataFrame = pd.DataFrame(rows)
+    txs: pd.DataFrame = txs[txs.block_number < num_blocks].sort_values('block_number', kind='stable')
+    txs['transaction'] = [f'0x{i:064x}' for i in range(len(txs))]
+    txs['block_timestamp'] = txs.block_number * 13 + 1600000000
+    txs[['transaction', 'block_number', 'block_timestamp', 'from_address', 'to_address', 'value']].to_csv(
+        os.path.join(data_dir, 'transactions.csv'), index=False)
+
+    pd.DataFrame(dict(
+        number = np.arange(num_blocks),
+        miner = [address('ff', i % 7) for i in range(num_blocks)],
+    )).to_csv(os.path.join(data_dir, 'blocks.csv'), index=False)
+
+    pd.DataFrame(dict(
+        address = exchanges + [address('cc', 1)],
+        name = [f'exchange {i}' for i in range(5)] + ['contract'],
+        account_type = ['eoa'] * 5 + ['contract'],
+        entity = ['exchange'] * 5 + ['dex'],
+    )).to_csv(os.path.join(data_dir, 'known_addresses.csv'), index=False)
+
+
+def run(data_dir: str, save_dir: str, chunk_bytes: int, resume: bool = False,
+        kill_after: Optional[int] = None) -> int:
+    """
+    Run the driver. With `kill_after`, SIGKILL it once that many chunks
+    have been checkpointed. Returns the exit code.
+    """
+    cmd: List[str] = [sys.executable, '-c', DRIVER, data_dir, save_dir, str(chunk_bytes), '1' if resume else '0']
+    proc: subprocess.Popen = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL)
+    state_file: str = os.path.join(save_dir, 'checkpoint.json')
+    while kill_after is not None and proc.poll() is None:
+        try:
+            with open(state_file) as fp:
+                if json.load(fp)['chunk_count'] >= kill_after:
+                    proc.send_signal(signal.SIGKILL)
+                    break
+        except (FileNotFoundError, ValueError):
+            pass
+        time.sleep(0.002)
+    return proc.wait()
+
+
+def read_bytes(save_dir: str) -> Dict[str, bytes]:
+    out: Dict[str, bytes] = {}
+    for name in OUT_FILES:
+        with open(os.path.join(save_dir, name), 'rb') as fp:
+            out[name] = fp.read()
+    return out
+
+
+@pytest.fixture(scope='module')
+def data_dir(tmp_path_factory) -> str:
+    path: str = str(tmp_path_factory.mktemp('data'))
+    make_dataset(path)
+    return path
+
+
+@pytest.mark.parametrize('chunk_bytes', [0, 2**17])
+def test_resume_after_kill(data_dir: str, tmp_path, chunk_bytes: int):
+    reference: str = str(tmp_path / 'reference')
+    assert run(data_dir, reference, chunk_bytes) == 0
+    expected: Dict[str, bytes] = read_bytes(reference)
+    assert len(expected['data.csv'].splitlines()) > 100
+
+    # fixed rows: 20000 rows per chunk, so 6 chunks
+    rng: np.random.Generator = np.random.default_rng(chunk_bytes)
+    for trial, kill_after in enumerate(sorted(rng.choice(np.arange(1, 6), size=2, replace=False))):
+        save_dir: str = str(tmp_path / f'killed{trial}')
+        code: int = run(data_dir, save_dir, chunk_bytes, kill_after = int(kill_after))
+        assert code == -signal.SIGKILL, 'the run finished before it could be killed'
+        assert run(data_dir, save_dir, chunk_bytes, resume = True) == 0
+        assert read_bytes(save_dir) == expected, f'outputs differ after a kill at chunk {kill_after}'
@@ -0,0 +1,171 @@
+"""
+`src.diff2vec.graph` CSR graphs against plain Python / scipy references:
+neighbour lists, connected components and weighted alias tables.
+"""
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+import pytest
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from src.diff2vec.graph import CSRGraph, PagedCSRGraph, alias_tables, write_csr
+
+NUM_NODES: int = 300
+
+
+@pytest.fixture
+def edges() -> Tuple[np.array, np.array, np.array]:
+    rng: np.random.Generator = np.random.default_rng(0)
+    node_a: np.array = rng.integers(0, NUM_NODES, size=500)
+    node_b: np.array = rng.integers(0, NUM_NODES, size=500)
+    # repeats in both directions and self loops
+    node_a: np.array = np.concatenate([node_a, node_b[:50], node_a[:20]])
+    node_b: np.array = np.concatenate([node_b, node_a[:50], node_a[:20]])
+    weight: np.array = rng.integers(0, 4, size=len(node_a)).astype(np.float64)
+    return node_a, node_b, weight
+
+
+def make_adjacency(node_a: np.array, node_b: np.array) -> Dict[int, Set[int]]:
+    adjacency: Dict[int, Set[int]] = defaultdict(set)
+    for a, b in zip(node_a.tolist(), node_b.tolist()):
+        if a != b:
+            adjacency[a].add(b)
+            adjacency[b].add(a)
+    return adjacency
+
+
+def chunked(*arrays: np.array, chunk_size: int = 64) -> Callable[[], Iterable[Tuple]]:
+    def yield_edges() -> Iterable[Tuple[np.array, ...]]:
+        for start in range(0, len(arrays[0]), chunk_size):
+            yield tuple(array[start:start + chunk_size] for array in arrays)
+    return yield_edges
+
+
+def load_graphs(tmp_path, node_a: np.array, node_b: np.array) -> List[CSRGraph]:
+    graph_dir: str = str(tmp_path / 'graph')
+    # small blocks so that rows are deduplicated in several passes
+    write_csr(chunked(node_a, node_b), graph_dir, num_nodes = NUM_NODES, block_size = 100)
+    return [
+        CSRGraph.from_edges(node_a, node_b, NUM_NODES),
+        CSRGraph.load(graph_dir),
+        PagedCSRGraph(graph_dir, page_size = 16, cache_pages = 4),
+    ]
+
+
+def test_neighbors_match_adjacency(tmp_path, edges):
+    node_a, node_b, _ = edges
+    adjacency: Dict[int, Set[int]] = make_adjacency(node_a, node_b)
+    nodes: np.array = np.random.default_rng(1).integers(0, NUM_NODES, size=200)
+
+    for graph in load_graphs(tmp_path, node_a, node_b):
+        assert len(graph) == NUM_NODES
+        assert graph.nodes().tolist() == sorted(adjacency)
+        for node in range(NUM_NODES):
+            expected: Set[int] = adjacency.get(node, set())
+            assert graph.neighbors(node) == expected
+            assert graph.neighbors(node, as_set=False).tolist() == sorted(expected)
+            assert graph.degree(node) == len(expected)
+
+        offsets, indices = graph.neighbors_batch(nodes)
+        assert len(offsets) == len(nodes) + 1
+        for k, node in enumerate(nodes.tolist()):
+            assert indices[offsets[k]:offsets[k + 1]].tolist() == sorted(adjacency.get(node, set()))
+        empty_offsets, empty_indices = graph.neighbors_batch(np.array([], dtype=np.int64))
+        assert empty_offsets.tolist() == [0] and len(empty_indices) == 0
+
+
+def test_component_labels_match_scipy(tmp_path, edges):
+    node_a, node_b, _ = edges
+    # a sparser graph, so that there are many components of several sizes
+    node_a, node_b = node_a[:200], node_b[:200]
+    matrix: coo_matrix = coo_matrix(
+        (np.ones(len(node_a)), (node_a, node_b)), shape=(NUM_NODES, NUM_NODES))
+    num_components, expected = connected_components(matrix, directed=False)
+
+    for graph in load_graphs(tmp_path, node_a, node_b):
+        labels: np.array = graph.component_labels()
+        assert len(np.unique(labels)) == num_components
+        pairs: np.array = np.unique(np.stack([labels, expected]), axis=1)
+        assert pairs.shape[1] == num_components
+        # each label is the smallest node of its component
+        for label in np.unique(labels).tolist():
+            assert label == np.flatnonzero(labels == label).min()
+
+
+def test_weighted_graph_sums_repeated_edges(tmp_path, edges):
+    node_a, node_b, weight = edges
+    expected: Dict[Tuple[int, int], float] = defaultdict(float)
+    for a, b, w in zip(node_a.tolist(), node_b.tolist(), weight.tolist()):
+        if a != b:
+            expected[(a, b)] += w
+            expected[(b, a)] += w
+
+    graph_dir: str = str(tmp_path / 'weighted')
+    write_csr(chunked(node_a, node_b, weight), graph_dir,
+              num_nodes = NUM_NODES, block_size = 100, weighted = True)
+    graph: CSRGraph = CSRGraph.load(graph_dir)
+    assert graph.is_weighted()
+    for node in range(NUM_NODES):
+        start, end = int(graph._offsets[node]), int(graph._offsets[node + 1])
+        neighbors: np.array = graph._indices[start:end]
+        for neighbor, w in zip(neighbors.tolist(), graph._weights[start:end].tolist()):
+            assert w == expected[(node, neighbor)]
+        table_neighbors, prob, alias = graph.alias_table(node)
+        assert np.array_equal(table_neighbors, neighbors)
+        assert ((0 <= alias) & (alias < end - start)).all()
+
+
+def implied_probabilities(degrees: np.array, prob: np.array, alias: np.array) -> np.array:
+    """
+    Probability of drawing each slot from the tables, row by row.
+    """
+    starts: np.array = np.cumsum(degrees) - degrees
+    rows: np.array = np.repeat(np.arange(len(degrees)), degrees)
+    out: np.array = prob.copy()
+    np.add.at(out, starts[rows] + alias, 1.0 - prob)
+    return out / degrees[rows]
+
+
+def normalised(degrees: np.array, weights: np.array) -> np.array:
+    rows: np.array = np.repeat(np.arange(len(degrees)), degrees)
+    totals: np.array = np.bincount(rows, weights=weights, minlength=len(degrees))[rows]
+    # rows whose weights sum to 0 are uniform
+    return np.where(totals > 0, weights / np.where(totals > 0, totals, 1), 1.0 / degrees[rows])
+
+
+def test_alias_tables_match_weights():
+    rng: np.random.Generator = np.random.default_rng(2)
+    degrees: np.array = rng.integers(0, 12, size=400)
+    degrees[:3] = [1, 0, 5]
+    weights: np.array = rng.exponential(size=int(degrees.sum())) ** 3
+    weights[rng.random(len(weights)) < 0.3] = 0.0  # zero weights
+    weights[1:6] = 0.0  # a row whose weights all are 0 (degrees 1, 0, 5)
+
+    prob, alias = alias_tables(degrees, weights)
+    assert ((0 <= prob) & (prob <= 1)).all()
+    rows: np.array = np.repeat(np.arange(len(degrees)), degrees)
+    assert ((0 <= alias) & (alias < degrees[rows])).all()
+    expected: np.array = normalised(degrees, weights)
+    np.testing.assert_allclose(implied_probabilities(degrees, prob, alias), expected, atol=1e-9)
+
+
+def test_alias_tables_sample_empirically():
+    rng: np.random.Generator = np.random.default_rng(3)
+    degrees: np.array = np.array([4, 3, 6])
+    weights: np.array = np.array([1.0, 0.0, 3.0, 6.0,  0.0, 0.0, 0.0,  5, 0, 1, 1, 0, 3])
+    prob, alias = alias_tables(degrees, weights)
+    starts: np.array = np.cumsum(degrees) - degrees
+    expected: np.array = normalised(degrees, weights)
+
+    num_draws: int = 200000
+    for row, (start, degree) in enumerate(zip(starts.tolist(), degrees.tolist())):
+        slots: np.array = rng.integers(0, degree, size=num_draws)
+        keep: np.array = rng.random(num_draws) < prob[start + slots]
+        drawn: np.array = np.where(keep, slots, alias[start + slots])
+        freq: np.array = np.bincount(drawn, minlength=degree) / num_draws
+        np.testing.assert_allclose(freq, expected[start:start + degree], atol=0.005)
+        # zero weight neighbours are never drawn, unless the whole row is 0
+        if weights[start:start + degree].sum() > 0:
+            assert freq[weights[start:start + degree] == 0].sum() == 0
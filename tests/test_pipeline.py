@@ -0,0 +1,80 @@
+"""
+Skip / rerun behaviour of `src.utils.pipeline.Pipeline` on tiny stages:
+
+    A: writes a.txt from a parameter
+    B: reads a.txt, writes b.txt
+    C: independent, writes c.txt
+"""
+import os
+import sys
+from typing import Dict, List
+
+import pytest
+
+from src.utils.pipeline import Pipeline, Stage
+
+WRITE: str = "import sys; open(sys.argv[1], 'w').write(sys.argv[2])"
+UPPER: str = "import sys; open(sys.argv[2], 'w').write(open(sys.argv[1]).read().upper())"
+
+
+def make_pipeline(work_dir: str, value: str = 'hello') -> Pipeline:
+    path = lambda name: os.path.join(work_dir, name)
+    stages: List[Stage] = [
+        Stage('A', [sys.executable, '-c', WRITE, path('a.txt'), value], [], [path('a.txt')],
+              params = {'value': value}),
+        Stage('B', [sys.executable, '-c', UPPER, path('a.txt'), path('b.txt')],
+              [path('a.txt')], [path('b.txt')]),
+        Stage('C', [sys.executable, '-c', WRITE, path('c.txt'), 'c'], [], [path('c.txt')]),
+    ]
+    return Pipeline(stages, path('state'))
+
+
+def snapshot(work_dir: str) -> Dict[str, bytes]:
+    files: Dict[str, bytes] = {}
+    for root, _, names in os.walk(work_dir):
+        for name in names:
+            path: str = os.path.join(root, name)
+            with open(path, 'rb') as fp:
+                files[os.path.relpath(path, work_dir)] = fp.read() + str(os.stat(path).st_mtime_ns).encode()
+    return files
+
+
+@pytest.fixture
+def work_dir(tmp_path) -> str:
+    path: str = str(tmp_path)
+    assert sorted(make_pipeline(path).run(jobs = 2)) == ['A', 'B', 'C']
+    return path
+
+
+def test_second_run_skips_everything(work_dir: str):
+    assert make_pipeline(work_dir).run() == []
+    with open(os.path.join(work_dir, 'b.txt')) as fp:
+        assert fp.read() == 'HELLO'
+
+
+def test_param_change_reruns_stage_and_dependents(work_dir: str):
+    assert sorted(make_pipeline(work_dir, value = 'world').run(jobs = 2)) == ['A', 'B']
+    with open(os.path.join(work_dir, 'b.txt')) as fp:
+        assert fp.read() == 'WORLD'
+    assert make_pipeline(work_dir, value = 'world').run() == []
+
+
+def test_edited_output_reruns_its_stage(work_dir: str):
+    with open(os.path.join(work_dir, 'b.txt'), 'w') as fp:
+        fp.write('edited')
+    assert make_pipeline(work_dir).run() == ['B']
+    with open(os.path.join(work_dir, 'b.txt')) as fp:
+        assert fp.read() == 'HELLO'
+
+
+def test_dry_run_has_no_side_effects(work_dir: str):
+    before: Dict[str, bytes] = snapshot(work_dir)
+    assert sorted(make_pipeline(work_dir).run(dry_run = True, force = ['A'])) == ['A', 'B']
+    assert sorted(make_pipeline(work_dir, value = 'world').run(dry_run = True)) == ['A', 'B']
+    assert snapshot(work_dir) == before
+    assert make_pipeline(work_dir).run(dry_run = True) == []
+
+
+def test_force_reruns_downstream(work_dir: str):
+    assert sorted(make_pipeline(work_dir).run(force = ['A'])) == ['A', 'B']
+    assert make_pipeline(work_dir).run() == []
@@ -0,0 +1,124 @@
+"""
+`src.cluster.unionfind.DiskUnionFind` against scipy connected components,
+on random edges ingested in batches.
+"""
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pytest
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from src.cluster.unionfind import DiskUnionFind
+
+NUM_ADDRESSES: int = 2000
+
+
+def random_edges(rng: np.random.Generator, num_edges: int) -> Tuple[List[str], List[str]]:
+    # skewed so that a few large clusters form next to many small ones
+    ends: np.array = (NUM_ADDRESSES * rng.random((2, num_edges)) ** 2).astype(int)
+    return [f'0x{k:040x}' for k in ends[0]], [f'0x{k:040x}' for k in ends[1]]
+
+
+def assert_same_partition(uf: DiskUnionFind, node_a: List[str], node_b: List[str]):
+    ids_a: np.array = uf.encode(node_a)
+    ids_b: np.array = uf.encode(node_b)
+    graph: coo_matrix = coo_matrix(
+        (np.ones(len(ids_a)), (ids_a, ids_b)), shape=(len(uf), len(uf)))
+    _, labels = connected_components(graph, directed=False)
+    roots: np.array = uf.roots()
+    pairs: np.array = np.unique(np.stack([roots, labels]), axis=1)
+    assert pairs.shape[1] == len(np.unique(roots)) == len(np.unique(labels))
+    # roots are members of their own set
+    assert np.array_equal(uf.roots(np.unique(roots)), np.unique(roots))
+
+
+def apply_updates(uf: DiskUnionFind, db: Dict[str, int], ids: np.array):
+    for address, root in zip(uf.index.decode(ids).tolist(), uf.roots(ids).tolist()):
+        db[address] = root
+
+
+def assert_db_current(uf: DiskUnionFind, db: Dict[str, int]):
+    assert db == dict(zip(uf.index.decode(np.arange(len(uf))).tolist(), uf.roots().tolist()))
+
+
+def test_roots_match_connected_components(tmp_path):
+    rng: np.random.Generator = np.random.default_rng(0)
+    uf: DiskUnionFind = DiskUnionFind(str(tmp_path / 'uf'), capacity = 16)
+    node_a: List[str] = []
+    node_b: List[str] = []
+    for _ in range(3):
+        batch_a, batch_b = random_edges(rng, 600)
+        uf.union_edges(batch_a, batch_b)
+        node_a.extend(batch_a)
+        node_b.extend(batch_b)
+        assert_same_partition(uf, node_a, node_b)
+
+    # reopening from disk gives the same forest
+    reopened: DiskUnionFind = DiskUnionFind(str(tmp_path / 'uf'))
+    assert len(reopened) == len(uf)
+    assert np.array_equal(reopened.roots(), uf.roots())
+    for root in np.unique(uf.roots())[:20].tolist():
+        assert sorted(reopened.members(root)) == sorted(
+            uf.index.decode(np.flatnonzero(uf.roots() == root)).tolist())
+
+
+def test_changed_ids_are_new_or_moved(tmp_path):
+    rng: np.random.Generator = np.random.default_rng(1)
+    uf: DiskUnionFind = DiskUnionFind(str(tmp_path / 'uf'))
+    db: Dict[str, int] = {}
+    for _ in range(4):
+        before: np.array = uf.roots()
+        changed: np.array = uf.union_edges(*random_edges(rng, 400))
+        after: np.array = uf.roots()
+        expected: np.array = np.concatenate([
+            np.flatnonzero(after[:len(before)] != before),
+            np.arange(len(before), len(after)),
+        ])
+        assert np.array_equal(changed, expected)
+        apply_updates(uf, db, changed)
+        assert_db_current(uf, db)
+
+    # a new address joining a large cluster moves only itself
+    big: int = int(np.bincount(uf.roots()).argmax())
+    changed: np.array = uf.union_edges([uf.get_address(big)], ['0xnew'])
+    assert changed.tolist() == [len(uf) - 1]
+
+
+def test_resume_after_partial_ingest(tmp_path, monkeypatch):
+    rng: np.random.Generator = np.random.default_rng(2)
+    save_dir: str = str(tmp_path / 'uf')
+    pending_file: str = str(tmp_path / 'pending.npy')
+    uf: DiskUnionFind = DiskUnionFind(save_dir)
+    db: Dict[str, int] = {}
+    node_a, node_b = random_edges(rng, 500)
+    apply_updates(uf, db, uf.union_edges(node_a, node_b))
+
+    batch_a, batch_b = random_edges(rng, 500)
+    calls: List[int] = []
+    union = uf.union
+
+    def failing_union(i: int, j: int, moved: List[int] = None) -> int:
+        if len(calls) == 200:
+            raise KeyboardInterrupt
+        calls.append(i)
+        return union(i, j, moved = moved)
+
+    monkeypatch.setattr(uf, 'union', failing_union)
+    with pytest.raises(KeyboardInterrupt):
+        uf.union_edges(batch_a, batch_b, pending_file = pending_file)
+    assert os.path.isfile(f'{pending_file}.ingest')
+
+    # the next run reopens the store and ingests the same edges again
+    uf: DiskUnionFind = DiskUnionFind(save_dir)
+    changed: np.array = uf.union_edges(batch_a, batch_b, pending_file = pending_file)
+    assert not os.path.isfile(f'{pending_file}.ingest')
+    assert np.array_equal(np.load(pending_file), changed)
+    assert_same_partition(uf, node_a + batch_a, node_b + batch_b)
+    apply_updates(uf, db, changed)
+    assert_db_current(uf, db)
+
+    # pending ids are returned again until the caller clears them
+    more_a, more_b = random_edges(rng, 100)
+    assert np.isin(changed, uf.union_edges(more_a, more_b, pending_file = pending_file)).all()
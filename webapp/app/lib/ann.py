@@ -0,0 +1,159 @@
+"""
+In-process nearest neighbour search over the diff2vec vectors, for
+addresses without a row in the `Embedding` table (e.g. embedded after the
+last dump) or for a different k than the dump.
+
+Everything is memory mapped from one directory written by
+scripts/diff2vec/make_ann.py, so a worker loads it once and pages are
+shared between workers:
+
+    addresses.npy     sorted address array, the id of an address is its
+                      index (plus `addresses.delta*.npy` segments)
+    vectors-int8.npy  int8 vectors, row i is node i (4x smaller than float32)
+    scale.npy         float32 per-dimension scale: vector ~ int8 * scale
+    norms.npy         float32 squared norms of the dequantised vectors
+    faiss.index       optional IVF index (see get_neighbors.py)
+
+With `faiss.index` (and faiss installed) a query probes the memory mapped
+index. Otherwise it scans the int8 vectors a block at a time, which is
+exact up to quantisation but linear in the number of vectors: past
+`max_scan` vectors a scan would blow the latency budget of a request
+(~116 ms at 1M vectors), so such an index answers no queries at all.
+"""
+import os
+import numpy as np
+from typing import Any, List, Optional, Tuple
+
+try:
+    import faiss
+except ImportError:  # int8 scan only
+    faiss = None
+
+
+class ANNIndex:
+    """
+    @ann_dir: (str) directory written by make_ann.py
+    @nprobe: (int) inverted lists visited per query with a FAISS index
+    @block_size: (int) rows per block when scanning the int8 vectors
+    @max_scan: (int) largest number of vectors searched by a scan, without
+        a FAISS index
+    """
+
+    def __init__(
+        self,
+        ann_dir: str,
+        nprobe: int = 16,
+        block_size: int = 2**16,
+        max_scan: int = 2**18,
+    ):
+        self.ann_dir: str = ann_dir
+        self.block_size: int = block_size
+        self.max_scan: int = max_scan
+
+        names: List[str] = sorted(os.listdir(ann_dir))
+        self.segments: List[np.array] = [
+            np.load(os.path.join(ann_dir, 'addresses.npy'), mmap_mode='r')] + [
+            np.load(os.path.join(ann_dir, name), mmap_mode='r') for name in names
+            if name.startswith('addresses.delta') and name.endswith('.npy')
+        ]
+        self.starts: np.array = np.concatenate(
+            [[0], np.cumsum([len(segment) for segment in self.segments])]).astype(np.int64)
+        self.width: int = self.segments[0].dtype.itemsize
+
+        self.vectors: np.array = np.load(os.path.join(ann_dir, 'vectors-int8.npy'), mmap_mode='r')
+        self.scale: np.array = np.load(os.path.join(ann_dir, 'scale.npy'))
+        self.norms: np.array = np.load(os.path.join(ann_dir, 'norms.npy'), mmap_mode='r')
+
+        self.index: Optional[Any] = None
+        index_file: str = os.path.join(ann_dir, 'faiss.index')
+        if faiss is not None and os.path.isfile(index_file):
+            self.index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP)
+            faiss.extract_index_ivf(self.index).nprobe = nprobe
+        if not self.searchable:
+            print(f'{ann_dir}: {len(self)} vectors and no FAISS index, '
+                  f'too many to scan per query; serving no neighbours.')
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def searchable(self) -> bool:
+        return self.index is not None or len(self) <= self.max_scan
+
+    def get_id(self, address: str) -> int:
+        """
+        Node id of an address, -1 if it has no vector.
+        """
+        value: bytes = address.encode()
+        if len(value) > self.width:
+            return -1
+        for segment, start in zip(self.segments, self.starts[:-1].tolist()):
+            i: int = int(np.searchsorted(segment, value))
+            if i < len(segment) and segment[i] == value:
+                node: int = start + i
+                # rows of nodes outside the vocabulary are all zero
+                return node if node < len(self.vectors) and self.norms[node] > 0 else -1
+        return -1
+
+    def get_address(self, node: int) -> str:
+        segment: int = int(np.searchsorted(self.starts, node, side='right')) - 1
+        return self.segments[segment][node - self.starts[segment]].decode()
+
+    def get_vector(self, node: int) -> np.array:
+        return self.vectors[node].astype(np.float32) * self.scale
+
+    def search(self, query: np.array, k: int) -> Tuple[np.array, np.array]:
+        """
+        Ids and squared L2 distances of the k nearest vectors to `query`.
+        """
+        query: np.array = np.asarray(query, dtype=np.float32)
+        if not self.searchable:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if self.index is not None:
+            D, I = self.index.search(query[None, :], k)
+            return I[0], D[0]
+
+        # |x - q|^2 = |x|^2 - 2 (int8 * scale) . q + |q|^2
+        scaled: np.array = query * self.scale
+        best_ids: np.array = np.zeros(0, dtype=np.int64)
+        best_dist: np.array = np.zeros(0, dtype=np.float32)
+        for start in range(0, len(self.vectors), self.block_size):
+            block: np.array = np.asarray(self.vectors[start:start + self.block_size], dtype=np.float32)
+            dist: np.array = np.asarray(self.norms[start:start + len(block)]) - 2 * (block @ scaled)
+            top: np.array = np.argpartition(dist, min(k, len(dist) - 1))[:k]
+            best_ids: np.array = np.concatenate([best_ids, top + start])
+            best_dist: np.array = np.concatenate([best_dist, dist[top]])
+            keep: np.array = np.argpartition(best_dist, min(k, len(best_dist) - 1))[:k]
+            best_ids, best_dist = best_ids[keep], best_dist[keep]
+
+        order: np.array = np.argsort(best_dist)
+        dist: np.array = np.maximum(best_dist[order] + float(query @ query), 0)
+        return best_ids[order], dist
+
+    def neighbors(self, address: str, k: int = 10) -> List[Tuple[str, float]]:
+        """
+        (address, distance) of the k nearest neighbours of an address,
+        without itself. Empty if the address has no vector.
+        """
+        node: int = self.get_id(address)
+        if node < 0 or not self.searchable:
+            return []
+        ids, distances = self.search(self.get_vector(node), k + 1)
+        return [
+            (self.get_address(i), float(distance))
+            for i, distance in zip(ids.tolist(), distances.tolist())
+            if i >= 0 and i != node
+        ][:k]
+
+
+_ann: Optional[ANNIndex] = None
+
+
+def get_ann(ann_dir: Optional[str]) -> Optional[ANNIndex]:
+    """
+    The index of this worker, loaded on first use. None if not configured.
+    """
+    global _ann
+    if _ann is None and ann_dir is not None and os.path.isdir(ann_dir):
+        _ann = ANNIndex(ann_dir)
+    return _ann
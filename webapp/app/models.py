@@ -53,16 +53,21 @@ class DepositTransaction(db.Model):
 
 
 class Embedding(db.Model):
+    """
+    Diff2Vec nearest neighbours. `id` is the node id of the address
+    (see scripts/diff2vec/compress_graph.py) and `neighbors` holds the
+    ids of other rows, aligned with `distances`.
+    """
     __tablename__: str = 'embedding'
-    id: db.Column = db.Column(db.Integer, primary_key = True)
+    id: db.Column = db.Column(db.BigInteger, primary_key = True)
     address: db.Column = db.Column(
         db.String(128),
         index = True,
         unique = True,
         nullable = False,
     )
-    neighbors: db.Column = db.Column(db.String(512), nullable = False)
-    distances: db.Column = db.Column(db.String(512), nullable = False)
+    neighbors: db.Column = db.Column(db.ARRAY(db.BigInteger), nullable = False)
+    distances: db.Column = db.Column(db.ARRAY(db.REAL), nullable = False)
 
     def __repr__(self) -> str:
         return f'<Embedding {self.address}>'
@@ -6,7 +6,8 @@ from datetime import date
 from datetime import datetime
 from typing import Dict, Any, List, Tuple, Optional, Union, Set
 from sqlalchemy import desc, cast, Float
-from app.models import Address, TornadoPool
+from app.models import Address, TornadoPool, Embedding
+from app.lib.ann import ANNIndex, get_ann
 from sqlalchemy import or_
 
 
@@ -58,6 +59,44 @@ def safe_bool(x, default=False):
         return default
 
 
+def get_embedding_neighbors(node: Embedding) -> List[Tuple[str, float]]:
+    """
+    (address, distance) of the neighbours of an embedding row, without
+    itself. Neighbours are node ids, so their addresses are fetched with
+    one primary key lookup.
+    """
+    ids: List[int] = [i for i in node.neighbors if i >= 0 and i != node.id]
+    if len(ids) == 0:
+        return []
+    rows: List[Tuple[int, str]] = Embedding.query.with_entities(
+        Embedding.id, Embedding.address).filter(Embedding.id.in_(ids)).all()
+    addresses: Dict[int, str] = dict(rows)
+    return [
+        (addresses[i], float(distance))
+        for i, distance in zip(node.neighbors, node.distances) if i in addresses
+    ]
+
+
+def get_ann_neighbors(address: str, ann_dir: Optional[str], k: int = 10) -> List[Tuple[str, float]]:
+    """
+    (address, distance) of the neighbours of an address without an
+    embedding row, from the in-process index. Empty if no index is
+    configured or the address has no vector.
+    """
+    ann: Optional[ANNIndex] = get_ann(ann_dir)
+    if ann is None:
+        return []
+    return ann.neighbors(address, k = k)
+
+
+def has_ann_vector(address: str, ann_dir: Optional[str]) -> bool:
+    """
+    Whether the in-process index can serve neighbours of an address.
+    """
+    ann: Optional[ANNIndex] = get_ann(ann_dir)
+    return ann is not None and ann.searchable and ann.get_id(address) >= 0
+
+
 def get_today_date_str():
     today = date.today()
     return today.strftime('%m/%d/%Y')
@@ -634,6 +673,8 @@ class AddressRequestChecker:
         name_key: str = 'name',
         default_page: int = 0,
         default_limit: int = 50,
+        default_k: int = 10,
+        max_k: int = 100,
     ):
         self._request: Any = request
         self._table_cols: List[str] = table_cols
@@ -642,6 +683,8 @@ class AddressRequestChecker:
         self._name_key: str = name_key
         self._default_page: int = default_page
         self._default_limit: int = default_limit
+        self._default_k: int = default_k
+        self._max_k: int = max_k
 
         self._params: Dict[str, Any] = {}
 
@@ -649,6 +692,7 @@ class AddressRequestChecker:
         return (self._check_address() and
                 self._check_page() and
                 self._check_limit() and
+                self._check_k() and
                 self._check_sort_by() and 
                 self._check_filter_by())
 
@@ -683,6 +727,15 @@ class AddressRequestChecker:
         self._params['limit'] = limit
         return True
 
+    def _check_k(self) -> bool:
+        # number of diff2vec neighbours; like limit, never blocks a request
+        default: int = self._default_k
+        k: Union[str, int] = self._request.args.get('k', default)
+        k: int = safe_int(k, default)
+        k: int = min(max(k, 1), self._max_k)
+        self._params['k'] = k
+        return True
+
     def _check_sort_by(self) -> bool:
         default: str = self._entity_key
         sort_by: str = self._request.args.get('sort', default)
@@ -6,7 +6,7 @@ import numpy as np
 import pandas as pd
 from datetime import datetime
 from dateutil.relativedelta import relativedelta 
-from typing import Dict, Optional, List, Any, Set
+from typing import Dict, Optional, List, Any, Set, Tuple
 
 from app import app, w3, ns, rds, known_addresses, tornado_pools, reveal_dists
 from app.models import \
@@ -17,6 +17,7 @@ from app.utils import \
     entity_to_int, entity_to_str, to_dict, conf_to_label, \
     heuristic_to_str, is_valid_address, get_today_date_str, \
     is_tornado_address, get_equal_user_deposit_txs, find_reveals, \
+    get_embedding_neighbors, get_ann_neighbors, has_ann_vector, \
     AddressRequestChecker, TornadoPoolRequestChecker, \
     TransactionRequestChecker, PlotRequestChecker, \
     default_address_response, default_tornado_response, \
@@ -207,37 +208,37 @@ def haveibeencompromised():
     response: str = json.dumps(output)
     return Response(response)
 
-def query_diff2vec(node: Embedding, address) -> List[Dict[str, Any]]:
+def query_diff2vec(node: Embedding, address, k: int = 10) -> List[Dict[str, Any]]:
     """
-    Search the embedding table to fetch neighbors from Diff2Vec cluster.
+    Search the embedding table to fetch the `k` nearest neighbors from
+    the Diff2Vec cluster (at most as many as the dump stored).
     """
     cluster: List[Dict[str, Any]] = []
     cluster_conf: float = 0
 
     if node is not None:
-        neighbors: List[int] = json.loads(node.neighbors)
-        distances: List[float] = json.loads(node.distances)
-
-        for neighbor, distance in zip(neighbors, distances):
-            # swap terms b/c of upload accident
-            neighbor, distance = distance, neighbor
-            if neighbor == address: continue  # skip
-            cur_conf: float = float(1./abs(10.*distance+1.))
-            member: Dict[str, Any] = {
-                'address': neighbor,
-                # '_distance': distance,
-                    # add one to make max 1
-                'conf': round(cur_conf, 3),
-                'conf_label': conf_to_label(cur_conf),
-                'heuristic': DIFF2VEC_HEUR, 
-                'entity': NODE,
-                'ens_name': get_ens_name(neighbor, ns),
-            }
-            cluster.append(member)
-            cluster_conf += member['conf']
+        neighbors: List[Tuple[str, float]] = get_embedding_neighbors(node)[:k]
+    else:
+        # embedded after the last dump of the embedding table
+        neighbors: List[Tuple[str, float]] = get_ann_neighbors(address, app.config['ANN_DIR'], k = k)
+
+    for neighbor, distance in neighbors:
+        cur_conf: float = float(1./abs(10.*distance+1.))
+        member: Dict[str, Any] = {
+            'address': neighbor,
+            # '_distance': distance,
+                # add one to make max 1
+            'conf': round(cur_conf, 3),
+            'conf_label': conf_to_label(cur_conf),
+            'heuristic': DIFF2VEC_HEUR, 
+            'entity': NODE,
+            'ens_name': get_ens_name(neighbor, ns),
+        }
+        cluster.append(member)
+        cluster_conf += member['conf']
 
     cluster_size: int = len(cluster)
-    cluster_conf: float = cluster_conf / float(cluster_size)
+    cluster_conf: float = cluster_conf / float(max(cluster_size, 1))
 
     return cluster, cluster_size, cluster_conf
 
@@ -594,7 +595,8 @@ def search_address(request: Request) -> Response:
                 raise Exception(f'Entity {entity} not supported.')
 
             # find Diff2Vec embeddings and add to front of cluster
-            diff2vec_cluster, diff2vec_size, diff2vec_conf = query_diff2vec(node, address)
+            diff2vec_cluster, diff2vec_size, diff2vec_conf = query_diff2vec(
+                node, address, k = checker.get('k'))
             cluster: List[Dict[str, Any]] = diff2vec_cluster + cluster
             cluster_size += len(diff2vec_cluster)
 
@@ -628,10 +630,11 @@ def search_address(request: Request) -> Response:
             output['data']['query']['anonymity_score'] = anon_score
 
         # --- Case #2: address is not in the DAR Address table but is 
-        #              in Embedding (Diff2Vec) table --- 
-        elif node is not None:
+        #              in Embedding (Diff2Vec) table, or has a vector in
+        #              the in-process index (see app/lib/ann.py) --- 
+        elif node is not None or has_ann_vector(address, app.config['ANN_DIR']):
             # find Diff2Vec embeddings and add to front of cluster
-            cluster, cluster_size, conf = query_diff2vec(node, address)
+            cluster, cluster_size, conf = query_diff2vec(node, address, k = checker.get('k'))
 
             anon_score = compute_anonymity_score(
                 None,
@@ -939,7 +942,7 @@ def search_transaction():
     addr: Optional[Address] = Address.query.filter_by(address = address).first()
     node: Optional[Embedding] = Embedding.query.filter_by(address = address).first()
 
-    if addr is not None or node is not None: 
+    if addr is not None or node is not None or has_ann_vector(address, app.config['ANN_DIR']): 
         _, diff2vec_size, diff2vec_conf = query_diff2vec(node, address)
         tornado_dict: Dict[str, Any] = query_tornado_stats(address)
         anon_score = compute_anonymity_score(
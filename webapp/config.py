@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
@@ -21,3 +22,5 @@ class Config(object):
     MAX_SHOW: int = 25
     SQLALCHEMY_DATABASE_URI: str = get_database_uri(env = 'development')
     SQLALCHEMY_TRACK_MODIFICATIONS: bool = False
+    # directory from scripts/diff2vec/make_ann.py, see app/lib/ann.py
+    ANN_DIR: Optional[str] = os.environ.get('ANN_DIR')
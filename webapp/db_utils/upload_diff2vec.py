@@ -1,9 +1,11 @@
 """
-For large amounts of data, it is too slow to use FlaskSQL. 
-Try to upload directly using psycopg2 a large CSV file!
+For large amounts of data, it is too slow to use FlaskSQL.
+Upload directly with psycopg2 using binary COPY: the file written by
+`scripts/diff2vec/dump_neighbors.py` is already in the on-disk format
+of the `embedding` columns, so Postgres parses no text.
 
-Make sure to run `combine_metadata.py` and `prune_metadata.py`
-before running this.
+The table must have the current schema (`neighbors bigint[]`,
+`distances real[]`, see app/models.py).
 """
 
 import os
@@ -12,21 +14,28 @@ from typing import Any
 
 
 def main(args: Any):
-    csv_path: str = os.path.realpath(args.metadata_csv)
+    pgcopy_path: str = os.path.realpath(args.pgcopy_file)
 
     conn = psycopg2.connect(database = 'tornado', user = 'postgres')
     cursor = conn.cursor()
 
+    if args.drop_index:
+        # building the index once after the load is faster than updating it per row
+        cursor.execute("DROP INDEX IF EXISTS ix_embedding_address;")
     cursor.execute(
-        f"COPY embedding(address, neighbors, distances) FROM '{csv_path}' DELIMITER ',' CSV HEADER;"
+        f"COPY embedding(id, address, neighbors, distances) FROM '{pgcopy_path}' WITH (FORMAT binary);"
     )
+    if args.drop_index:
+        cursor.execute("CREATE UNIQUE INDEX ix_embedding_address ON embedding (address);")
     conn.commit()
 
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument('metadata_csv', type=str)
+    parser.add_argument('pgcopy_file', type=str)
+    parser.add_argument('--drop-index', action='store_true', default=False,
+                        help='drop the address index during the load and rebuild it after')
     args = parser.parse_args()
 
     main(args)
@@ -3,12 +3,13 @@ Test how well deposit address reuse is doing by computing recall
 of a fixed set of ENS clusters.
 """
 
-import os, json
+import os
 import pandas as pd
 from tqdm import tqdm
 from typing import Any, Set, List, Optional
 
 from app.models import Address, Embedding
+from app.utils import get_embedding_neighbors
 
 
 class TestENSClusters:
@@ -65,9 +66,9 @@ class TestENSClusters:
         node: Optional[Embedding] = \
             Embedding.query.filter_by(address = address).first()
         if node is not None:
-            # I mapped neighbors -> distances so this is actually loading neighbors
-            cluster: List[str] = json.loads(node.distances)
-            cluster: Set[str] = set(cluster)
+            cluster: Set[str] = {address}
+            cluster: Set[str] = cluster.union(
+                [neighbor for neighbor, _ in get_embedding_neighbors(node)])
         else:
             cluster: Set[str] = {address}
         return cluster